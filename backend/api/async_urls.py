@@ -0,0 +1,34 @@
+from django.urls import re_path
+
+from api.async_views import (
+    ingredient_list_fast_path,
+    read_view,
+    recipe_fast_path,
+    reference_fast_path
+)
+from api.urls import router
+
+FAST_PATHS = {
+    'tag-list': reference_fast_path('tag'),
+    'tag-detail': reference_fast_path('tag'),
+    'ingredient-list': ingredient_list_fast_path,
+    'ingredient-detail': reference_fast_path('ingredient'),
+    'recipe-list': recipe_fast_path,
+    'recipe-detail': recipe_fast_path,
+}
+
+# Роутер принимает в id любой сегмент, и асинхронный адрес рецепта
+# перехватил бы действия списка (download_shopping_cart, feed,
+# by-ingredients) у синхронных адресов, которые идут следом.
+ROUTER_LOOKUP = '[^/.]+'
+NUMERIC_LOOKUP = r'\d+'
+
+# Те же адреса, что у роутера, но с асинхронными представлениями.
+urlpatterns = [
+    re_path(
+        str(url.pattern).replace(ROUTER_LOOKUP, NUMERIC_LOOKUP),
+        read_view(url.callback, FAST_PATHS[url.name])
+    )
+    for url in router.urls
+    if url.name in FAST_PATHS
+]
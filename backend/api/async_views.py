@@ -0,0 +1,141 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.http import HttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+
+from rest_framework import status
+
+from api.cache import (
+    RESPONSE_KEY,
+    get_cached_recipe_data,
+    get_recipe_cache_key,
+    get_versioned_etag,
+    has_recipe_search
+)
+from api.renderers import TimedJSONRenderer
+from api.serializers import IngredientSerializer
+from recipes.search import ingredient_index
+
+JSON_MEDIA_TYPES = ('*/*', 'application/*', 'application/json')
+
+
+def accepts_json(request):
+    """ Клиент принимает JSON и не просит страницу browsable API. """
+    if 'format' in request.GET:
+        return False
+    accept = request.META.get('HTTP_ACCEPT') or '*/*'
+    return all(
+        media_type.split(';')[0].strip() in JSON_MEDIA_TYPES
+        for media_type in accept.split(',')
+    )
+
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    """ Тот же ответ, что отдал бы TimedJSONRenderer во вьюсете. """
+    response = HttpResponse(
+        TimedJSONRenderer().render(data),
+        content_type='application/json',
+        status=status_code
+    )
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+def reference_fast_path(name):
+    """ Ответ VersionedCacheMixin из кэша: 304 или сохраненные данные. """
+    def fast_path(request, **kwargs):
+        etag = get_versioned_etag(name, request.get_full_path())
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            data = cache.get(RESPONSE_KEY.format(etag))
+            if data is None:
+                return None
+            response = json_response(data)
+        response['ETag'] = etag
+        patch_cache_control(
+            response, public=True, max_age=settings.REFERENCE_CACHE_MAX_AGE
+        )
+        return response
+    return fast_path
+
+
+def ingredient_list_fast_path(request, **kwargs):
+    """ Автодополнение из уже построенного индекса ингредиентов. """
+    name = request.GET.get('name')
+    if name is None:
+        return reference_fast_path('ingredient')(request, **kwargs)
+    if settings.INGREDIENT_SEARCH_BACKEND != 'memory':
+        return None
+    ingredients = ingredient_index.search(
+        name, settings.INGREDIENT_SEARCH_LIMIT, load=False
+    )
+    if ingredients is None:
+        return None
+    return json_response(IngredientSerializer(ingredients, many=True).data)
+
+
+def recipe_fast_path(request, pk=None, **kwargs):
+    """ Рецепт или лента из кэша AnonymousRecipeCacheMixin.
+
+    С заголовком Authorization пользователя нужно искать по токену
+    в БД, такие запросы идут в синхронное представление, как и
+    поиск, который не кэшируется.
+    """
+    if ('HTTP_AUTHORIZATION' in request.META
+            or has_recipe_search(request.GET)):
+        return None
+    if pk is not None and not pk.isdigit():
+        return None
+    key = get_recipe_cache_key(pk, request.GET.lists())
+    data = get_cached_recipe_data(key)
+    if data is None:
+        return None
+    response = json_response(data)
+    response['X-Cache'] = 'HIT'
+    return response
+
+
+def call_view(view, request, *args, **kwargs):
+    """ Выполняет представление в потоке пула и рендерит ответ.
+
+    Соединения с БД в потоках пула не закрываются сигналами
+    запроса, поэтому устаревшие закрываются здесь.
+    """
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if callable(getattr(response, 'render', None)):
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+def read_view(view, fast_path):
+    """ Асинхронная обертка синхронного представления DRF.
+
+    GET, на который fast_path отвечает из кэша или памяти процесса,
+    обрабатывается в цикле событий без потоков. Остальные чтения
+    выполняются одним переходом в пул потоков, где DRF сам проводит
+    аутентификацию, проверку прав и запросы к БД. Изменяющие запросы
+    идут в общий синхронный поток, как обычные представления.
+    """
+    async def async_view(request, *args, **kwargs):
+        if (request.method == 'GET' and 'format' not in kwargs
+                and accepts_json(request)):
+            response = fast_path(request, *args, **kwargs)
+            if response is not None:
+                return response
+        if (request.method in ('GET', 'HEAD', 'OPTIONS')
+                and settings.ASYNC_READ_THREAD_POOL):
+            return await sync_to_async(call_view, thread_sensitive=False)(
+                view, request, *args, **kwargs
+            )
+        return await sync_to_async(view)(request, *args, **kwargs)
+
+    async_view.csrf_exempt = True
+    return async_view
@@ -0,0 +1,64 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from api.cache import count_cache
+from api.timing import phase
+from users.models import User
+
+TOKEN_KEY = 'api:token:{}'
+
+
+def get_token_cache_key(key):
+    """ Ключ кэша токена, сам токен в ключ не попадает. """
+    return TOKEN_KEY.format(hashlib.sha256(key.encode()).hexdigest())
+
+
+def invalidate_tokens_on_commit(keys):
+    """ Удаляет токены из кэша после коммита текущей транзакции. """
+    cache_keys = [get_token_cache_key(key) for key in keys]
+    if cache_keys:
+        transaction.on_commit(lambda: cache.delete_many(cache_keys))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """ TokenAuthentication, который хранит токен с пользователем в кэше.
+
+    Кэш общий для процессов, поэтому сигналы сбрасывают запись при
+    удалении токена (выход через djoser) и при сохранении пользователя,
+    в том числе смене пароля и деактивации. Счетчики пользователя
+    меняются через F()-выражения без сигналов, поэтому они отложены
+    и при обращении читаются из БД.
+    """
+
+    def authenticate(self, request):
+        with phase('auth'):
+            return super().authenticate(request)
+
+    def authenticate_credentials(self, key):
+        cache_key = get_token_cache_key(key)
+        token = cache.get(cache_key)
+        if token is None:
+            count_cache('token', 'misses')
+            model = self.get_model()
+            try:
+                token = model.objects.select_related('user').defer(
+                    *(f'user__{field}' for field in User.counter_fields)
+                ).get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed(_('Invalid token.'))
+            cache.set(cache_key, token, settings.TOKEN_CACHE_TIMEOUT)
+        else:
+            count_cache('token', 'hits')
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        return token.user, token
@@ -0,0 +1,393 @@
+import base64
+import io
+import json
+import os
+import statistics
+import tempfile
+import time
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.authtoken.models import Token
+
+from PIL import Image
+
+from api.authentication import CachedTokenAuthentication
+from recipes.cache import VERSION_KEY
+from recipes.management.commands.seed_benchmark_data import (
+    PASSWORD,
+    USERNAME_PREFIX
+)
+from recipes.models import (
+    Favorite,
+    IngredientRecipe,
+    Recipe,
+    ShoppingCart,
+    Subscription,
+    Tag
+)
+from users.models import User
+
+BASELINE_PATH = os.path.join(
+    os.path.dirname(__file__), 'benchmark_baseline.json'
+)
+# Запас к базовой задержке, чтобы не падать на шуме быстрых адресов.
+LATENCY_SLACK_MS = 5
+VERSION_KEYS = [
+    VERSION_KEY.format(name) for name in ('tag', 'ingredient', 'recipe')
+]
+BENCHMARK_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark',
+    }
+}
+
+Endpoint = namedtuple(
+    'Endpoint', ('name', 'method', 'url', 'auth', 'data', 'status'),
+    defaults=(False, None, 200)
+)
+Result = namedtuple(
+    'Result', ('name', 'status', 'queries', 'sql_ms', 'serialization_ms',
+               'total_ms')
+)
+
+
+def make_image():
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), 'red').save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+def recipe_payload(context):
+    return {
+        'tags': [context['tag']],
+        'ingredients': [
+            {'id': ingredient_id, 'amount': 10}
+            for ingredient_id in context['ingredients']
+        ],
+        'name': 'Рецепт для замера',
+        'image': make_image(),
+        'text': 'Описание',
+        'cooking_time': 10,
+    }
+
+
+ENDPOINTS = (
+    Endpoint('api-root', 'get', '/api/'),
+    Endpoint('tag-list', 'get', '/api/tags/'),
+    Endpoint('tag-detail', 'get', '/api/tags/{tag}/'),
+    Endpoint('ingredient-list', 'get', '/api/ingredients/'),
+    Endpoint(
+        'ingredient-search', 'get', '/api/ingredients/?name={ingredient_name}'
+    ),
+    Endpoint('ingredient-detail', 'get', '/api/ingredients/{ingredient}/'),
+    Endpoint('recipe-list', 'get', '/api/recipes/'),
+    Endpoint('recipe-list-auth', 'get', '/api/recipes/', auth=True),
+    Endpoint(
+        'recipe-list-filtered', 'get',
+        '/api/recipes/?is_favorited=1&tags={tag_slug}',
+        auth=True
+    ),
+    Endpoint(
+        'recipe-list-author', 'get', '/api/recipes/?author={author}'
+    ),
+    Endpoint(
+        'recipe-list-cursor', 'get', '/api/recipes/?pagination=cursor',
+        auth=True
+    ),
+    Endpoint('recipe-search', 'get', '/api/recipes/?search={search}'),
+    Endpoint('recipe-trending', 'get', '/api/recipes/?ordering=trending'),
+    Endpoint('recipe-detail', 'get', '/api/recipes/{recipe}/'),
+    Endpoint('recipe-detail-auth', 'get', '/api/recipes/{recipe}/', auth=True),
+    Endpoint('recipe-similar', 'get', '/api/recipes/{recipe}/similar/'),
+    Endpoint(
+        'recipe-by-ingredients', 'get',
+        '/api/recipes/by-ingredients/?ids={ingredient_ids}'
+    ),
+    Endpoint('recipe-feed', 'get', '/api/recipes/feed/', auth=True),
+    Endpoint(
+        'recipe-create', 'post', '/api/recipes/', auth=True,
+        data=recipe_payload, status=201
+    ),
+    Endpoint(
+        'recipe-update', 'patch', '/api/recipes/{own_recipe}/', auth=True,
+        data=recipe_payload
+    ),
+    Endpoint(
+        'recipe-delete', 'delete', '/api/recipes/{own_recipe}/', auth=True,
+        status=204
+    ),
+    Endpoint(
+        'recipe-favorite-add', 'post', '/api/recipes/{new_recipe}/favorite/',
+        auth=True, status=201
+    ),
+    Endpoint(
+        'recipe-favorite-remove', 'delete',
+        '/api/recipes/{favorite}/favorite/', auth=True, status=204
+    ),
+    Endpoint(
+        'recipe-cart-add', 'post', '/api/recipes/{new_recipe}/shopping_cart/',
+        auth=True, status=201
+    ),
+    Endpoint(
+        'recipe-cart-remove', 'delete', '/api/recipes/{cart}/shopping_cart/',
+        auth=True, status=204
+    ),
+    Endpoint(
+        'recipe-download-shopping-cart', 'get',
+        '/api/recipes/download_shopping_cart/', auth=True
+    ),
+    Endpoint(
+        'recipe-download-shopping-cart-csv', 'get',
+        '/api/recipes/download_shopping_cart/?format=csv', auth=True
+    ),
+    Endpoint('users-list', 'get', '/api/users/', auth=True),
+    Endpoint('users-detail', 'get', '/api/users/{author}/', auth=True),
+    Endpoint('users-me', 'get', '/api/users/me/', auth=True),
+    Endpoint(
+        'users-subscriptions', 'get', '/api/users/subscriptions/', auth=True
+    ),
+    Endpoint(
+        'users-subscriptions-limit', 'get',
+        '/api/users/subscriptions/?recipes_limit=3', auth=True
+    ),
+    Endpoint(
+        'users-subscribe', 'post', '/api/users/{new_author}/subscribe/',
+        auth=True, status=201
+    ),
+    Endpoint(
+        'users-unsubscribe', 'delete', '/api/users/{subscribed}/subscribe/',
+        auth=True, status=204
+    ),
+    Endpoint(
+        'users-create', 'post', '/api/users/', status=201,
+        data=lambda context: {
+            'email': 'benchmark-new@example.com',
+            'username': 'benchmark-new',
+            'first_name': 'Имя',
+            'last_name': 'Фамилия',
+            'password': 'Benchmark-password-1',
+        }
+    ),
+    Endpoint(
+        'users-set-password', 'post', '/api/users/set_password/', auth=True,
+        status=204, data=lambda context: {
+            'current_password': PASSWORD,
+            'new_password': 'Benchmark-password-2',
+        }
+    ),
+    Endpoint(
+        'token-login', 'post', '/api/auth/token/login/',
+        data=lambda context: {
+            'email': context['email'], 'password': PASSWORD
+        }
+    ),
+    Endpoint(
+        'token-logout', 'post', '/api/auth/token/logout/', auth=True,
+        status=204
+    ),
+)
+
+
+def get_context():
+    """ Объекты для адресов замеров из данных seed_benchmark_data.
+
+    Пользователь замеров - автор с подписками, избранным и корзиной.
+    Возвращает None, если такого пользователя нет.
+    """
+    user = User.objects.filter(
+        username__startswith=USERNAME_PREFIX, recipes_count__gt=0,
+        subscriptions_count__gt=0,
+    ).filter(
+        Exists(Favorite.objects.filter(user=OuterRef('pk'))),
+        Exists(ShoppingCart.objects.filter(user=OuterRef('pk'))),
+    ).order_by('-subscriptions_count', 'id').first()
+    if user is None:
+        return None
+    recipe = Recipe.objects.order_by('-favorites_count', 'id').first()
+    ingredient_ids = list(IngredientRecipe.objects.filter(
+        recipe=recipe
+    ).order_by('id').values_list('ingredient_id', flat=True))
+    ingredient_name = IngredientRecipe.objects.filter(
+        recipe=recipe
+    ).values_list('ingredient__name', flat=True).order_by('id').first()
+    tag = Tag.objects.filter(recipes=recipe).order_by('id').first()
+    subscribed = Subscription.objects.filter(
+        user=user
+    ).order_by('id').values_list('author_id', flat=True)
+    return {
+        'email': user.email,
+        'token': Token.objects.get_or_create(user=user)[0].key,
+        'recipe': recipe.id,
+        'search': recipe.name.split()[0],
+        'tag': tag.id,
+        'tag_slug': tag.slug,
+        'ingredient': ingredient_ids[0],
+        'ingredients': ingredient_ids,
+        'ingredient_ids': ','.join(map(str, ingredient_ids)),
+        'ingredient_name': ingredient_name[:3],
+        'author': recipe.author_id,
+        'own_recipe': Recipe.objects.filter(
+            author=user
+        ).order_by('id').values_list('id', flat=True).first(),
+        'new_recipe': Recipe.objects.exclude(
+            favorites__user=user
+        ).exclude(cart__user=user).order_by(
+            '-favorites_count', 'id'
+        ).values_list('id', flat=True).first(),
+        'favorite': Favorite.objects.filter(
+            user=user
+        ).order_by('id').values_list('recipe_id', flat=True).first(),
+        'cart': ShoppingCart.objects.filter(
+            user=user
+        ).order_by('id').values_list('recipe_id', flat=True).first(),
+        'subscribed': subscribed.first(),
+        'new_author': User.objects.exclude(pk=user.pk).exclude(
+            pk__in=subscribed
+        ).order_by('-recipes_count', 'id').values_list(
+            'id', flat=True
+        ).first(),
+    }
+
+
+def parse_server_timing(header):
+    """ Длительности из заголовка Server-Timing в секундах. """
+    metrics = {}
+    for metric in header.split(','):
+        name, *params = metric.strip().split(';')
+        for param in params:
+            key, _, value = param.partition('=')
+            if key == 'dur':
+                metrics[name] = float(value) / 1000
+    return metrics
+
+
+def measure(client, endpoint, context):
+    """ Один запрос в транзакции, которая затем откатывается. """
+    headers = {}
+    if endpoint.auth:
+        headers['HTTP_AUTHORIZATION'] = f'Token {context["token"]}'
+    body = json.dumps(endpoint.data(context)) if endpoint.data else ''
+    # Версии данных переживают очистку: ими помечены индексы
+    # в памяти процесса, которые в устойчивом режиме уже построены.
+    versions = cache.get_many(VERSION_KEYS)
+    cache.clear()
+    cache.set_many(versions, timeout=None)
+    if endpoint.auth:
+        # Как в устойчивом режиме: токен уже в кэше аутентификации.
+        CachedTokenAuthentication().authenticate_credentials(
+            context['token']
+        )
+    with transaction.atomic():
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.generic(
+                endpoint.method.upper(), endpoint.url.format(**context),
+                body, content_type='application/json', **headers
+            )
+            if response.streaming:
+                b''.join(response.streaming_content)
+            total = time.perf_counter() - started
+        transaction.set_rollback(True)
+    metrics = parse_server_timing(response['Server-Timing'])
+    return (
+        response.status_code,
+        len(queries),
+        metrics['db'],
+        metrics['serialize'],
+        total,
+    )
+
+
+def run_suite(context, repeat=5, names=None):
+    """ Замеряет адреса API, каждый repeat раз после прогрева.
+
+    Кэш ответов очищается перед каждым запросом, индексы в памяти
+    процесса и токен в кэше аутентификации остаются прогретыми.
+    Для запроса берется наибольшее число запросов к БД и медианы
+    времени.
+    """
+    client = Client()
+    results = []
+    with tempfile.TemporaryDirectory() as media_root, override_settings(
+        CACHES=BENCHMARK_CACHES, MEDIA_ROOT=media_root,
+        SERVER_TIMING_HEADER=True
+    ):
+        for endpoint in ENDPOINTS:
+            if names and endpoint.name not in names:
+                continue
+            measure(client, endpoint, context)
+            samples = [
+                measure(client, endpoint, context) for _ in range(repeat)
+            ]
+            statuses, queries, sql, serialization, total = zip(*samples)
+            results.append(Result(
+                endpoint.name,
+                statuses[-1] if len(set(statuses)) == 1 else statuses,
+                max(queries),
+                statistics.median(sql) * 1000,
+                statistics.median(serialization) * 1000,
+                statistics.median(total) * 1000,
+            ))
+    return results
+
+
+def load_baseline(path=BASELINE_PATH):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def get_budgets(results):
+    """ Бюджеты по результатам замеров для benchmark_baseline.json. """
+    return {
+        result.name: {
+            'queries': result.queries,
+            'latency_ms': round(result.total_ms, 1),
+        }
+        for result in results
+    }
+
+
+def save_baseline(baseline, path=BASELINE_PATH):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(baseline, file, indent=4)
+        file.write('\n')
+
+
+def check_results(results, baseline, tolerance=None):
+    """ Нарушения бюджета: статус, число запросов и задержка.
+
+    Задержка проверяется, только если задан tolerance - во сколько
+    раз она может превысить сохраненную (плюс LATENCY_SLACK_MS).
+    """
+    expected_statuses = {
+        endpoint.name: endpoint.status for endpoint in ENDPOINTS
+    }
+    errors = []
+    for result in results:
+        budget = baseline.get(result.name)
+        if result.status != expected_statuses[result.name]:
+            errors.append(f'{result.name}: статус {result.status}')
+        if budget is None:
+            errors.append(f'{result.name}: нет бюджета')
+            continue
+        if result.queries > budget['queries']:
+            errors.append(
+                f'{result.name}: {result.queries} запросов к БД, '
+                f'бюджет {budget["queries"]}'
+            )
+        if tolerance is not None and result.total_ms > (
+                budget['latency_ms'] * tolerance + LATENCY_SLACK_MS):
+            errors.append(
+                f'{result.name}: {result.total_ms:.1f} мс, '
+                f'базовое {budget["latency_ms"]} мс'
+            )
+    return errors
@@ -0,0 +1,221 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from recipes.cache import get_cache_version
+from recipes.models import Tag
+
+RESPONSE_KEY = 'api:response:{}'
+RECIPE_RESPONSE_KEY = 'api:recipe_response:{}'
+CACHE_STATS_KEY = 'api:{}_cache:{}'
+TAG_SLUGS_KEY = 'api:tag_slugs:{}'
+# Параметры, от которых зависит ответ с рецептами: фильтры RecipeFilter
+# и пагинация. Остальные не попадают в ключ кэша.
+RECIPE_QUERY_PARAMS = frozenset((
+    'author', 'tags', 'tags_match', 'is_favorited', 'is_in_shopping_cart',
+    'search', 'ordering', 'page', 'limit', 'cursor', 'pagination',
+))
+# Параметры со списком значений, порядок и повторы в них не важны.
+RECIPE_LIST_PARAMS = frozenset(('author', 'tags'))
+
+
+def get_tag_ids_by_slug():
+    """ Словарь slug -> id тегов, кэшируется до изменения тегов. """
+    key = TAG_SLUGS_KEY.format(get_cache_version('tag'))
+    tag_ids = cache.get(key)
+    if tag_ids is None:
+        tag_ids = dict(Tag.objects.values_list('slug', 'id'))
+        cache.set(key, tag_ids, settings.REFERENCE_CACHE_TIMEOUT)
+    return tag_ids
+
+
+def get_versioned_etag(name, full_path):
+    """ Строгий ETag ответа по версии данных name и пути запроса. """
+    version = get_cache_version(name)
+    path = hashlib.md5(full_path.encode()).hexdigest()
+    return f'"{name}-{version}-{path}"'
+
+
+def normalize_recipe_params(params):
+    """ Известные параметры запроса рецептов в каноническом виде.
+
+    params - пары (параметр, список значений) из строки запроса.
+    У остальных параметров, как и в QueryDict.get, берется
+    последнее значение, пробелы по краям поиска не важны.
+    """
+    normalized = []
+    for key, values in params:
+        if key not in RECIPE_QUERY_PARAMS:
+            continue
+        if key in RECIPE_LIST_PARAMS:
+            values = sorted(set(values))
+        elif key == 'search':
+            values = [values[-1].strip()]
+        else:
+            values = values[-1:]
+        normalized.append((key, values))
+    return sorted(normalized)
+
+
+def has_recipe_search(query_params):
+    """ Есть ли в запросе рецептов непустой поиск.
+
+    Строка поиска произвольна, такие ответы не кэшируются,
+    чтобы случайные запросы не вытесняли из кэша ленты.
+    """
+    return bool(query_params.get('search', '').strip())
+
+
+def get_recipe_cache_key(pk, params):
+    """ Ключ кэша рецепта (pk) или ленты рецептов (pk is None).
+
+    params - пары (параметр, список значений) из строки запроса,
+    неизвестные параметры отбрасываются.
+    """
+    params = normalize_recipe_params(params)
+    recipe_version = 'recipe' if pk is None else f'recipe:{pk}'
+    versions = [
+        get_cache_version(name)
+        for name in (recipe_version, 'tag', 'ingredient')
+    ]
+    raw = json.dumps([pk, params, versions])
+    return RECIPE_RESPONSE_KEY.format(hashlib.md5(raw.encode()).hexdigest())
+
+
+def get_cached_recipe_data(key):
+    """ Данные из кэша рецептов или None, попадание учитывается. """
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    author_version, data = entry
+    if (author_version is not None and author_version
+            != get_cache_version(f'user:{data["author"]["id"]}')):
+        return None
+    count_cache('recipe', 'hits')
+    return data
+
+
+def count_cache(name, result):
+    """ Считает попадания (hits) и промахи (misses) кэша name. """
+    key = CACHE_STATS_KEY.format(name, result)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+
+
+def get_cache_stats(name):
+    """ Счетчики попаданий и промахов кэша name. """
+    return {
+        result: cache.get(CACHE_STATS_KEY.format(name, result), 0)
+        for result in ('hits', 'misses')
+    }
+
+
+class VersionedCacheMixin:
+    """ Кэширует list и retrieve по версии данных модели.
+
+    Ответ отдается со строгим ETag, при совпадении If-None-Match
+    возвращается 304 без обращения к БД. Версию увеличивают
+    сигналы при изменении модели.
+    """
+    cache_version_name = None
+
+    def perform_authentication(self, request):
+        # Пользователь нужен только небезопасным запросам,
+        # аутентификация выполнится при первом обращении к request.user.
+        pass
+
+    def get_etag(self, request):
+        return get_versioned_etag(
+            self.cache_version_name, request.get_full_path()
+        )
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            key = RESPONSE_KEY.format(etag)
+            data = cache.get(key)
+            if data is None:
+                response = handler(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(
+                    key, response.data, settings.REFERENCE_CACHE_TIMEOUT
+                )
+            else:
+                response = Response(data)
+        response['ETag'] = etag
+        patch_cache_control(
+            response, public=True, max_age=settings.REFERENCE_CACHE_MAX_AGE
+        )
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+
+class AnonymousRecipeCacheMixin:
+    """ Кэширует list и retrieve рецептов для анонимных пользователей.
+
+    Ключ строится из нормализованных параметров запроса и версий:
+    ленты рецептов (или одного рецепта), тегов и ингредиентов.
+    Для рецепта дополнительно проверяется версия его автора.
+    Запрос с посторонними параметрами читает тот же ключ, но ответ
+    не сохраняет: иначе случайные параметры заполняли бы кэш,
+    а ссылки next и previous в нем содержали бы чужие параметры.
+    Запросы с поиском кэш не читают и не пополняют.
+    """
+
+    def cached_recipe_response(self, handler, request, *args, **kwargs):
+        pk = self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        if (not request.user.is_anonymous
+                or (pk is not None and not str(pk).isdigit())
+                or has_recipe_search(request.query_params)):
+            return handler(request, *args, **kwargs)
+        key = get_recipe_cache_key(pk, request.query_params.lists())
+        data = get_cached_recipe_data(key)
+        if data is not None:
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+        count_cache('recipe', 'misses')
+        response = handler(request, *args, **kwargs)
+        if (response.status_code == status.HTTP_200_OK
+                and RECIPE_QUERY_PARAMS.issuperset(request.query_params)):
+            author_version = None
+            if pk is not None:
+                author_version = get_cache_version(
+                    f'user:{response.data["author"]["id"]}'
+                )
+            cache.set(
+                key,
+                (author_version, response.data),
+                settings.RECIPE_CACHE_TIMEOUT
+            )
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_recipe_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_recipe_response(
+            super().retrieve, request, *args, **kwargs
+        )
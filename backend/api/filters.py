@@ -1,21 +1,35 @@
+from django.db.models import Exists, F, OuterRef
 from django_filters import rest_framework as filters
 
-from recipes.models import Recipe, Tag
-from users.models import User
+from api.cache import get_tag_ids_by_slug
+from recipes.models import Recipe, RecipeTag
+from recipes.search import search_recipes
+
+TAGS_MATCH_ANY = 'any'
+TAGS_MATCH_ALL = 'all'
+RANK_ORDERINGS = ('trending', 'popular')
 
 
 class RecipeFilter(filters.FilterSet):
-    """Фильтрует выборку рецептов по полям."""
+    """Фильтрует выборку рецептов по полям.
+
+    Теги и авторы фильтруются без JOIN: авторы по author_id,
+    теги через EXISTS по таблице связи, поэтому рецепты
+    не дублируются и distinct() не нужен.
+    """
 
-    author = filters.ModelMultipleChoiceFilter(
-        field_name='author__id',
-        to_field_name='id',
-        queryset=User.objects.all()
+    author = filters.CharFilter(
+        method='get_author'
+    )
+    tags = filters.CharFilter(
+        method='get_tags'
     )
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all()
+    tags_match = filters.ChoiceFilter(
+        choices=(
+            (TAGS_MATCH_ANY, 'Любой из тегов'),
+            (TAGS_MATCH_ALL, 'Все теги'),
+        ),
+        method='get_tags_match'
     )
     is_favorited = filters.BooleanFilter(
         method='get_is_favorited'
@@ -23,22 +37,85 @@ class RecipeFilter(filters.FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart'
     )
+    search = filters.CharFilter(
+        method='get_search'
+    )
+    ordering = filters.ChoiceFilter(
+        choices=(
+            ('trending', 'Набирают популярность'),
+            ('popular', 'Популярные'),
+        ),
+        method='get_ordering'
+    )
 
     class Meta:
         model = Recipe
         fields = (
             'author',
             'tags',
+            'tags_match',
             'is_favorited',
             'is_in_shopping_cart',
+            'search',
+            'ordering',
         )
 
+    def get_author(self, queryset, name, value):
+        author_ids = [
+            author_id for author_id in self.data.getlist(name)
+            if author_id.isdigit()
+        ]
+        return queryset.filter(author_id__in=author_ids)
+
+    def get_tags(self, queryset, name, value):
+        """Рецепты с любым (tags_match=any) или всеми (all) тегами."""
+        tag_ids_by_slug = get_tag_ids_by_slug()
+        slugs = set(self.data.getlist(name))
+        tag_ids = [
+            tag_ids_by_slug[slug] for slug in slugs
+            if slug in tag_ids_by_slug
+        ]
+        if self.form.cleaned_data.get('tags_match') == TAGS_MATCH_ALL:
+            if len(tag_ids) < len(slugs):
+                return queryset.none()
+            for tag_id in tag_ids:
+                queryset = queryset.filter(Exists(RecipeTag.objects.filter(
+                    recipe=OuterRef('pk'), tag_id=tag_id
+                )))
+            return queryset
+        return queryset.filter(Exists(RecipeTag.objects.filter(
+            recipe=OuterRef('pk'), tag_id__in=tag_ids
+        )))
+
+    def get_tags_match(self, queryset, name, value):
+        # Режим учитывается в get_tags.
+        return queryset
+
     def get_is_favorited(self, queryset, name, value):
         if value:
-            return queryset.filter(favorites__user=self.request.user)
+            return queryset.filter(is_favorited=True)
         return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
         if value:
-            return queryset.filter(cart__user=self.request.user)
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
+
+    def get_search(self, queryset, name, value):
+        """Полнотекстовый поиск, результаты упорядочены по рангу."""
+        value = value.strip()
+        if not value:
+            return queryset
+        return search_recipes(queryset, value)
+
+    def get_ordering(self, queryset, name, value):
+        """Сортировка по рейтингу из RecipeScore, поле rank для курсора.
+
+        Строка рейтинга есть у каждого рецепта (сигнал при создании,
+        create_missing_scores после migrate и в update_scores),
+        поэтому соединение внутреннее и страницы идут по индексу
+        рейтинга, как лента по pub_date.
+        """
+        return queryset.filter(score__isnull=False).annotate(
+            rank=F(f'score__{value}')
+        ).order_by('-rank', '-id')
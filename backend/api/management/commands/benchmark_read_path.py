@@ -0,0 +1,97 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+DEFAULT_PATHS = (
+    '/api/recipes/',
+    '/api/recipes/{recipe_id}/',
+    '/api/tags/',
+    '/api/ingredients/?name=са',
+)
+
+
+class Command(BaseCommand):
+    """
+    Сравнивает серверы под конкурентной нагрузкой на горячих
+    адресах чтения, например WSGI с синхронными воркерами и ASGI
+    с воркерами uvicorn:
+    python manage.py benchmark_read_path \\
+        --target wsgi=http://localhost:7000 \\
+        --target asgi=http://localhost:7001
+    Для каждого сервера выводятся запросы в секунду, p50 и p99
+    задержки и число ошибок.
+    """
+    help = 'Нагрузочное сравнение WSGI и ASGI на адресах чтения'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--target', action='append', required=True,
+            help='Сервер в виде имя=адрес, можно указать несколько'
+        )
+        parser.add_argument(
+            '--path', action='append',
+            help='Адрес для запросов, по умолчанию рецепты, теги '
+                 'и поиск ингредиентов'
+        )
+        parser.add_argument('--recipe-id', type=int, default=1)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument(
+            '--token', help='Токен, чтобы мерить чтение пользователем'
+        )
+
+    def run(self, base_url, paths, options):
+        local = threading.local()
+        headers = {'Accept': 'application/json'}
+        if options['token']:
+            headers['Authorization'] = f'Token {options["token"]}'
+
+        def fetch(number):
+            session = getattr(local, 'session', None)
+            if session is None:
+                session = local.session = requests.Session()
+            url = base_url + paths[number % len(paths)]
+            started = time.perf_counter()
+            try:
+                ok = session.get(url, headers=headers).status_code < 400
+            except requests.RequestException:
+                ok = False
+            return time.perf_counter() - started, ok
+
+        # Прогрев: кэши и индексы строятся до замера.
+        for path in paths:
+            requests.get(base_url + path, headers=headers)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            results = list(executor.map(fetch, range(options['requests'])))
+        elapsed = time.perf_counter() - started
+        latencies = sorted(latency for latency, _ in results)
+        percentiles = statistics.quantiles(latencies, n=100)
+        return {
+            'rps': len(results) / elapsed,
+            'p50': percentiles[49] * 1000,
+            'p99': percentiles[98] * 1000,
+            'errors': sum(not ok for _, ok in results),
+        }
+
+    def handle(self, *args, **options):
+        if options['requests'] < 2 or options['concurrency'] <= 0:
+            raise CommandError('Нужно хотя бы 2 запроса и 1 поток')
+        paths = [
+            path.format(recipe_id=options['recipe_id'])
+            for path in options['path'] or DEFAULT_PATHS
+        ]
+        for target in options['target']:
+            name, separator, base_url = target.partition('=')
+            if not separator:
+                raise CommandError(f'Ожидается имя=адрес: {target}')
+            result = self.run(base_url.rstrip('/'), paths, options)
+            self.stdout.write(
+                f'{name}: {result["rps"]:.0f} запр/с, '
+                f'p50 {result["p50"]:.1f} мс, p99 {result["p99"]:.1f} мс, '
+                f'ошибок {result["errors"]}'
+            )
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import get_cache_stats
+
+CACHES = (
+    ('recipe', 'Кэш рецептов для анонимных пользователей'),
+    ('token', 'Кэш токенов аутентификации'),
+)
+
+
+class Command(BaseCommand):
+    """
+    Показывает попадания и промахи кэша рецептов для анонимных
+    пользователей и кэша токенов: python manage.py cache_stats
+    """
+    help = 'Статистика кэша рецептов и токенов'
+
+    def handle(self, *args, **options):
+        for name, title in CACHES:
+            stats = get_cache_stats(name)
+            total = stats['hits'] + stats['misses']
+            ratio = stats['hits'] / total if total else 0
+            self.stdout.write(
+                f'{title}\n'
+                f'  Попадания: {stats["hits"]}\n'
+                f'  Промахи: {stats["misses"]}\n'
+                f'  Доля попаданий: {ratio:.1%}'
+            )
@@ -0,0 +1,85 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (
+    setup_test_environment,
+    teardown_test_environment
+)
+
+from api.benchmarks import (
+    check_results,
+    get_budgets,
+    get_context,
+    load_baseline,
+    run_suite,
+    save_baseline
+)
+
+
+class Command(BaseCommand):
+    """
+    Замеряет адреса API на данных seed_benchmark_data:
+    python manage.py run_benchmarks [--update-baseline]
+    Для каждого адреса выводятся число запросов к БД, время SQL,
+    сериализации и всего запроса. Команда завершается ошибкой,
+    если число запросов превысило бюджет из api/benchmark_baseline.json
+    или задержка больше базовой в --tolerance раз. Изменяющие
+    запросы выполняются в транзакции, которая откатывается.
+    """
+    help = 'Замеры запросов к БД и задержки адресов API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument(
+            '--tolerance', type=float, default=2.0,
+            help='Во сколько раз задержка может превысить базовую'
+        )
+        parser.add_argument(
+            '--no-latency', action='store_true',
+            help='Проверять только число запросов к БД'
+        )
+        parser.add_argument(
+            '--only', action='append',
+            help='Замерить только указанные адреса'
+        )
+        parser.add_argument(
+            '--update-baseline', action='store_true',
+            help='Сохранить результаты как новые бюджеты'
+        )
+
+    def handle(self, *args, **options):
+        if options['repeat'] <= 0:
+            raise CommandError('--repeat должен быть больше нуля')
+        context = get_context()
+        if context is None:
+            raise CommandError(
+                'Нет данных для замеров, запустите seed_benchmark_data'
+            )
+        setup_test_environment()
+        try:
+            results = run_suite(context, options['repeat'], options['only'])
+        finally:
+            teardown_test_environment()
+        baseline = load_baseline()
+        self.stdout.write(
+            f'{"адрес":40} {"статус":>6} {"SQL":>8} {"мс SQL":>8} '
+            f'{"мс сер.":>8} {"мс":>8} {"база":>8}'
+        )
+        for result in results:
+            budget = baseline.get(result.name, {})
+            self.stdout.write(
+                f'{result.name:40} {str(result.status):>6} '
+                f'{result.queries:>4}/{budget.get("queries", "-"):<3} '
+                f'{result.sql_ms:8.1f} {result.serialization_ms:8.1f} '
+                f'{result.total_ms:8.1f} {budget.get("latency_ms", "-"):>8}'
+            )
+        if options['update_baseline']:
+            baseline.update(get_budgets(results))
+            save_baseline(baseline)
+            self.stdout.write(self.style.SUCCESS('Бюджеты обновлены'))
+            return
+        errors = check_results(
+            results, baseline,
+            None if options['no_latency'] else options['tolerance']
+        )
+        if errors:
+            raise CommandError('Бюджет превышен:\n' + '\n'.join(errors))
+        self.stdout.write(self.style.SUCCESS('Все адреса в бюджете'))
@@ -0,0 +1,147 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class PageLimitPagination(PageNumberPagination):
+    """ Постраничная пагинация с размером страницы из параметра limit. """
+    page_size_query_param = 'limit'
+    max_page_size = 100
+
+
+class KeysetPagination(BasePagination):
+    """ Курсорная пагинация по паре (-order_field, -id).
+
+    Следующая страница выбирается условием по значениям последней
+    строки, без COUNT и OFFSET, поэтому стоимость страницы
+    не зависит от ее номера. Нужен индекс по (-order_field, -id).
+    """
+    order_field = 'pub_date'
+    cursor_query_param = 'cursor'
+    page_size = PageLimitPagination.page_size
+    page_size_query_param = PageLimitPagination.page_size_query_param
+    max_page_size = PageLimitPagination.max_page_size
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def format_value(self, value):
+        return value.isoformat()
+
+    def parse_value(self, value):
+        return datetime.fromisoformat(value)
+
+    def encode_cursor(self, obj):
+        value = self.format_value(getattr(obj, self.order_field))
+        raw = f'{value}|{obj.id}'.encode()
+        return base64.urlsafe_b64encode(raw).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            value, pk = base64.urlsafe_b64decode(
+                cursor.encode()
+            ).decode().split('|')
+            return self.parse_value(value), int(pk)
+        except (binascii.Error, UnicodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(f'-{self.order_field}', '-id')
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            value, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(**{f'{self.order_field}__lt': value})
+                | Q(**{self.order_field: value, 'id__lt': pk}),
+                **{f'{self.order_field}__lte': value}
+            )
+        page = list(queryset[:page_size + 1])
+        self.next_cursor = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_cursor = self.encode_cursor(page[-1])
+        return page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.next_cursor
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {
+                    'type': 'string',
+                    'nullable': True,
+                },
+                'results': schema,
+            },
+        }
+
+
+class SubscriptionKeysetPagination(KeysetPagination):
+    """ Курсорная пагинация подписок по дате подписки. """
+    order_field = 'subscribed_at'
+
+
+class FeedPagination(KeysetPagination):
+    """ Курсорная пагинация ленты подписок. """
+    order_field = 'feed_date'
+
+
+class RankKeysetPagination(KeysetPagination):
+    """ Курсорная пагинация по рейтингу рецепта из аннотации rank. """
+    order_field = 'rank'
+
+    def format_value(self, value):
+        return repr(float(value))
+
+    def parse_value(self, value):
+        return float(value)
+
+
+class KeysetPaginationMixin:
+    """ Включает курсорную пагинацию по параметру pagination=cursor.
+
+    Без параметра используется обычный pagination_class.
+    """
+    keyset_pagination_class = KeysetPagination
+
+    def get_keyset_pagination_class(self):
+        return self.keyset_pagination_class
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if self.request.query_params.get('pagination') == 'cursor':
+                self._paginator = self.get_keyset_pagination_class()()
+            else:
+                self._paginator = super().paginator
+        return self._paginator
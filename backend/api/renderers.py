@@ -0,0 +1,119 @@
+import csv
+import io
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from api.timing import phase
+
+SHOPPING_LIST_TITLE = 'Список покупок:'
+SHOPPING_LIST_HEADER = ('Ингредиент', 'Единица измерения', 'Количество')
+PDF_FONT_NAME = 'ShoppingListFont'
+PDF_CHUNK_SIZE = 64 * 1024
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """ JSONRenderer, время которого относится к фазе render. """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with phase('render'):
+            return super().render(
+                data, accepted_media_type, renderer_context
+            )
+
+
+class ShoppingListRenderer(ABC, BaseRenderer):
+    """ Базовый рендерер файла со списком покупок.
+
+    Сам файл отдается потоком через stream(), render() нужен
+    только для ответов с ошибками.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict) and 'detail' in data:
+            data = data['detail']
+        return str(data).encode('utf-8')
+
+    @abstractmethod
+    def stream(self, ingredients):
+        """ Отдает файл по частям для StreamingHttpResponse. """
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    """ Список покупок в виде текстового файла. """
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, ingredients):
+        yield f'{SHOPPING_LIST_TITLE}\n'
+        for name, measurement_unit, amount in ingredients:
+            yield f'{name} ({measurement_unit}) - {amount}\n'
+
+
+class Echo:
+    """ Файлоподобный объект, который возвращает записанную строку. """
+
+    def write(self, value):
+        return value
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    """ Список покупок в формате CSV. """
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, ingredients):
+        writer = csv.writer(Echo())
+        yield writer.writerow(SHOPPING_LIST_HEADER)
+        for row in ingredients:
+            yield writer.writerow(row)
+
+
+class PDFShoppingListRenderer(ShoppingListRenderer):
+    """ Список покупок в формате PDF.
+
+    Шрифт с кириллицей берется из settings.SHOPPING_LIST_FONT.
+    """
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    font_size = 12
+    margin = 50
+
+    def get_font(self):
+        if PDF_FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(PDF_FONT_NAME, settings.SHOPPING_LIST_FONT)
+            )
+        return PDF_FONT_NAME
+
+    def stream(self, ingredients):
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        font = self.get_font()
+        width, height = A4
+        line_height = self.font_size * 1.5
+        y = height - self.margin
+        pdf.setFont(font, self.font_size)
+        pdf.drawString(self.margin, y, SHOPPING_LIST_TITLE)
+        for name, measurement_unit, amount in ingredients:
+            y -= line_height
+            if y < self.margin:
+                pdf.showPage()
+                pdf.setFont(font, self.font_size)
+                y = height - self.margin
+            pdf.drawString(
+                self.margin, y, f'{name} ({measurement_unit}) - {amount}'
+            )
+        pdf.save()
+        buffer.seek(0)
+        yield from iter(lambda: buffer.read(PDF_CHUNK_SIZE), b'')
@@ -1,15 +1,24 @@
 import base64
+import binascii
+import tempfile
+import uuid
 
-from django.core.files.base import ContentFile
-from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
 
 from rest_framework.validators import UniqueTogetherValidator
 from rest_framework import serializers
 
 from djoser.serializers import UserSerializer
 
+from PIL import Image
+
 from users.models import User
 
+from api.timing import TimedSerializerMixin
+from api.utils import get_recipes_limit
+
 from recipes.models import (
     Tag,
     Ingredient,
@@ -22,17 +31,74 @@ from recipes.models import (
 
 
 class Base64ImageField(serializers.ImageField):
+    """ Изображение в виде data URI с base64.
+
+    Размер проверяется до декодирования, base64 декодируется частями
+    во временный файл, формат и размер в пикселях проверяются
+    по заголовку без декодирования всего изображения.
+    """
+    default_error_messages = {
+        'too_large': 'Размер изображения больше {max_size} байт.',
+        'invalid_base64': 'Некорректные данные base64.',
+        'invalid_format': 'Допустимые форматы изображения: {formats}.',
+        'too_many_pixels': 'Изображение больше {max_pixels} пикселей.',
+    }
+    chunk_size = 64 * 1024
+
     def to_internal_value(self, data):
 
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            data = self.decode(data)
 
         return super().to_internal_value(data)
 
-
-class UserSerializer(UserSerializer):
+    def decode(self, data):
+        start = data.find(';base64,')
+        if start == -1:
+            self.fail('invalid_base64')
+        start += len(';base64,')
+        max_size = settings.RECIPE_IMAGE_MAX_SIZE
+        if (len(data) - start) // 4 * 3 > max_size + 2:
+            self.fail('too_large', max_size=max_size)
+
+        file = tempfile.SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+        )
+        try:
+            for position in range(start, len(data), self.chunk_size):
+                file.write(base64.b64decode(
+                    data[position:position + self.chunk_size], validate=True
+                ))
+        except binascii.Error:
+            file.close()
+            self.fail('invalid_base64')
+        if file.tell() > max_size:
+            file.close()
+            self.fail('too_large', max_size=max_size)
+        file.seek(0)
+        image_format = self.check_image(file)
+        file.seek(0)
+        return File(file, name=f'{uuid.uuid4().hex}.{image_format.lower()}')
+
+    def check_image(self, file):
+        """ Формат и размер берутся из заголовка, пиксели не читаются. """
+        try:
+            image = Image.open(file)
+        except (OSError, Image.DecompressionBombError):
+            file.close()
+            self.fail('invalid_image')
+        formats = settings.RECIPE_IMAGE_FORMATS
+        if image.format not in formats:
+            file.close()
+            self.fail('invalid_format', formats=', '.join(formats))
+        max_pixels = settings.RECIPE_IMAGE_MAX_PIXELS
+        if image.width * image.height > max_pixels:
+            file.close()
+            self.fail('too_many_pixels', max_pixels=max_pixels)
+        return image.format
+
+
+class UserSerializer(TimedSerializerMixin, UserSerializer):
     """ Сериализатор для кастомной модели User. """
     is_subscribed = serializers.SerializerMethodField()
 
@@ -48,17 +114,36 @@ class UserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        """Вычисляем поле is_subscribed."""
-        user = self.context.get('request').user
-        if user is None or user.is_anonymous:
-            return False
-        return Subscription.objects.filter(
-            user=user,
-            author=obj
-        ).exists()
+        """Вычисляем поле is_subscribed.
 
+        Берет аннотацию из queryset, иначе проверяет по множеству
+        id авторов, загруженному один раз на весь контекст.
+        """
+        is_subscribed = getattr(obj, 'is_subscribed', None)
+        if is_subscribed is not None:
+            return is_subscribed
+        return obj.id in self.get_subscribed_ids()
+
+    def get_subscribed_ids(self):
+        """Множество id авторов, на которых подписан пользователь запроса.
 
-class IngredientSerializer(serializers.ModelSerializer):
+        Загружается одним запросом и хранится в общем контексте,
+        поэтому его используют все вложенные сериализаторы.
+        """
+        if 'subscribed_ids' not in self.context:
+            user = self.context.get('request').user
+            if user is None or user.is_anonymous:
+                self.context['subscribed_ids'] = frozenset()
+            else:
+                self.context['subscribed_ids'] = frozenset(
+                    Subscription.objects.filter(
+                        user=user
+                    ).values_list('author_id', flat=True)
+                )
+        return self.context['subscribed_ids']
+
+
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """ Сериализатор  для модели Ingredient. """
     id = serializers.PrimaryKeyRelatedField(read_only=True)
 
@@ -108,7 +193,7 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
         )
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """ Сериализатор для модели Tag."""
     id = serializers.PrimaryKeyRelatedField(read_only=True)
 
@@ -122,7 +207,7 @@ class TagSerializer(serializers.ModelSerializer):
         )
 
 
-class RecipeGetSerializer(serializers.ModelSerializer):
+class RecipeGetSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """ Сериализатор для модели Recipe при GET запросах."""
     tags = TagSerializer(many=True, read_only=True)
     author = UserSerializer(read_only=True)
@@ -144,29 +229,67 @@ class RecipeGetSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_thumbnail',
+            'image_webp',
             'text',
             'cooking_time',
         )
 
     def get_is_favorited(self, obj):
-        """Метод для поля is_favorited."""
+        """Метод для поля is_favorited.
+
+        Берет аннотацию из queryset, запрос делает только если ее нет.
+        """
+        is_favorited = getattr(obj, 'is_favorited', None)
+        if is_favorited is not None:
+            return is_favorited
         user = self.context.get('request').user
         return (user.is_authenticated
                 and user.favorites.filter(recipe=obj).exists())
 
     def get_is_in_shopping_cart(self, obj):
-        """Метод для поля is_in_shopping_cart."""
+        """Метод для поля is_in_shopping_cart.
+
+        Берет аннотацию из queryset, запрос делает только если ее нет.
+        """
+        is_in_shopping_cart = getattr(obj, 'is_in_shopping_cart', None)
+        if is_in_shopping_cart is not None:
+            return is_in_shopping_cart
         user = self.context.get('request').user
         return (user.is_authenticated
                 and user.cart.filter(recipe=obj).exists())
 
 
+class RecipeMatchSerializer(RecipeGetSerializer):
+    """ Рецепт из подбора по ингредиентам с недостающими ингредиентами.
+
+    Имеющиеся ингредиенты передаются в context['ingredient_ids'],
+    недостающие берутся из уже подгруженных ингредиентов рецепта.
+    """
+    missing_ingredients = serializers.SerializerMethodField(read_only=True)
+
+    class Meta(RecipeGetSerializer.Meta):
+        fields = RecipeGetSerializer.Meta.fields + ('missing_ingredients',)
+
+    def get_missing_ingredients(self, obj):
+        ingredient_ids = self.context['ingredient_ids']
+        return IngredientSerializer(
+            [
+                amount.ingredient for amount in obj.amount_ingredients.all()
+                if amount.ingredient_id not in ingredient_ids
+            ],
+            many=True
+        ).data
+
+
 class RecipeSerializer(serializers.ModelSerializer):
-    """ Сериализатор для модели Recipe при небезопасных запросах. """
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True
-    )
+    """ Сериализатор для модели Recipe при небезопасных запросах.
+
+    Теги и ингредиенты проверяются одним запросом in_bulk,
+    при обновлении меняются только изменившиеся строки.
+    Запись идет в одной транзакции.
+    """
+    tags = serializers.ListField(child=serializers.IntegerField())
     author = UserSerializer(read_only=True)
     ingredients = IngredientRecipeSerializer(many=True)
     image = Base64ImageField()
@@ -191,32 +314,32 @@ class RecipeSerializer(serializers.ModelSerializer):
         return cooking_time
 
     def validate(self, data):
-        ingredients = self.initial_data.get('ingredients')
+        ingredients = data.get('ingredients')
         if not ingredients:
             raise serializers.ValidationError({
                 'ingredients': 'Нужен хоть один ингридиент для рецепта'})
 
-        tags = self.initial_data.get('tags')
+        tags = data.get('tags')
         if not tags:
             raise serializers.ValidationError('Не указаны тэги')
 
-        if len(data['tags']) > len(set(data['tags'])):
+        if len(tags) > len(set(tags)):
             raise serializers.ValidationError('Теги не могут повторяться!')
 
-        ingredient_list = []
-        for ingredient_item in ingredients:
-            ingredient = get_object_or_404(Ingredient,
-                                           id=ingredient_item['id'])
-            if ingredient in ingredient_list:
-                raise serializers.ValidationError('Ингридиенты должны '
-                                                  'быть уникальными')
-            ingredient_list.append(ingredient)
-            if int(ingredient_item['amount']) < 0:
-                raise serializers.ValidationError({
-                    'ingredients': ('Убедитесь, что значение количества '
-                                    'ингредиента больше 0')
-                })
-        data['ingredients'] = ingredients
+        if len(Tag.objects.in_bulk(tags)) < len(tags):
+            raise serializers.ValidationError({
+                'tags': 'Указан несуществующий тег'})
+
+        ingredient_ids = {
+            ingredient_item['id'] for ingredient_item in ingredients
+        }
+        if len(ingredient_ids) < len(ingredients):
+            raise serializers.ValidationError('Ингридиенты должны '
+                                              'быть уникальными')
+        if len(Ingredient.objects.in_bulk(ingredient_ids)) < len(
+                ingredient_ids):
+            raise serializers.ValidationError({
+                'ingredients': 'Указан несуществующий ингредиент'})
         return data
 
     def create_ingredients(self, ingredients, recipe):
@@ -229,6 +352,42 @@ class RecipeSerializer(serializers.ModelSerializer):
             for ingredient in ingredients
         )
 
+    def update_ingredients(self, ingredients, recipe):
+        """ Удаляет, изменяет и создает только отличающиеся строки. """
+        amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients
+        }
+        existing = {
+            ingredient_recipe.ingredient_id: ingredient_recipe
+            for ingredient_recipe in IngredientRecipe.objects.filter(
+                recipe=recipe
+            ).order_by()
+        }
+        removed = [
+            ingredient_recipe.id
+            for ingredient_id, ingredient_recipe in existing.items()
+            if ingredient_id not in amounts
+        ]
+        changed = []
+        for ingredient_id, ingredient_recipe in existing.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and ingredient_recipe.amount != amount:
+                ingredient_recipe.amount = amount
+                changed.append(ingredient_recipe)
+        if removed:
+            IngredientRecipe.objects.filter(id__in=removed).delete()
+        if changed:
+            IngredientRecipe.objects.bulk_update(changed, ('amount',))
+        self.create_ingredients(
+            [
+                ingredient for ingredient in ingredients
+                if ingredient['id'] not in existing
+            ],
+            recipe
+        )
+
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
@@ -237,23 +396,25 @@ class RecipeSerializer(serializers.ModelSerializer):
         self.create_ingredients(recipe=recipe, ingredients=ingredients)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
         instance.tags.set(tags)
-        IngredientRecipe.objects.filter(recipe=instance).delete()
-        super().update(instance, validated_data)
-        self.create_ingredients(ingredients, instance)
-        instance.save()
-        return instance
+        self.update_ingredients(ingredients, instance)
+        return super().update(instance, validated_data)
 
     def to_representation(self, instance):
         request = self.context.get('request')
         context = {'request': request}
+        instance = Recipe.objects.with_related().with_user_flags(
+            request.user
+        ).get(pk=instance.pk)
         return RecipeGetSerializer(instance, context=context).data
 
 
-class RecipeFavoriteSerializer(serializers.ModelSerializer):
+class RecipeFavoriteSerializer(TimedSerializerMixin,
+                               serializers.ModelSerializer):
     """ Сериализатор для Favorite и ShoppingCart. """
 
     class Meta:
@@ -262,6 +423,8 @@ class RecipeFavoriteSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_thumbnail',
+            'image_webp',
             'cooking_time'
         )
 
@@ -320,14 +483,21 @@ class SubscriptionSerializer(serializers.ModelSerializer):
 class SubscriptionReadSerializer(UserSerializer):
     """ Сериализатор для модели User для полей подписок."""
 
-    recipes = RecipeFavoriteSerializer(many=True, read_only=True)
-    recipes_count = serializers.SerializerMethodField(read_only=True)
+    recipes = serializers.SerializerMethodField(read_only=True)
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta(UserSerializer.Meta):
         fields = UserSerializer.Meta.fields + ('recipes', 'recipes_count')
 
-    def get_recipes_count(self, obj):
-        """ Вычисляет колличество рецептов у автора рецептов,
-        на которых он подписан.
+    def get_recipes(self, obj):
+        """ Рецепты автора, не больше recipes_limit из запроса.
+
+        Если рецепты уже подгружены через prefetch, срез берется
+        из кэша без дополнительного запроса.
         """
-        return obj.recipes.count()
+        recipes = obj.recipes.all()[
+            :get_recipes_limit(self.context.get('request'))
+        ]
+        return RecipeFavoriteSerializer(
+            recipes, many=True, context=self.context
+        ).data
@@ -0,0 +1,95 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from api.authentication import invalidate_tokens_on_commit
+from recipes.cache import bump_cache_version_on_commit
+from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
+from users.models import User
+
+# Поля пользователя, которые попадают в ответы с рецептами.
+USER_PUBLIC_FIELDS = frozenset(
+    ('email', 'username', 'first_name', 'last_name')
+)
+# Поля, которые сохраняются при входе и не влияют на аутентификацию.
+USER_LOGIN_FIELDS = frozenset(('last_login',))
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def bump_tag_version(sender, **kwargs):
+    """ Сбрасывает кэш ответов с тегами. """
+    bump_cache_version_on_commit('tag')
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def bump_ingredient_version(sender, **kwargs):
+    """ Сбрасывает кэш ответов с ингредиентами. """
+    bump_cache_version_on_commit('ingredient')
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def bump_recipe_version(sender, instance, **kwargs):
+    """ Сбрасывает кэш ленты и самого рецепта. """
+    bump_cache_version_on_commit('recipe', f'recipe:{instance.pk}')
+
+
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+def bump_ingredient_recipe_version(sender, instance, **kwargs):
+    """ Сбрасывает кэш ленты и рецепта при изменении его ингредиентов. """
+    bump_cache_version_on_commit('recipe', f'recipe:{instance.recipe_id}')
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def bump_recipe_tags_version(sender, instance, action, reverse, pk_set,
+                             **kwargs):
+    """ Сбрасывает кэш ленты и рецептов при изменении их тегов. """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    names = ['recipe']
+    if not reverse:
+        names.append(f'recipe:{instance.pk}')
+    elif pk_set is None:
+        # tag.recipes.clear(): затронутые рецепты неизвестны,
+        # версия тегов входит в ключи всех рецептов.
+        names.append('tag')
+    else:
+        names.extend(f'recipe:{recipe_id}' for recipe_id in pk_set)
+    bump_cache_version_on_commit(*names)
+
+
+@receiver(post_save, sender=User)
+def bump_author_version(sender, instance, update_fields, **kwargs):
+    """ Сбрасывает кэш рецептов автора при изменении его данных.
+
+    Сохранения без публичных полей (например, last_login) пропускаются.
+    """
+    if update_fields is not None and USER_PUBLIC_FIELDS.isdisjoint(
+            update_fields):
+        return
+    names = [f'user:{instance.pk}']
+    if Recipe.objects.filter(author=instance).exists():
+        names.append('recipe')
+    bump_cache_version_on_commit(*names)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    """ Сбрасывает кэш токена при выходе или удалении пользователя. """
+    invalidate_tokens_on_commit([instance.key])
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, update_fields,
+                           **kwargs):
+    """ Сбрасывает кэш токенов пользователя при изменении его данных.
+
+    Так смена пароля и деактивация действуют сразу, а не через
+    TOKEN_CACHE_TIMEOUT. Сохранение last_login при входе пропускается.
+    """
+    if created or (update_fields is not None
+                   and update_fields <= USER_LOGIN_FIELDS):
+        return
+    invalidate_tokens_on_commit(
+        Token.objects.filter(user=instance).values_list('key', flat=True)
+    )
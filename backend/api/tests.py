@@ -1,13 +1,2059 @@
+import base64
+import io
+import os
+import shutil
+import tempfile
+from contextlib import ExitStack
+from datetime import timedelta
 from http import HTTPStatus
+from unittest import mock, skipUnless
 
-from django.test import Client, TestCase
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.signals import request_finished, request_started
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    close_old_connections,
+    connection,
+    connections
+)
+from asgiref.sync import async_to_sync
+from django.test import (
+    Client,
+    TestCase,
+    TransactionTestCase,
+    override_settings
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from PIL import Image
+
+from recipes.models import (
+    Tag,
+    Ingredient,
+    Recipe,
+    IngredientRecipe,
+    ShoppingCart,
+    Favorite,
+    FeedEntry,
+    RecipeScore,
+    Subscription,
+)
+from api.authentication import (
+    CachedTokenAuthentication,
+    get_token_cache_key
+)
+from api.benchmarks import (
+    check_results,
+    get_context,
+    load_baseline,
+    parse_server_timing,
+    run_suite
+)
+from api.cache import RECIPE_QUERY_PARAMS, get_cache_stats
+from api.filters import RecipeFilter
+from foodgram.asgi import application
+from foodgram.routers import replica_health
+from recipes.cache import bump_cache_version, get_cache_version
+from recipes.counters import recount
+from recipes.images import generate_variants
+from recipes.scores import update_scores
+from recipes.signals import backfill_recipe_scores
+from recipes.search import ingredient_index, recipe_ingredient_index
+from recipes.similarity import build_model, similarity_index
+from users.models import User
+
+postgres_only = skipUnless(
+    connection.vendor == 'postgresql', 'Только для PostgreSQL'
+)
+
+
+def make_user(name, **extra_fields):
+    """Пользователь name с почтой name@example.com и паролем pass."""
+    return User.objects.create_user(
+        username=name, email=f'{name}@example.com',
+        first_name=name.capitalize(), last_name=name.capitalize(),
+        password='pass', **extra_fields
+    )
 
 
 class FoodgramAPITestCase(TestCase):
     def setUp(self):
+        cache.clear()
         self.guest_client = Client()
 
     def test_list_exists(self):
         """Проверка доступности списка задач."""
         response = self.guest_client.get('/api/recipes/')
         self.assertEqual(response.status_code, HTTPStatus.OK)
+
+
+class RecipeFlagsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('reader')
+        cls.author = make_user('author')
+        cls.tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        cls.ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit='г'
+        )
+        cls.recipes = []
+        for number in range(3):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}', text='Описание',
+                author=cls.author, cooking_time=10
+            )
+            recipe.tags.add(cls.tag)
+            IngredientRecipe.objects.create(
+                recipe=recipe, ingredient=cls.ingredient, amount=5
+            )
+            cls.recipes.append(recipe)
+        Favorite.objects.create(user=cls.user, recipe=cls.recipes[0])
+        ShoppingCart.objects.create(user=cls.user, recipe=cls.recipes[1])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_flags_in_list(self):
+        """Флаги is_favorited и is_in_shopping_cart берутся из аннотаций."""
+        response = self.client.get('/api/recipes/')
+        flags = {
+            item['id']: (item['is_favorited'], item['is_in_shopping_cart'])
+            for item in response.json()['results']
+        }
+        self.assertEqual(flags[self.recipes[0].id], (True, False))
+        self.assertEqual(flags[self.recipes[1].id], (False, True))
+        self.assertEqual(flags[self.recipes[2].id], (False, False))
+
+    def test_flag_filters(self):
+        """Фильтры по избранному и корзине используют аннотации."""
+        response = self.client.get('/api/recipes/?is_favorited=1')
+        self.assertEqual(
+            [item['id'] for item in response.json()['results']],
+            [self.recipes[0].id]
+        )
+        response = self.client.get('/api/recipes/?is_in_shopping_cart=1')
+        self.assertEqual(
+            [item['id'] for item in response.json()['results']],
+            [self.recipes[1].id]
+        )
+
+    def test_anonymous_flags(self):
+        """Для анонима флаги всегда False."""
+        response = APIClient().get(f'/api/recipes/{self.recipes[0].id}/')
+        self.assertFalse(response.json()['is_favorited'])
+        self.assertFalse(response.json()['is_in_shopping_cart'])
+
+
+class SubscriptionLookupTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('reader')
+        cls.authors = [make_user(f'author{number}') for number in range(6)]
+        for author in cls.authors:
+            Recipe.objects.create(
+                name='Рецепт', text='Описание',
+                author=author, cooking_time=10
+            )
+        Subscription.objects.create(user=cls.user, author=cls.authors[0])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_recipe_list_queries(self):
+        """Подписки на авторов рецептов загружаются одним запросом."""
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/recipes/')
+        subscribed = {
+            item['author']['id']: item['author']['is_subscribed']
+            for item in response.json()['results']
+        }
+        self.assertTrue(subscribed[self.authors[0].id])
+        self.assertFalse(subscribed[self.authors[1].id])
+
+    def test_user_list_queries(self):
+        """Список пользователей не делает запрос на каждую строку."""
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/users/')
+        subscribed = {
+            item['id']: item['is_subscribed']
+            for item in response.json()['results']
+        }
+        self.assertTrue(subscribed[self.authors[0].id])
+        self.assertFalse(subscribed[self.authors[1].id])
+
+
+class SubscriptionsRecipesLimitTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('reader')
+        cls.authors = []
+        for number in range(3):
+            author = make_user(f'author{number}')
+            Recipe.objects.bulk_create(
+                Recipe(name=f'Рецепт {index}', text='Описание',
+                       author=author, cooking_time=10)
+                for index in range(5)
+            )
+            Subscription.objects.create(user=cls.user, author=author)
+            cls.authors.append(author)
+        # bulk_create не обновляет счетчики.
+        recount()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_recipes_limit(self):
+        """recipes_limit ограничивает рецепты, recipes_count - полный."""
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                '/api/users/subscriptions/?recipes_limit=2'
+            )
+        for author in response.json()['results']:
+            self.assertEqual(
+                [recipe['name'] for recipe in author['recipes']],
+                ['Рецепт 4', 'Рецепт 3']
+            )
+            self.assertEqual(author['recipes_count'], 5)
+            self.assertTrue(author['is_subscribed'])
+
+    @override_settings(SUBSCRIPTION_RECIPES_LIMIT=3)
+    def test_default_cap(self):
+        """Без recipes_limit и с большим значением рецептов не больше 3."""
+        for path in (
+            '/api/users/subscriptions/',
+            '/api/users/subscriptions/?recipes_limit=100',
+        ):
+            with self.subTest(path=path):
+                for author in self.client.get(path).json()['results']:
+                    self.assertEqual(len(author['recipes']), 3)
+
+    def test_prefetch_page_authors_only(self):
+        """Рецепты нумеруются только у авторов текущей страницы."""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/users/subscriptions/?limit=1')
+        [recipes_query] = [
+            query['sql'] for query in queries
+            if 'ROW_NUMBER' in query['sql']
+        ]
+        self.assertIn(
+            f'"author_id" IN ({self.authors[0].id})', recipes_query
+        )
+
+    def test_subscribe_recipes_limit(self):
+        """recipes_limit применяется и к ответу subscribe."""
+        author = make_user('newauthor')
+        Recipe.objects.bulk_create(
+            Recipe(name=f'Рецепт {index}', text='Описание',
+                   author=author, cooking_time=10)
+            for index in range(4)
+        )
+        recount()
+        response = self.client.post(
+            f'/api/users/{author.id}/subscribe/?recipes_limit=1'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual(len(response.json()['recipes']), 1)
+        self.assertEqual(response.json()['recipes_count'], 4)
+
+
+class ShoppingListTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('reader')
+        author = make_user('author')
+        cls.salt = Ingredient.objects.create(
+            name='соль', measurement_unit='г'
+        )
+        cls.flour = Ingredient.objects.create(
+            name='мука', measurement_unit='г'
+        )
+        recipes = [
+            Recipe.objects.create(name=f'Рецепт {number}', text='Описание',
+                                  author=author, cooking_time=10)
+            for number in range(20)
+        ]
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=recipe, ingredient=ingredient, amount=7)
+            for recipe in recipes
+            for ingredient in (cls.salt, cls.flour)
+        )
+        cart_recipes = recipes[:2]
+        IngredientRecipe.objects.filter(
+            recipe=cart_recipes[0], ingredient=cls.salt
+        ).update(amount=5)
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=cls.user, recipe=recipe)
+            for recipe in cart_recipes
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def download(self, file_format):
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                '/api/recipes/download_shopping_cart/',
+                {'format': file_format}
+            )
+            content = b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return response, content
+
+    def test_txt_totals(self):
+        """Суммы считаются только по рецептам из корзины."""
+        response, content = self.download('txt')
+        self.assertEqual(
+            content.decode(),
+            'Список покупок:\nмука (г) - 14\nсоль (г) - 12\n'
+        )
+        self.assertIn('shopping_list.txt', response['Content-Disposition'])
+
+    def test_csv(self):
+        response, content = self.download('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(content.decode().splitlines()[1:], [
+            'мука,г,14',
+            'соль,г,12',
+        ])
+
+    def test_pdf(self):
+        response, content = self.download('pdf')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(content.startswith(b'%PDF'))
+
+    def test_anonymous(self):
+        response = APIClient().get('/api/recipes/download_shopping_cart/')
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+
+class IngredientSearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('Сахар', 'сахарная пудра', 'Ванильный сахар', 'соль'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def setUp(self):
+        cache.clear()
+        ingredient_index.invalidate()
+
+    def search(self, name):
+        response = self.client.get('/api/ingredients/', {'name': name})
+        return [item['name'] for item in response.json()]
+
+    def test_prefix_before_substring(self):
+        """Совпадения по началу названия идут раньше подстрок."""
+        self.assertEqual(
+            self.search('сах'),
+            ['Сахар', 'сахарная пудра', 'Ванильный сахар']
+        )
+
+    def test_index_rebuilt_on_save(self):
+        """Новый ингредиент сразу находится поиском."""
+        self.search('сах')
+        Ingredient.objects.create(name='сахарин', measurement_unit='г')
+        with self.assertNumQueries(1):
+            self.assertIn('сахарин', self.search('сах'))
+        with self.assertNumQueries(0):
+            self.search('сол')
+
+    def test_index_follows_catalog_version(self):
+        """Индекс перестраивается по версии каталога из общего кэша."""
+        self.search('сах')
+        # bulk_create без сигналов, как запись из другого процесса.
+        Ingredient.objects.bulk_create(
+            [Ingredient(name='сахароза', measurement_unit='г')]
+        )
+        self.assertNotIn('сахароза', self.search('сах'))
+        bump_cache_version('ingredient')
+        self.assertIn('сахароза', self.search('сах'))
+
+    @postgres_only
+    def test_name_prefix_index(self):
+        """Индекс по UPPER(name) создается после migrate."""
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, Ingredient._meta.db_table
+            )
+        self.assertIn('ingredient_name_upper_idx', constraints)
+
+    @override_settings(INGREDIENT_SEARCH_BACKEND='database')
+    def test_database_backend(self):
+        self.assertEqual(
+            self.search('сах'),
+            ['Сахар', 'сахарная пудра', 'Ванильный сахар']
+        )
+
+    @override_settings(INGREDIENT_SEARCH_LIMIT=2)
+    def test_limit(self):
+        self.assertEqual(self.search('сах'), ['Сахар', 'сахарная пудра'])
+
+
+class ReferenceCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(name='Обед', slug='lunch')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_etag_not_modified(self):
+        """Совпавший If-None-Match дает 304 без запросов к БД."""
+        response = self.client.get('/api/tags/')
+        etag = response['ETag']
+        self.assertIn('max-age', response['Cache-Control'])
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                '/api/tags/', HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/tags/')
+        self.assertEqual(response.json()[0]['slug'], 'lunch')
+
+    def test_version_bumped_on_save(self):
+        """Изменение тега меняет ETag и содержимое ответа."""
+        etag = self.client.get('/api/tags/')['ETag']
+        self.tag.slug = 'dinner'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.save()
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()[0]['slug'], 'dinner')
+
+
+class AnonymousRecipeCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = make_user('author')
+        cls.breakfast = Tag.objects.create(name='Завтрак', slug='breakfast')
+        cls.lunch = Tag.objects.create(name='Обед', slug='lunch')
+        cls.ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit='г'
+        )
+        cls.recipe = Recipe.objects.create(
+            name='Рецепт', text='Описание', author=cls.author, cooking_time=10
+        )
+        cls.recipe.tags.add(cls.breakfast, cls.lunch)
+        cls.amount = IngredientRecipe.objects.create(
+            recipe=cls.recipe, ingredient=cls.ingredient, amount=5
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_normalized_params(self):
+        """Порядок тегов в запросе не влияет на ключ кэша."""
+        response = self.client.get(
+            '/api/recipes/?tags=lunch&tags=breakfast'
+        )
+        self.assertEqual(response['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                '/api/recipes/?tags=breakfast&tags=lunch'
+            )
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(get_cache_stats('recipe'), {'hits': 1, 'misses': 1})
+
+    def test_unknown_params_ignored(self):
+        """Посторонние параметры не создают записей в кэше."""
+        for nonce in range(2):
+            response = self.client.get(f'/api/recipes/?x={nonce}')
+            self.assertEqual(response['X-Cache'], 'MISS')
+        self.client.get('/api/recipes/?limit=1&page=1')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/recipes/?page=1&limit=1&x=2')
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+    def test_search_not_cached(self):
+        """Поиск не читает и не пополняет кэш рецептов."""
+        for query in ('Рецепт', 'рецепт ', 'Рецепт'):
+            response = self.client.get(f'/api/recipes/?search={query}')
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertNotIn('X-Cache', response)
+        self.assertEqual(get_cache_stats('recipe'), {'hits': 0, 'misses': 0})
+        response = self.client.get('/api/recipes/?search=')
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+    def test_params_cover_filter(self):
+        """В ключ кэша попадают все параметры RecipeFilter."""
+        self.assertLessEqual(
+            set(RecipeFilter.base_filters), RECIPE_QUERY_PARAMS
+        )
+
+    def test_invalidated_by_ingredient_amount(self):
+        """Изменение ингредиентов рецепта сбрасывает кэш."""
+        self.client.get('/api/recipes/')
+        self.client.get(f'/api/recipes/{self.recipe.id}/')
+        self.amount.amount = 7
+        with self.captureOnCommitCallbacks(execute=True):
+            self.amount.save()
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.id}/'):
+            response = self.client.get(url)
+            self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['ingredients'][0]['amount'], 7)
+
+    def test_invalidated_by_author(self):
+        """Изменение имени автора сбрасывает кэш рецепта."""
+        self.client.get(f'/api/recipes/{self.recipe.id}/')
+        self.author.first_name = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.save()
+        response = self.client.get(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['author']['first_name'], 'Renamed')
+
+    def test_authenticated_not_cached(self):
+        client = APIClient()
+        client.force_authenticate(self.author)
+        response = client.get('/api/recipes/')
+        self.assertNotIn('X-Cache', response)
+
+
+class KeysetPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('reader')
+        author = make_user('author')
+        cls.recipes = [
+            Recipe.objects.create(name=f'Рецепт {number}', text='Описание',
+                                  author=author, cooking_time=10)
+            for number in range(5)
+        ]
+        # Одинаковая дата публикации: порядок задает id.
+        Recipe.objects.filter(
+            id__in=[recipe.id for recipe in cls.recipes[:3]]
+        ).update(pub_date=cls.recipes[0].pub_date)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_pages_follow_pub_date_and_id(self):
+        """Курсор проходит все рецепты без повторов и пропусков."""
+        url = '/api/recipes/?pagination=cursor&limit=2'
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertNotIn('count', response.json())
+            ids += [item['id'] for item in response.json()['results']]
+            url = response.json()['next']
+        expected = [recipe.id for recipe in reversed(self.recipes[3:])]
+        expected += sorted(
+            (recipe.id for recipe in self.recipes[:3]), reverse=True
+        )
+        self.assertEqual(ids, expected)
+
+    def test_page_mode_honours_limit(self):
+        response = self.client.get('/api/recipes/?limit=2')
+        self.assertEqual(response.json()['count'], 5)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/?pagination=cursor&cursor=x')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_subscriptions_cursor(self):
+        authors = User.objects.exclude(id=self.user.id)
+        Subscription.objects.create(user=self.user, author=authors[0])
+        response = self.client.get(
+            '/api/users/subscriptions/?pagination=cursor&limit=1'
+        )
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertIsNone(response.json()['next'])
+
+
+class RecipeTagFilterTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = make_user('author')
+        cls.breakfast = Tag.objects.create(name='Завтрак', slug='breakfast')
+        cls.lunch = Tag.objects.create(name='Обед', slug='lunch')
+        cls.both, cls.only_lunch = (
+            Recipe.objects.create(name=name, text='Описание',
+                                  author=author, cooking_time=10)
+            for name in ('Оба', 'Обед')
+        )
+        cls.both.tags.add(cls.breakfast, cls.lunch)
+        cls.only_lunch.tags.add(cls.lunch)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_ids(self, query):
+        response = self.client.get(f'/api/recipes/?{query}')
+        return sorted(item['id'] for item in response.json()['results'])
+
+    def test_any_without_duplicates(self):
+        """Рецепт с несколькими подходящими тегами выводится один раз."""
+        self.assertEqual(
+            self.get_ids('tags=breakfast&tags=lunch'),
+            sorted((self.both.id, self.only_lunch.id))
+        )
+
+    def test_all(self):
+        self.assertEqual(
+            self.get_ids('tags=breakfast&tags=lunch&tags_match=all'),
+            [self.both.id]
+        )
+
+    def test_unknown_slug(self):
+        self.assertEqual(self.get_ids('tags=unknown'), [])
+        self.assertEqual(
+            self.get_ids('tags=lunch&tags=unknown&tags_match=all'), []
+        )
+
+    def test_author(self):
+        author_id = self.both.author_id
+        self.assertEqual(len(self.get_ids(f'author={author_id}')), 2)
+        self.assertEqual(self.get_ids(f'author={author_id + 1}'), [])
+
+
+def make_image(size=(64, 48), image_format='PNG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, image_format)
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return f'data:image/{image_format.lower()};base64,{encoded}'
+
+
+class RecipeImageTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = make_user('author')
+        cls.tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        cls.ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit='г'
+        )
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def post_recipe(self, image):
+        return self.client.post('/api/recipes/', {
+            'tags': [self.tag.id],
+            'ingredients': [{'id': self.ingredient.id, 'amount': 5}],
+            'name': 'Рецепт',
+            'image': image,
+            'text': 'Описание',
+            'cooking_time': 10,
+        }, format='json')
+
+    def test_variants(self):
+        """Миниатюра и WebP строятся вне запроса и попадают в ответ."""
+        response = self.post_recipe(make_image((1000, 600)))
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertIsNone(response.json()['image_thumbnail'])
+        recipe_id = response.json()['id']
+        generate_variants(recipe_id)
+        recipe = Recipe.objects.get(id=recipe_id)
+        with Image.open(recipe.image_thumbnail.path) as thumbnail:
+            self.assertEqual(thumbnail.format, 'WEBP')
+            self.assertEqual(thumbnail.size, (480, 288))
+        response = self.client.get(f'/api/recipes/{recipe_id}/')
+        self.assertTrue(response.json()['image_webp'].endswith('.webp'))
+
+    def test_stale_variants_deleted(self):
+        """Варианты строятся для нового изображения, старые удаляются."""
+        recipe_id = self.post_recipe(make_image()).json()['id']
+        generate_variants(recipe_id)
+        recipe = Recipe.objects.get(id=recipe_id)
+        stale_paths = [recipe.image_thumbnail.path, recipe.image_webp.path]
+        with mock.patch('recipes.signals.schedule_variants') as schedule:
+            recipe.name = 'Новое название'
+            with CaptureQueriesContext(connection) as queries:
+                recipe.save()
+            schedule.assert_not_called()
+            updates = [
+                query['sql'] for query in queries
+                if query['sql'].startswith('UPDATE "recipes_recipe"')
+            ]
+            self.assertEqual(len(updates), 1)
+            self.assertIn('"name"', updates[0])
+            self.assertNotIn('"image"', updates[0])
+            response = self.client.patch(f'/api/recipes/{recipe_id}/', {
+                'tags': [self.tag.id],
+                'ingredients': [{'id': self.ingredient.id, 'amount': 5}],
+                'name': 'Новое название',
+                'image': make_image((300, 200)),
+                'text': 'Описание',
+                'cooking_time': 10,
+            }, format='json')
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            schedule.assert_called_once()
+        generate_variants(recipe_id)
+        recipe = Recipe.objects.get(id=recipe_id)
+        self.assertTrue(os.path.exists(recipe.image_thumbnail.path))
+        for path in stale_paths:
+            self.assertFalse(os.path.exists(path))
+
+    @override_settings(RECIPE_IMAGE_MAX_SIZE=100)
+    def test_too_large(self):
+        response = self.post_recipe(make_image())
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertIn('image', response.json())
+
+    @override_settings(RECIPE_IMAGE_MAX_PIXELS=100)
+    def test_too_many_pixels(self):
+        response = self.post_recipe(make_image())
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_invalid_format(self):
+        response = self.post_recipe(make_image(image_format='BMP'))
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    def test_invalid_base64(self):
+        response = self.post_recipe('data:image/png;base64,***')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+
+class RecipeWriteQueriesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = make_user('author')
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {number}', slug=f'tag{number}')
+            for number in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(60)
+        ]
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def get_payload(self, ingredients, tags, amount=5):
+        return {
+            'tags': [tag.id for tag in tags],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': amount}
+                for ingredient in ingredients
+            ],
+            'name': 'Рецепт',
+            'image': make_image(),
+            'text': 'Описание',
+            'cooking_time': 10,
+        }
+
+    def count_queries(self, method, url, payload):
+        with CaptureQueriesContext(connection) as queries:
+            response = method(url, payload, format='json')
+        self.assertIn(
+            response.status_code, (HTTPStatus.OK, HTTPStatus.CREATED)
+        )
+        return len(queries), response.json()
+
+    def test_create_queries_do_not_depend_on_size(self):
+        """Число запросов при создании не зависит от числа ингредиентов."""
+        small, _ = self.count_queries(
+            self.client.post, '/api/recipes/',
+            self.get_payload(self.ingredients[:2], self.tags[:1])
+        )
+        large, data = self.count_queries(
+            self.client.post, '/api/recipes/',
+            self.get_payload(self.ingredients, self.tags)
+        )
+        self.assertEqual(small, large)
+        self.assertEqual(len(data['ingredients']), 60)
+
+    def test_update_diff(self):
+        """Обновление меняет только отличающиеся строки."""
+        _, data = self.count_queries(
+            self.client.post, '/api/recipes/',
+            self.get_payload(self.ingredients[:55], self.tags[:2])
+        )
+        url = f'/api/recipes/{data["id"]}/'
+        kept = IngredientRecipe.objects.get(
+            recipe_id=data['id'], ingredient=self.ingredients[0]
+        )
+        payload = self.get_payload(self.ingredients[5:], self.tags[1:])
+        payload['ingredients'][0]['amount'] = 9
+        with self.assertNumQueries(19):
+            response = self.client.patch(url, payload, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        amounts = dict(IngredientRecipe.objects.filter(
+            recipe_id=data['id']
+        ).values_list('ingredient_id', 'amount'))
+        self.assertEqual(set(amounts), {
+            ingredient.id for ingredient in self.ingredients[5:]
+        })
+        self.assertEqual(amounts[self.ingredients[5].id], 9)
+        self.assertFalse(
+            IngredientRecipe.objects.filter(id=kept.id).exists()
+        )
+        self.assertEqual(
+            sorted(tag['id'] for tag in response.json()['tags']),
+            [tag.id for tag in self.tags[1:]]
+        )
+
+    def test_unknown_and_duplicate_ingredients(self):
+        payload = self.get_payload(self.ingredients[:2], self.tags[:1])
+        payload['ingredients'][1]['id'] = payload['ingredients'][0]['id']
+        response = self.client.post('/api/recipes/', payload, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        payload['ingredients'][1]['id'] = 0
+        response = self.client.post('/api/recipes/', payload, format='json')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+
+class RecipeExportImportTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, True)
+
+    def test_round_trip(self):
+        """Выгруженные рецепты загружаются обратно со всеми связями."""
+        author = make_user('author')
+        tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit='г'
+        )
+        for number in range(3):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}', text='Описание', author=author,
+                cooking_time=10,
+                image=ContentFile(b'image', name=f'image{number}.png')
+            )
+            recipe.tags.add(tag)
+            IngredientRecipe.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=number + 1
+            )
+        pub_dates = list(Recipe.objects.values_list('pub_date', flat=True))
+        path = os.path.join(self.media_root, 'recipes.jsonl')
+        call_command('export_recipes', path, '--batch-size=2',
+                     stderr=io.StringIO())
+        Recipe.objects.all().delete()
+        User.objects.all().delete()
+        Tag.objects.all().delete()
+        versions = {
+            name: get_cache_version(name)
+            for name in ('recipe', 'tag', 'ingredient')
+        }
+
+        call_command('import_recipes', path, '--batch-size=2',
+                     '--workers=1', stdout=io.StringIO())
+
+        # Тег создан заново, ингредиент остался прежним.
+        self.assertEqual(
+            {
+                name: get_cache_version(name) != version
+                for name, version in versions.items()
+            },
+            {'recipe': True, 'tag': True, 'ingredient': False}
+        )
+
+        recipes = Recipe.objects.with_related().order_by('name')
+        self.assertEqual(len(recipes), 3)
+        self.assertEqual(
+            sorted(recipe.pub_date for recipe in recipes), sorted(pub_dates)
+        )
+        for number, recipe in enumerate(recipes):
+            self.assertEqual(recipe.author.email, 'author@example.com')
+            self.assertEqual(
+                [tag.slug for tag in recipe.tags.all()], ['breakfast']
+            )
+            amounts = recipe.amount_ingredients.all()
+            self.assertEqual(amounts[0].ingredient, ingredient)
+            self.assertEqual(amounts[0].amount, number + 1)
+            with recipe.image.open('rb') as file:
+                self.assertEqual(file.read(), b'image')
+        self.assertEqual(recipes[0].author.recipes_count, 3)
+
+    def export_recipe(self):
+        """Выгружает рецепт с изображением и удаляет его и автора."""
+        recipe = Recipe.objects.create(
+            name='Рецепт', text='Описание', author=make_user('author'),
+            cooking_time=10, image=ContentFile(b'image', name='image.png')
+        )
+        path = os.path.join(self.media_root, 'recipes.jsonl')
+        call_command('export_recipes', path, stderr=io.StringIO())
+        recipe.image.delete(save=False)
+        Recipe.objects.all().delete()
+        User.objects.all().delete()
+        return path
+
+    def get_images(self):
+        return os.listdir(os.path.join(self.media_root, 'recipes', 'images'))
+
+    def test_username_taken(self):
+        """Автор с занятым именем пропускается, его изображения удаляются."""
+        path = self.export_recipe()
+        User.objects.create_user(username='author', email='other@example.com')
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_recipes', path, '--workers=1',
+                     stdout=stdout, stderr=stderr)
+        self.assertIn('author@example.com', stderr.getvalue())
+        self.assertIn('пропущено 1', stdout.getvalue())
+        self.assertFalse(Recipe.objects.exists())
+        self.assertEqual(self.get_images(), [])
+
+    def test_rollback_deletes_images(self):
+        """Изображения пачки, которая откатилась, удаляются."""
+        path = self.export_recipe()
+        with mock.patch(
+            'recipes.management.commands.import_recipes.fan_out',
+            side_effect=RuntimeError
+        ), self.assertRaises(RuntimeError):
+            call_command('import_recipes', path, '--workers=1',
+                         stdout=io.StringIO())
+        self.assertFalse(Recipe.objects.exists())
+        self.assertEqual(self.get_images(), [])
+
+
+class LoadIngredientsTestCase(TestCase):
+    def setUp(self):
+        ingredient_index.invalidate()
+        cache.clear()
+
+    def load(self, *args):
+        out = io.StringIO()
+        call_command('load_ingredients_from_csv', *args, stdout=out)
+        return out.getvalue()
+
+    def test_repeated_load_is_idempotent(self):
+        """Повторная загрузка CSV и JSON не создает дубликатов."""
+        self.load('--batch-size=500')
+        count = Ingredient.objects.count()
+        self.assertGreater(count, 0)
+        json_path = os.path.join(settings.BASE_DIR, 'data', 'ingredients.json')
+        output = self.load(json_path, '--batch-size=500')
+        self.assertIn('добавлено 0', output)
+        self.assertEqual(Ingredient.objects.count(), count)
+
+    def test_catalog_version_bumped(self):
+        """Воркеры узнают о загрузке по версии каталога в кэше."""
+        version = get_cache_version('ingredient')
+        output = self.load('--batch-size=500')
+        self.assertNotEqual(get_cache_version('ingredient'), version)
+        self.assertIn('перезапустите', output)
+
+    def test_no_warning_with_shared_cache(self):
+        with tempfile.TemporaryDirectory() as location, override_settings(
+            CACHES={'default': {
+                'BACKEND':
+                    'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            }}
+        ):
+            output = self.load('--batch-size=500')
+        self.assertNotIn('перезапустите', output)
+
+    def test_dry_run_writes_nothing(self):
+        """Пробный запуск только считает новые ингредиенты."""
+        Ingredient.objects.create(
+            name='абрикосовое варенье', measurement_unit='г'
+        )
+        output = self.load('--dry-run')
+        self.assertIn('Пробный запуск', output)
+        self.assertEqual(Ingredient.objects.count(), 1)
+
+
+class CountersTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('reader')
+        cls.author = make_user('author')
+        cls.recipe = Recipe.objects.create(
+            name='Рецепт', text='Описание', author=cls.author, cooking_time=10
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertCounters(self, favorites_count, cart_count):
+        self.recipe.refresh_from_db()
+        self.assertEqual(
+            (self.recipe.favorites_count, self.recipe.cart_count),
+            (favorites_count, cart_count)
+        )
+
+    def test_favorite_and_cart(self):
+        """Счетчики меняются при добавлении и удалении через API."""
+        url = f'/api/recipes/{self.recipe.id}/'
+        self.client.post(url + 'favorite/')
+        self.client.post(url + 'shopping_cart/')
+        self.assertCounters(1, 1)
+        self.client.delete(url + 'favorite/')
+        self.assertCounters(0, 1)
+
+    def test_cascade(self):
+        """Удаление пользователя уменьшает счетчики его рецептов."""
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipe)
+        self.user.delete()
+        self.assertCounters(0, 0)
+
+    def test_recipes_count(self):
+        """Счетчик рецептов автора и поле recipes_count подписок."""
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 1)
+        Subscription.objects.create(user=self.user, author=self.author)
+        response = self.client.get('/api/users/subscriptions/')
+        self.assertEqual(response.json()['results'][0]['recipes_count'], 1)
+        self.recipe.delete()
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 0)
+
+    def test_save_keeps_counters(self):
+        """Сохранение устаревшего объекта не затирает счетчики."""
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        stale.name = 'Новое название'
+        stale.save()
+        self.assertCounters(1, 0)
+
+    def test_recount(self):
+        """Команда recount исправляет разошедшиеся счетчики."""
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        Recipe.objects.update(favorites_count=5, cart_count=2)
+        User.objects.update(recipes_count=0)
+        fixed = recount()
+        self.assertEqual(fixed['recipes.Recipe.favorites_count'], 1)
+        self.assertEqual(fixed['users.User.recipes_count'], 1)
+        self.assertCounters(1, 0)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 1)
+        self.assertEqual(
+            recount(), dict.fromkeys(fixed, 0)
+        )
+
+
+class RecipeAdminQueriesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = make_user('admin', is_staff=True, is_superuser=True)
+        tags = [
+            Tag.objects.create(name=f'Тег {number}', slug=f'tag{number}')
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(5)
+        ]
+        Ingredient.objects.create(name='ваниль', measurement_unit='г')
+        for number in range(5):
+            author = make_user(f'author{number}')
+            cls.recipe = Recipe.objects.create(
+                name=f'Рецепт {number}', text='Описание',
+                author=author, cooking_time=10
+            )
+            cls.recipe.tags.set(tags)
+            for ingredient in ingredients:
+                IngredientRecipe.objects.create(
+                    recipe=cls.recipe, ingredient=ingredient, amount=1
+                )
+            Favorite.objects.create(user=cls.admin, recipe=cls.recipe)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_changelist_queries(self):
+        """Число запросов списка рецептов не зависит от числа строк."""
+        with self.assertNumQueries(8):
+            response = self.client.get('/admin/recipes/recipe/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertContains(response, 'Рецепт 4')
+
+    def test_change_view_queries(self):
+        """Форма рецепта не загружает списки ингредиентов и авторов.
+
+        Виджет автодополнения делает по запросу на строку инлайна:
+        5 ингредиентов и 3 тега.
+        """
+        with self.assertNumQueries(17):
+            response = self.client.get(
+                f'/admin/recipes/recipe/{self.recipe.id}/change/'
+            )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotContains(response, 'ваниль')
+
+    def test_user_changelist_filters(self):
+        """Фильтры пользователей не перечисляют значения из таблицы."""
+        response = self.client.get('/admin/users/user/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertContains(response, '?is_active__exact=1')
+        self.assertNotContains(response, '?email=')
+
+
+class FeedTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('reader')
+        cls.authors = [make_user(f'author{number}') for number in range(3)]
+        for author in cls.authors:
+            for number in range(2):
+                Recipe.objects.create(
+                    name=f'Рецепт {number}', text='Описание',
+                    author=author, cooking_time=10
+                )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def subscribe(self, *authors):
+        for author in authors:
+            Subscription.objects.create(user=self.user, author=author)
+
+    def get_feed_ids(self):
+        self.user.refresh_from_db()
+        self.client.force_authenticate(self.user)
+        url = '/api/recipes/feed/?limit=2'
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            ids += [item['id'] for item in response.json()['results']]
+            url = response.json()['next']
+        return ids
+
+    def get_expected_ids(self):
+        return list(Recipe.objects.filter(
+            author__subscribing__user=self.user
+        ).order_by('-pub_date', '-id').values_list('id', flat=True))
+
+    def test_semi_join(self):
+        """Лента без FeedEntry: только подписки, новые первыми."""
+        self.subscribe(*self.authors[:2])
+        ids = self.get_feed_ids()
+        self.assertEqual(len(ids), 4)
+        self.assertEqual(ids, self.get_expected_ids())
+        self.assertFalse(FeedEntry.objects.exists())
+
+    def test_page_queries(self):
+        """Страница ленты: рецепты, ингредиенты, теги и подписки."""
+        self.subscribe(*self.authors)
+        self.user.refresh_from_db()
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(4):
+            self.client.get('/api/recipes/feed/?limit=2')
+
+    @override_settings(FEED_FANOUT_THRESHOLD=2)
+    def test_timeline(self):
+        """После порога лента читается из FeedEntry и пополняется."""
+        self.subscribe(*self.authors[:2])
+        self.assertEqual(FeedEntry.objects.filter(user=self.user).count(), 4)
+        Recipe.objects.create(
+            name='Новый рецепт', text='Описание',
+            author=self.authors[0], cooking_time=10
+        )
+        self.subscribe(self.authors[2])
+        ids = self.get_feed_ids()
+        self.assertEqual(len(ids), 7)
+        self.assertEqual(ids, self.get_expected_ids())
+
+    @override_settings(FEED_FANOUT_THRESHOLD=2)
+    def test_unsubscribe(self):
+        """Отписка убирает автора, ниже порога лента удаляется."""
+        self.subscribe(*self.authors)
+        Subscription.objects.get(
+            user=self.user, author=self.authors[0]
+        ).delete()
+        self.assertFalse(FeedEntry.objects.filter(
+            recipe__author=self.authors[0]
+        ).exists())
+        self.assertEqual(self.get_feed_ids(), self.get_expected_ids())
+        Subscription.objects.get(
+            user=self.user, author=self.authors[1]
+        ).delete()
+        self.assertFalse(FeedEntry.objects.exists())
+        self.assertEqual(self.get_feed_ids(), self.get_expected_ids())
+
+    def test_anonymous(self):
+        response = self.client.get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+
+class RecipeSearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = make_user('author')
+        cls.other = make_user('other')
+        beet = Ingredient.objects.create(name='свекла', measurement_unit='г')
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.by_name = Recipe.objects.create(
+                name='Борщ украинский', text='Суп на бульоне',
+                author=cls.author, cooking_time=10
+            )
+            cls.by_text = Recipe.objects.create(
+                name='Обед', text='Вместо борща можно сварить щи',
+                author=cls.author, cooking_time=10
+            )
+            cls.by_ingredient = Recipe.objects.create(
+                name='Салат', text='Нарезать и смешать',
+                author=cls.other, cooking_time=10
+            )
+            IngredientRecipe.objects.create(
+                recipe=cls.by_ingredient, ingredient=beet, amount=1
+            )
+            Recipe.objects.create(
+                name='Омлет', text='Яйца и молоко',
+                author=cls.author, cooking_time=10
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query):
+        response = self.client.get(f'/api/recipes/?{query}')
+        return [item['id'] for item in response.json()['results']]
+
+    def test_ranked(self):
+        """Совпадение в названии выше совпадения в описании."""
+        self.assertEqual(
+            self.search('search=борщ'), [self.by_name.id, self.by_text.id]
+        )
+
+    def test_ingredients(self):
+        self.assertEqual(
+            self.search('search=свекла'), [self.by_ingredient.id]
+        )
+
+    def test_with_filters(self):
+        self.assertEqual(
+            self.search(f'search=борщ&author={self.other.id}'), []
+        )
+
+    def test_cursor_pagination_rejected(self):
+        """Курсор не хранит релевантность, с поиском он недоступен."""
+        response = self.client.get(
+            '/api/recipes/?search=борщ&pagination=cursor'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertIn('pagination', response.json())
+        self.assertEqual(
+            self.search('search=борщ&pagination=cursor&ordering=popular'),
+            [self.by_text.id, self.by_name.id]
+        )
+
+    def test_vector_updated_on_save(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.by_text.text = 'Котлеты с пюре'
+            self.by_text.save()
+        self.assertEqual(self.search('search=борщ'), [self.by_name.id])
+        self.assertEqual(self.search('search=котлеты'), [self.by_text.id])
+
+    def test_vector_not_selected(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get('/api/recipes/')
+        for query in context.captured_queries:
+            self.assertNotIn('search_vector', query['sql'])
+
+    @postgres_only
+    def test_search_index(self):
+        """GIN-индекс вектора создается после migrate."""
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, Recipe._meta.db_table
+            )
+        self.assertEqual(
+            constraints['recipe_search_vector_idx']['type'], 'gin'
+        )
+
+
+@override_settings(RECIPE_SEARCH_BACKEND='python')
+class RecipePythonSearchTestCase(RecipeSearchTestCase):
+    """Те же проверки для поиска без полнотекстового индекса."""
+
+    def test_case_insensitive(self):
+        """Регистр кириллицы не важен, нужны все слова запроса."""
+        self.assertEqual(
+            self.search('search=БОРЩ Украинский'), [self.by_name.id]
+        )
+        self.assertEqual(self.search('search=борщ котлеты'), [])
+
+
+class RecipeByIngredientsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = make_user('author')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(4)
+        ]
+        cls.recipes = {}
+        for name, indexes in (
+            ('full', (0, 1)),
+            ('half', (0, 2)),
+            ('third', (1, 2, 3)),
+            ('none', (3,)),
+        ):
+            recipe = Recipe.objects.create(
+                name=name, text='Описание', author=cls.author,
+                cooking_time=10
+            )
+            for index in indexes:
+                IngredientRecipe.objects.create(
+                    recipe=recipe, ingredient=cls.ingredients[index],
+                    amount=1
+                )
+            cls.recipes[name] = recipe
+
+    def setUp(self):
+        cache.clear()
+        recipe_ingredient_index.invalidate()
+
+    def get(self, *indexes, params=''):
+        ids = ','.join(str(self.ingredients[index].id) for index in indexes)
+        return self.client.get(
+            f'/api/recipes/by-ingredients/?ids={ids}{params}'
+        )
+
+    def get_names(self, *indexes):
+        return [
+            item['name'] for item in self.get(*indexes).json()['results']
+        ]
+
+    def test_ranking_and_missing(self):
+        """Сначала рецепты с большей долей имеющихся ингредиентов."""
+        response = self.get(0, 1)
+        results = response.json()['results']
+        self.assertEqual(response.json()['count'], 3)
+        self.assertEqual(
+            [item['name'] for item in results], ['full', 'half', 'third']
+        )
+        self.assertEqual(results[0]['missing_ingredients'], [])
+        self.assertEqual(
+            [item['id'] for item in results[1]['missing_ingredients']],
+            [self.ingredients[2].id]
+        )
+        self.assertEqual(len(results[2]['missing_ingredients']), 2)
+
+    def test_pagination_queries(self):
+        """Индекс строится одним запросом, страница читается из БД."""
+        self.get(0)
+        with self.assertNumQueries(3):
+            response = self.get(0, 1, 2, params='&limit=2&page=2')
+        self.assertEqual(response.json()['count'], 3)
+        self.assertEqual(len(response.json()['results']), 1)
+
+    def test_incremental_update(self):
+        """Записи рецептов попадают в построенный индекс."""
+        self.assertEqual(self.get_names(3), ['none', 'third'])
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.create(
+                name='new', text='Описание', author=self.author,
+                cooking_time=10
+            )
+            IngredientRecipe.objects.create(
+                recipe=recipe, ingredient=self.ingredients[3], amount=1
+            )
+        self.assertEqual(self.get_names(3), ['new', 'none', 'third'])
+        with self.captureOnCommitCallbacks(execute=True):
+            IngredientRecipe.objects.filter(
+                recipe=self.recipes['third'], ingredient=self.ingredients[3]
+            ).delete()
+            self.recipes['none'].delete()
+        self.assertEqual(self.get_names(3), ['new'])
+        self.assertEqual(self.get_names(1), ['third', 'full'])
+
+    def test_stale_index_served_while_rebuilding(self):
+        """После TTL поиск не ждет перестроения и читает прежний индекс."""
+        self.get(3)
+        recipe = Recipe.objects.create(
+            name='new', text='Описание', author=self.author, cooking_time=10
+        )
+        IngredientRecipe.objects.create(
+            recipe=recipe, ingredient=self.ingredients[3], amount=1
+        )
+        with mock.patch.object(
+            recipe_ingredient_index, '_start_rebuild'
+        ) as start_rebuild, override_settings(RECIPE_INGREDIENT_INDEX_TTL=0):
+            self.assertEqual(self.get_names(3), ['none', 'third'])
+            self.assertEqual(self.get_names(3), ['none', 'third'])
+        start_rebuild.assert_called_once_with()
+        with self.captureOnCommitCallbacks(execute=True):
+            IngredientRecipe.objects.filter(
+                recipe=self.recipes['third'], ingredient=self.ingredients[3]
+            ).delete()
+        recipe_ingredient_index.rebuild()
+        self.assertEqual(self.get_names(3), ['new', 'none'])
+
+    def test_invalid_ids(self):
+        response = self.client.get('/api/recipes/by-ingredients/?ids=a')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        response = self.client.get('/api/recipes/by-ingredients/')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+
+class SimilarRecipesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = make_user('author')
+        cls.tag = Tag.objects.create(name='Суп', slug='soup')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(6)
+        ]
+        cls.recipes = {}
+        for name, indexes in (
+            ('borscht', (0, 1, 2)),
+            ('cabbage soup', (0, 1, 3)),
+            ('beet salad', (2, 4)),
+            ('omelette', (5,)),
+        ):
+            cls.recipes[name] = cls.create_recipe(name, indexes)
+
+    @classmethod
+    def create_recipe(cls, name, indexes):
+        recipe = Recipe.objects.create(
+            name=name, text='Описание', author=cls.author, cooking_time=10
+        )
+        for index in indexes:
+            IngredientRecipe.objects.create(
+                recipe=recipe, ingredient=cls.ingredients[index], amount=1
+            )
+        return recipe
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        similarity = override_settings(RECIPE_SIMILARITY_DIR=directory)
+        similarity.enable()
+        self.addCleanup(similarity.disable)
+        similarity_index.invalidate()
+
+    def get_similar(self, name):
+        response = self.client.get(
+            f'/api/recipes/{self.recipes[name].id}/similar/'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [item['name'] for item in response.json()]
+
+    def test_similar(self):
+        """Похожие рецепты упорядочены по сходству, без самого рецепта."""
+        self.assertEqual(build_model(), (4, 4))
+        self.assertEqual(
+            self.get_similar('borscht'), ['cabbage soup', 'beet salad']
+        )
+        self.assertEqual(self.get_similar('omelette'), [])
+
+    def test_without_model(self):
+        self.assertEqual(self.get_similar('borscht'), [])
+        response = self.client.get('/api/recipes/0/similar/')
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_incremental(self):
+        """Пересчитываются только затронутые изменениями рецепты."""
+        build_model()
+        self.assertEqual(build_model(incremental=True), (4, 0))
+        self.recipes['omelette 2'] = self.create_recipe('omelette 2', (5,))
+        recipes, updated = build_model(incremental=True)
+        self.assertEqual((recipes, updated), (5, 2))
+        self.assertEqual(self.get_similar('omelette'), ['omelette 2'])
+        self.assertEqual(
+            self.get_similar('borscht'), ['cabbage soup', 'beet salad']
+        )
+        self.recipes['borscht'].delete()
+        build_model(incremental=True)
+        self.assertEqual(self.get_similar('beet salad'), [])
+
+    def test_query_count(self):
+        build_model()
+        with self.assertNumQueries(2):
+            self.get_similar('borscht')
+
+
+class RecipeRankingTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = make_user('author')
+        cls.users = [make_user(f'user{number}') for number in range(4)]
+        cls.recipes = {
+            name: Recipe.objects.create(
+                name=name, text='Описание', author=cls.author,
+                cooking_time=10
+            )
+            for name in ('classic', 'fresh', 'quiet')
+        }
+        # Запуски идут позже событий больше чем на RECIPE_SCORE_LAG.
+        cls.now = timezone.now()
+        cls.run_at = cls.now + timedelta(minutes=5)
+
+    def setUp(self):
+        cache.clear()
+
+    def add_events(self, model, name, users, days_ago):
+        model.objects.bulk_create(
+            model(user=user, recipe=self.recipes[name]) for user in users
+        )
+        model.objects.filter(
+            recipe=self.recipes[name], user__in=users
+        ).update(date_added=self.now - timedelta(days=days_ago))
+
+    def get_names(self, ordering, params=''):
+        response = self.client.get(
+            f'/api/recipes/?ordering={ordering}{params}'
+        )
+        return [item['name'] for item in response.json()['results']]
+
+    def test_trending_and_popular(self):
+        """Свежая активность важнее для trending, объем - для popular."""
+        self.add_events(Favorite, 'classic', self.users, days_ago=20)
+        self.add_events(Favorite, 'fresh', self.users[:1], days_ago=0)
+        self.add_events(ShoppingCart, 'fresh', self.users[:1], days_ago=0)
+        self.assertEqual(update_scores(now=self.run_at), 2)
+        self.assertEqual(
+            self.get_names('trending'), ['fresh', 'classic', 'quiet']
+        )
+        self.assertEqual(
+            self.get_names('popular'), ['classic', 'fresh', 'quiet']
+        )
+
+    def test_incremental_windows(self):
+        """Следующий запуск читает только новые события."""
+        self.add_events(Favorite, 'classic', self.users[:2], days_ago=1)
+        update_scores(now=self.run_at)
+        self.assertEqual(update_scores(now=self.run_at), 0)
+        # Событие после границы первого запуска.
+        self.add_events(Favorite, 'quiet', self.users[:3], days_ago=-0.02)
+        self.assertEqual(
+            update_scores(now=self.run_at + timedelta(hours=1)), 1
+        )
+        self.assertEqual(
+            self.get_names('trending'), ['quiet', 'classic', 'fresh']
+        )
+
+    @override_settings(RECIPE_TRENDING_HALF_LIFE=600)
+    def test_rebase_keeps_order(self):
+        """Перенос опорной даты не меняет порядок рейтинга."""
+        self.add_events(Favorite, 'classic', self.users[:2], days_ago=0)
+        self.add_events(Favorite, 'fresh', self.users[:1], days_ago=0)
+        update_scores(now=self.run_at)
+        update_scores(now=self.run_at + timedelta(days=2))
+        self.assertEqual(
+            self.get_names('trending'), ['classic', 'fresh', 'quiet']
+        )
+
+    def test_cursor(self):
+        self.add_events(Favorite, 'classic', self.users[:2], days_ago=0)
+        update_scores(now=self.run_at)
+        url = '/api/recipes/?ordering=trending&pagination=cursor&limit=1'
+        names = []
+        while url:
+            response = self.client.get(url)
+            names += [item['name'] for item in response.json()['results']]
+            url = response.json()['next']
+        self.assertEqual(names[0], 'classic')
+        self.assertEqual(sorted(names[1:]), ['fresh', 'quiet'])
+
+    def test_missing_scores_backfilled(self):
+        """После migrate у каждого рецепта есть строка рейтинга."""
+        self.add_events(Favorite, 'classic', self.users[:2], days_ago=0)
+        update_scores(now=self.run_at)
+        RecipeScore.objects.filter(recipe=self.recipes['quiet']).delete()
+        backfill_recipe_scores(sender=None, using='default')
+        self.assertEqual(
+            self.get_names('popular'), ['classic', 'quiet', 'fresh']
+        )
+
+    def test_recipe_delete_skips_score_updates(self):
+        """Каскадное удаление избранного не вычитает из рейтинга."""
+        self.add_events(Favorite, 'classic', self.users, days_ago=0)
+        update_scores(now=self.run_at)
+        with CaptureQueriesContext(connection) as queries:
+            self.recipes['classic'].delete()
+        self.assertFalse([
+            query for query in queries
+            if query['sql'].startswith('UPDATE "recipes_recipescore"')
+        ])
+
+    @postgres_only
+    def test_ranked_page_uses_score_index(self):
+        """Страница рейтинга читается по индексу, без сортировки."""
+        plan = RecipeFilter().get_ordering(
+            Recipe.objects.all(), 'ordering', 'trending'
+        )[:6].explain()
+        self.assertIn('recipe_score_trending_idx', plan)
+        self.assertNotIn('Sort', plan)
+
+    def test_removal_lowers_score(self):
+        """Удаление из избранного и корзины вычитает вклад события."""
+        self.add_events(Favorite, 'classic', self.users[:2], days_ago=0)
+        self.add_events(Favorite, 'fresh', self.users[:1], days_ago=0)
+        self.add_events(ShoppingCart, 'fresh', self.users[:1], days_ago=0)
+        update_scores(now=self.run_at)
+        self.assertEqual(
+            self.get_names('trending'), ['classic', 'fresh', 'quiet']
+        )
+        Favorite.objects.filter(
+            recipe=self.recipes['classic'], user=self.users[0]
+        ).delete()
+        # Лента анонимов обновится по RECIPE_CACHE_TIMEOUT.
+        cache.clear()
+        self.assertEqual(
+            self.get_names('trending'), ['fresh', 'classic', 'quiet']
+        )
+        ShoppingCart.objects.filter(recipe=self.recipes['fresh']).delete()
+        Favorite.objects.filter(recipe=self.recipes['fresh']).delete()
+        self.assertAlmostEqual(
+            RecipeScore.objects.get(recipe=self.recipes['fresh']).popular, 0
+        )
+
+
+@override_settings(ASYNC_READ_THREAD_POOL=False)
+class AsyncReadPathTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = make_user('author')
+        cls.token = Token.objects.create(user=cls.author)
+        cls.tag = Tag.objects.create(name='Обед', slug='lunch')
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        cls.recipe = Recipe.objects.create(
+            name='Рецепт', text='Описание', author=cls.author, cooking_time=10
+        )
+        cls.recipe.tags.add(cls.tag)
+
+    def setUp(self):
+        cache.clear()
+        ingredient_index.invalidate()
+
+    def request(self, method, path, token=None, **headers):
+        """Запрос через ASGI-обработчик, как под uvicorn."""
+        if token is not None:
+            headers['authorization'] = f'Token {token}'
+        headers = {
+            name.replace('_', '-'): value for name, value in headers.items()
+        }
+
+        async def send():
+            return await getattr(self.async_client, method)(path, **headers)
+        return async_to_sync(send)()
+
+    def test_reference_from_cache(self):
+        """Повторный запрос тегов отдается из кэша без БД."""
+        response = self.request('get', '/api/tags/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            cached = self.request('get', '/api/tags/')
+            not_modified = self.request(
+                'get', '/api/tags/', if_none_match=etag
+            )
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['ETag'], etag)
+        self.assertEqual(not_modified.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_anonymous_recipes_from_cache(self):
+        """Кэшированная лента совпадает с ответом вьюсета под WSGI."""
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.id}/'):
+            response = self.request('get', url)
+            self.assertEqual(response['X-Cache'], 'MISS')
+            with self.assertNumQueries(0):
+                response = self.request('get', url)
+            self.assertEqual(response['X-Cache'], 'HIT')
+            self.assertEqual(response.content, self.client.get(url).content)
+
+    def test_authenticated_not_cached(self):
+        response = self.request('get', '/api/recipes/', token=self.token.key)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotIn('X-Cache', response)
+        self.assertFalse(response.json()['results'][0]['is_favorited'])
+
+    def test_ingredient_search_from_index(self):
+        """Поиск по построенному индексу не обращается к БД."""
+        self.request('get', '/api/ingredients/?name=со')
+        with self.assertNumQueries(0):
+            response = self.request('get', '/api/ingredients/?name=с')
+        self.assertEqual(response.json()[0]['name'], 'соль')
+
+    def test_browsable_api_not_from_cache(self):
+        self.request('get', '/api/tags/')
+        response = self.request('get', '/api/tags/', accept='text/html')
+        self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+
+    def test_write_passes_through(self):
+        """Изменяющие запросы по тем же адресам доходят до вьюсета."""
+        response = self.request(
+            'delete', f'/api/recipes/{self.recipe.id}/', token=self.token.key
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_list_actions_not_caught_by_detail(self):
+        """Действия списка рецептов не принимаются за id рецепта."""
+        ingredient = Ingredient.objects.get()
+        for path in (
+            '/api/recipes/feed/',
+            f'/api/recipes/by-ingredients/?ids={ingredient.id}',
+        ):
+            with self.subTest(path=path):
+                response = self.request('get', path, token=self.token.key)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                self.assertIn('results', response.json())
+
+    def call_application(self, path, token):
+        """Статус и тело ответа прямо от foodgram.asgi.application.
+
+        AsyncClient не отправляет ответ через ASGIHandler, поэтому
+        потоковое тело перебиралось бы не в цикле событий.
+        """
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'},
+            'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': b'',
+            'root_path': '', 'client': ('127.0.0.1', 0),
+            'server': ('testserver', 80),
+            'headers': [
+                (b'host', b'testserver'),
+                (b'authorization', f'Token {token}'.encode()),
+            ],
+        }
+        # Как тестовый клиент: соединение держит транзакцию теста.
+        for signal in (request_started, request_finished):
+            signal.disconnect(close_old_connections)
+        try:
+            async_to_sync(application)(scope, receive, send)
+        finally:
+            for signal in (request_started, request_finished):
+                signal.connect(close_old_connections)
+        return messages[0]['status'], b''.join(
+            message.get('body', b'') for message in messages[1:]
+        )
+
+    def test_shopping_list_download(self):
+        """Потоковый файл под ASGI отдается целиком, без ORM в цикле."""
+        ingredient = Ingredient.objects.get()
+        IngredientRecipe.objects.create(
+            recipe=self.recipe, ingredient=ingredient, amount=5
+        )
+        ShoppingCart.objects.create(user=self.author, recipe=self.recipe)
+        status_code, body = self.call_application(
+            '/api/recipes/download_shopping_cart/', self.token.key
+        )
+        self.assertEqual(status_code, HTTPStatus.OK)
+        self.assertIn('соль (г) - 5', body.decode())
+
+
+class AsyncReadThreadPoolTestCase(TransactionTestCase):
+    @override_settings(SERVER_TIMING_HEADER=True)
+    def test_read_in_thread_pool(self):
+        """Промах кэша выполняется в потоке пула со своим соединением."""
+        author = make_user('author')
+        Recipe.objects.create(
+            name='Рецепт', text='Описание', author=author, cooking_time=10
+        )
+        cache.clear()
+
+        async def send():
+            return await self.async_client.get('/api/recipes/')
+        response = async_to_sync(send)()
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.json()['count'], 1)
+        # Запросы из потока пула попадают в замеры запроса.
+        self.assertNotIn('desc="0 queries"', response['Server-Timing'])
+
+
+TEST_REPLICA = 'test_replica'
+
+
+@override_settings(
+    DATABASE_REPLICAS=settings.DATABASE_REPLICAS or [TEST_REPLICA]
+)
+class ReplicaRoutingTestCase(TransactionTestCase):
+    """Маршрутизация на реплики из DB_REPLICA_HOSTS.
+
+    Без них тест подключает реплику TEST_REPLICA: второе соединение
+    с тестовой БД, зеркало default.
+    """
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        # До super(): там включается override_settings, а '__all__'
+        # превращается в список соединений.
+        if not settings.DATABASE_REPLICAS:
+            connections.settings[TEST_REPLICA] = {
+                **connections[DEFAULT_DB_ALIAS].settings_dict,
+                'TEST': {'MIRROR': DEFAULT_DB_ALIAS},
+            }
+            cls.addClassCleanup(cls.remove_test_replica)
+        super().setUpClass()
+
+    @classmethod
+    def remove_test_replica(cls):
+        connections[TEST_REPLICA].close()
+        del connections[TEST_REPLICA]
+        del connections.settings[TEST_REPLICA]
+
+    def setUp(self):
+        cache.clear()
+        replica_health.invalidate()
+        self.user = make_user('user')
+        token = Token.objects.create(user=self.user)
+        self.recipe = Recipe.objects.create(
+            name='Рецепт', text='Описание', author=self.user, cooking_time=10
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def request(self, method, path, aliases=None):
+        """Ответ и число запросов к основной БД и к репликам."""
+        aliases = aliases or ['default', *settings.DATABASE_REPLICAS]
+        with ExitStack() as stack:
+            contexts = [
+                stack.enter_context(CaptureQueriesContext(connections[alias]))
+                for alias in aliases
+            ]
+            response = getattr(self.client, method)(path)
+        primary, *replicas = contexts
+        return response, len(primary), sum(map(len, replicas))
+
+    def test_safe_reads_use_replica(self):
+        self.client.get('/api/users/')
+        response, primary, replica = self.request('get', '/api/users/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_writes_pin_reads_to_primary(self):
+        """После записи пользователь читает из основной БД."""
+        response, _, replica = self.request(
+            'post', f'/api/recipes/{self.recipe.id}/favorite/'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual(replica, 0)
+        response, primary, replica = self.request('get', '/api/recipes/')
+        self.assertTrue(response.json()['results'][0]['is_favorited'])
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+        self.client.credentials()
+        _, primary, replica = self.request('get', '/api/users/')
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_failover_to_primary(self):
+        """Недоступная реплика исключается до следующей проверки."""
+        for alias in settings.DATABASE_REPLICAS:
+            connection = connections[alias]
+            connection.close()
+            self.addCleanup(
+                connection.settings_dict.__setitem__,
+                'PORT', connection.settings_dict['PORT']
+            )
+            connection.settings_dict['PORT'] = '1'
+        response, primary, _ = self.request(
+            'get', '/api/users/', aliases=['default']
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertGreater(primary, 0)
+
+
+class CachedTokenAuthenticationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = make_user('user')
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def assertTokenCached(self, cached=True):
+        key = get_token_cache_key(self.token.key)
+        self.assertEqual(cache.get(key) is not None, cached)
+
+    def test_steady_state_skips_token_query(self):
+        """Повторный запрос не читает токен из БД."""
+        self.client.get('/api/users/me/')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.json()['email'], 'user@example.com')
+        self.assertFalse(any(
+            'authtoken_token' in query['sql']
+            for query in queries.captured_queries
+        ))
+        self.assertEqual(get_cache_stats('token'), {'hits': 1, 'misses': 1})
+
+    def test_counters_read_from_database(self):
+        """Счетчики пользователя из кэша не устаревают."""
+        self.client.get('/api/users/me/')
+        User.objects.filter(pk=self.user.pk).update(subscriptions_count=7)
+        user, _ = CachedTokenAuthentication().authenticate_credentials(
+            self.token.key
+        )
+        self.assertEqual(user.subscriptions_count, 7)
+
+    def test_logout_invalidates(self):
+        self.client.get('/api/users/me/')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.assertTokenCached(False)
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+    def test_deactivation_invalidates(self):
+        self.client.get('/api/users/me/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+    def test_password_change_invalidates(self):
+        self.client.get('/api/users/me/')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                '/api/users/set_password/',
+                {'current_password': 'pass', 'new_password': 'N3w-passw0rd'}
+            )
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.assertTokenCached(False)
+
+    def test_last_login_keeps_cache(self):
+        """Сохранение last_login при входе не сбрасывает кэш."""
+        self.client.get('/api/users/me/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.last_login = timezone.now()
+            self.user.save(update_fields=('last_login',))
+        self.assertTokenCached()
+
+
+@override_settings(SERVER_TIMING_HEADER=True)
+class RequestTimingTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = make_user('author')
+        Recipe.objects.create(
+            name='Рецепт', text='Описание', author=cls.author, cooking_time=10
+        )
+        cls.token = Token.objects.create(user=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                '/api/recipes/',
+                HTTP_AUTHORIZATION=f'Token {self.token.key}'
+            )
+        metrics = parse_server_timing(response['Server-Timing'])
+        self.assertEqual(
+            list(metrics),
+            ['db', 'auth', 'serialize', 'render', 'view', 'total']
+        )
+        self.assertIn(
+            f'desc="{len(queries)} queries"', response['Server-Timing']
+        )
+        self.assertGreater(metrics['auth'], 0)
+        self.assertGreater(metrics['serialize'], 0)
+        self.assertGreater(metrics['render'], 0)
+        self.assertAlmostEqual(
+            metrics['total'],
+            metrics['auth'] + metrics['serialize'] + metrics['render']
+            + metrics['view'],
+            places=3
+        )
+
+    @override_settings(SERVER_TIMING_HEADER=False)
+    def test_header_disabled(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/tags/'))
+
+    @override_settings(SLOW_REQUEST_THRESHOLD_MS=0, SLOW_REQUEST_TOP_QUERIES=2)
+    def test_slow_request_logged(self):
+        """Медленный запрос пишется в журнал с самыми долгими SQL."""
+        with self.assertLogs('foodgram.slow_requests', 'WARNING') as logs:
+            self.client.get('/api/recipes/')
+        message = logs.output[0]
+        self.assertIn('GET /api/recipes/', message)
+        self.assertEqual(message.count('SELECT'), 2)
+
+
+class BenchmarkBudgetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'seed_benchmark_data', users=15, recipes=60, ingredients=40,
+            tags=4, favorites=6, cart=4, subscriptions=4, seed=7,
+            stdout=io.StringIO()
+        )
+
+    def setUp(self):
+        cache.clear()
+        ingredient_index.invalidate()
+        recipe_ingredient_index.invalidate()
+
+    def get_snapshot(self):
+        return (
+            sorted(Recipe.objects.values_list(
+                'name', 'author__username', 'cooking_time', 'pub_date'
+            )),
+            sorted(Favorite.objects.values_list(
+                'user__username', 'recipe__name'
+            )),
+            sorted(Subscription.objects.values_list(
+                'user__username', 'author__username'
+            )),
+        )
+
+    def test_seed_is_deterministic(self):
+        snapshot = self.get_snapshot()
+        call_command(
+            'seed_benchmark_data', users=15, recipes=60, ingredients=40,
+            tags=4, favorites=6, cart=4, subscriptions=4, seed=7,
+            clear=True, stdout=io.StringIO()
+        )
+        self.assertEqual(self.get_snapshot(), snapshot)
+        self.assertEqual(recount(), {
+            'recipes.Recipe.favorites_count': 0,
+            'recipes.Recipe.cart_count': 0,
+            'users.User.recipes_count': 0,
+            'users.User.subscriptions_count': 0,
+        })
+
+    def test_query_budgets(self):
+        """Каждый адрес API укладывается в сохраненный бюджет запросов."""
+        results = run_suite(get_context(), repeat=1)
+        self.assertEqual(check_results(results, load_baseline()), [])
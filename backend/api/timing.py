@@ -0,0 +1,129 @@
+import heapq
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.backends.signals import connection_created
+
+PHASES = ('auth', 'serialize', 'render')
+
+_current_timing = ContextVar('request_timing', default=None)
+
+
+class RequestTiming:
+    """ Время запроса по фазам и его запросы к БД.
+
+    Фазы не вкладываются друг в друга: время вложенной фазы
+    относится к внешней. Из запросов к БД хранятся только
+    top_size самых долгих.
+    """
+
+    def __init__(self, top_size):
+        self.started = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.active_phase = None
+        self.queries = 0
+        self.sql = 0.0
+        self.top_size = top_size
+        self.top_queries = []
+
+    def add_query(self, sql, duration):
+        self.queries += 1
+        self.sql += duration
+        item = (duration, self.queries, sql)
+        if len(self.top_queries) < self.top_size:
+            heapq.heappush(self.top_queries, item)
+        elif self.top_size:
+            heapq.heappushpop(self.top_queries, item)
+
+    def get_slowest_queries(self):
+        return [
+            (duration, sql)
+            for duration, _, sql in sorted(self.top_queries, reverse=True)
+        ]
+
+    def get_metrics(self):
+        """ Длительности в секундах: db, фазы, view и total.
+
+        view - время представления без фаз, db пересекается
+        с остальными метриками.
+        """
+        total = time.perf_counter() - self.started
+        metrics = {'db': self.sql, **self.phases}
+        metrics['view'] = max(total - sum(self.phases.values()), 0)
+        metrics['total'] = total
+        return metrics
+
+
+def get_server_timing(metrics, queries):
+    """ Значение заголовка Server-Timing. """
+    return ', '.join(
+        f'{name};dur={duration * 1000:.1f}'
+        + (f';desc="{queries} queries"' if name == 'db' else '')
+        for name, duration in metrics.items()
+    )
+
+
+def start_timing(top_size):
+    timing = RequestTiming(top_size)
+    return timing, _current_timing.set(timing)
+
+
+def finish_timing(token):
+    _current_timing.reset(token)
+
+
+@contextmanager
+def phase(name):
+    """ Относит время блока к фазе name текущего запроса. """
+    timing = _current_timing.get()
+    if timing is None or timing.active_phase is not None:
+        yield
+        return
+    timing.active_phase = name
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.phases[name] += time.perf_counter() - started
+        timing.active_phase = None
+
+
+def record_query(execute, sql, params, many, context):
+    """ Обертка выполнения SQL: время и текст запроса без параметров. """
+    timing = _current_timing.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.add_query(sql, time.perf_counter() - started)
+
+
+def add_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TimedSerializerMixin:
+    """ Относит представление объекта к фазе serialize.
+
+    Нужен только сериализаторам верхнего уровня: фазы не вкладываются,
+    вложенные сериализаторы уже внутри фазы. У many=True замеряется
+    каждый объект, поэтому выборка из БД в фазу не входит.
+    """
+
+    def to_representation(self, instance):
+        with phase('serialize'):
+            return super().to_representation(instance)
+
+
+def install():
+    """ Подключает замер SQL ко всем соединениям с БД.
+
+    Фазы замеряются без подмены классов DRF: auth - в
+    CachedTokenAuthentication, serialize - в TimedSerializerMixin,
+    render - в TimedJSONRenderer.
+    """
+    connection_created.connect(add_query_recorder)
@@ -1,9 +1,70 @@
+from django.conf import settings
+from django.db.models import Sum
 from django.shortcuts import get_object_or_404
 
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework import status
 
-from recipes.models import Recipe, Subscription
+from recipes.models import IngredientRecipe, Recipe, Subscription
+
+
+def get_shopping_list(user):
+    """
+    Суммарное количество ингредиентов из рецептов в корзине user.
+    Группировка по ингредиенту, сортировка по названию.
+    """
+    return IngredientRecipe.objects.filter(
+        recipe__cart__user=user
+    ).values(
+        'ingredient',
+        'ingredient__name',
+        'ingredient__measurement_unit',
+    ).annotate(
+        total=Sum('amount')
+    ).order_by('ingredient__name').values_list(
+        'ingredient__name',
+        'ingredient__measurement_unit',
+        'total',
+    )
+
+
+def get_recipes_limit(request):
+    """
+    Значение параметра recipes_limit из запроса, не больше
+    SUBSCRIPTION_RECIPES_LIMIT. Без параметра или с неверным
+    значением - SUBSCRIPTION_RECIPES_LIMIT.
+    """
+    default = settings.SUBSCRIPTION_RECIPES_LIMIT
+    if request is None:
+        return default
+    try:
+        limit = int(request.query_params.get('recipes_limit'))
+    except (TypeError, ValueError):
+        return default
+    return min(limit, default) if limit >= 0 else default
+
+
+def get_ingredient_ids(request):
+    """
+    Список id ингредиентов из параметра ids: ids=1,2 или ids=1&ids=2.
+    """
+    values = [
+        value.strip()
+        for param in request.query_params.getlist('ids')
+        for value in param.split(',')
+        if value.strip()
+    ]
+    if not values:
+        raise ValidationError({'ids': 'Укажите id ингредиентов.'})
+    if not all(value.isdigit() for value in values):
+        raise ValidationError({'ids': 'id ингредиентов должны быть числами.'})
+    if len(values) > settings.RECIPE_BY_INGREDIENTS_MAX_IDS:
+        raise ValidationError({
+            'ids': 'Не больше '
+                   f'{settings.RECIPE_BY_INGREDIENTS_MAX_IDS} ингредиентов.'
+        })
+    return [int(value) for value in values]
 
 
 def create_object(request, pk, serializer_in, serializer_out, model):
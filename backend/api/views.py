@@ -1,11 +1,21 @@
-from django.db.models import Sum
+from django.db.models import (
+    BooleanField,
+    Exists,
+    F,
+    OuterRef,
+    Prefetch,
+    Value,
+    prefetch_related_objects
+)
+from django.conf import settings
 from django_filters.rest_framework import DjangoFilterBackend
-from django.shortcuts import HttpResponse
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 
 from rest_framework import status, viewsets, permissions
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
 
 from djoser.views import UserViewSet
 
@@ -17,14 +27,41 @@ from recipes.models import (
     Favorite,
     Subscription
 )
-from api.utils import create_object, delete_object
-from api.filters import RecipeFilter
+from recipes.feed import get_feed
+from recipes.search import recipe_ingredient_index, search_ingredients
+from recipes.similarity import similarity_index
+from api.utils import (
+    create_object,
+    delete_object,
+    get_ingredient_ids,
+    get_recipes_limit,
+    get_shopping_list
+)
+from api.cache import (
+    AnonymousRecipeCacheMixin,
+    VersionedCacheMixin,
+    has_recipe_search
+)
+from api.filters import RANK_ORDERINGS, RecipeFilter
+from api.pagination import (
+    FeedPagination,
+    KeysetPaginationMixin,
+    PageLimitPagination,
+    RankKeysetPagination,
+    SubscriptionKeysetPagination
+)
 from api.permissions import OwnerOrReadOnly
+from api.renderers import (
+    TextShoppingListRenderer,
+    CSVShoppingListRenderer,
+    PDFShoppingListRenderer
+)
 from api.serializers import (
     TagSerializer,
     UserSerializer,
     IngredientSerializer,
     RecipeGetSerializer,
+    RecipeMatchSerializer,
     RecipeSerializer,
     RecipeFavoriteSerializer,
     FavoriteSerializer,
@@ -36,45 +73,66 @@ from api.serializers import (
 from users.models import User
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(VersionedCacheMixin, viewsets.ReadOnlyModelViewSet):
     """ Вьюсет для модели Tag """
+    cache_version_name = 'tag'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
     permission_classes = (OwnerOrReadOnly,)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(VersionedCacheMixin, viewsets.ReadOnlyModelViewSet):
     """ Вьюсет для модели Ingredient. """
+    cache_version_name = 'ingredient'
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
     permission_classes = (OwnerOrReadOnly,)
 
-    def get_queryset(self):
-        queryset = Ingredient.objects.all()
-        ingredients = self.request.query_params.get('name')
-        if ingredients is not None:
-            queryset = queryset.filter(name__istartswith=ingredients)
-        return queryset
+    def list(self, request, *args, **kwargs):
+        """ Поиск по параметру name идет через индекс ингредиентов. """
+        name = request.query_params.get('name')
+        if name is None:
+            return super().list(request, *args, **kwargs)
+        serializer = self.get_serializer(search_ingredients(name), many=True)
+        return Response(serializer.data)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(AnonymousRecipeCacheMixin, KeysetPaginationMixin,
+                    viewsets.ModelViewSet):
     """ Вывод для модели Recipe. """
-    pagination_class = PageNumberPagination
+    pagination_class = PageLimitPagination
     permission_classes = (OwnerOrReadOnly,
                           permissions.IsAuthenticatedOrReadOnly,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
     def get_queryset(self):
-        return (Recipe.objects.prefetch_related(
-                'amount_ingredients__ingredient',
-                'tags').all())
+        if self.request.method not in permissions.SAFE_METHODS:
+            return Recipe.objects.all()
+        return Recipe.objects.with_related().with_user_flags(
+            self.request.user
+        )
 
     def perform_create(self, serializer):
         return serializer.save(author=self.request.user)
 
+    def get_keyset_pagination_class(self):
+        """ Курсор по рейтингу для ordering, по дате для ленты.
+
+        Результаты поиска упорядочены по релевантности, которой нет
+        в курсоре, поэтому курсор с поиском без ordering недоступен.
+        """
+        if self.request.query_params.get('ordering') in RANK_ORDERINGS:
+            return RankKeysetPagination
+        if has_recipe_search(self.request.query_params):
+            raise ValidationError({'pagination': (
+                'Курсорная пагинация недоступна для поиска, '
+                'используйте постраничную.'
+            )})
+        return super().get_keyset_pagination_class()
+
     def get_serializer_class(self):
         """ Метод вибирает сериализатор. """
         if self.request.method in permissions.SAFE_METHODS:
@@ -120,35 +178,113 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False, methods=['get'],
-            permission_classes=(permissions.IsAuthenticated,))
+            permission_classes=(permissions.IsAuthenticated,),
+            renderer_classes=(TextShoppingListRenderer,
+                              CSVShoppingListRenderer,
+                              PDFShoppingListRenderer))
     def download_shopping_cart(self, request):
-        """ Скачать файл со списком покупок. """
+        """ Скачать файл со списком покупок.
+
+        Формат выбирается параметром format: txt (по умолчанию), csv, pdf.
+        Строки читаются из БД до ответа: под ASGI Django перебирает
+        потоковый ответ в цикле событий, где ORM недоступна. Строк
+        не больше, чем ингредиентов в каталоге, потоком отдается файл.
+        """
+        renderer = request.accepted_renderer
+        ingredients = list(get_shopping_list(request.user))
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{renderer.format}"'
+        )
+        return response
 
-        ingredient_lst = ShoppingCart.objects.filter(
-            user=request.user
-        ).values_list(
-            'recipe_id__ingredients__name',
-            'recipe_id__ingredients__measurement_unit',
-            Sum('recipe_id__ingredients__amount_ingredients__amount'))
+    @action(detail=False, methods=['get'],
+            permission_classes=(permissions.IsAuthenticated,))
+    def feed(self, request):
+        """ Новые рецепты авторов, на которых подписан пользователь.
 
-        shopping_list = ['Список покупок:']
-        ingredient_lst = set(ingredient_lst)
+        Всегда курсорная пагинация, фильтры те же, что у списка.
+        """
+        queryset = self.filter_queryset(
+            get_feed(request.user).with_related().with_user_flags(
+                request.user
+            )
+        )
+        paginator = FeedPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
-        for ingredient in ingredient_lst:
-            shopping_list.append('{} ({}) - {}'.format(*ingredient))
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk):
+        """ Похожие рецепты из модели build_recipe_similarity.
 
-        response = HttpResponse('\n'.join(shopping_list),
-                                content_type='text/plain')
-        response['Content-Disposition'] = \
-            'attachment; filename="shopping_list.txt"'
-        return response
+        Параметр limit ограничивает число рецептов.
+        """
+        recipe = get_object_or_404(Recipe.objects.only('id'), pk=pk)
+        limit = settings.RECIPE_SIMILARITY_TOP_K
+        try:
+            limit = min(int(request.query_params['limit']), limit)
+        except (KeyError, ValueError):
+            pass
+        recipe_ids = similarity_index.similar(recipe.id, max(limit, 0))
+        recipes = Recipe.objects.in_bulk(recipe_ids)
+        serializer = RecipeFavoriteSerializer(
+            [
+                recipes[recipe_id] for recipe_id in recipe_ids
+                if recipe_id in recipes
+            ],
+            many=True,
+            context=self.get_serializer_context()
+        )
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'], url_path='by-ingredients')
+    def by_ingredients(self, request):
+        """ Рецепты, которые можно приготовить из ингредиентов ids.
 
+        Ранжирование идет по обратному индексу в памяти, из БД
+        читается только текущая страница рецептов.
+        """
+        ingredient_ids = get_ingredient_ids(request)
+        paginator = PageLimitPagination()
+        page = paginator.paginate_queryset(
+            recipe_ingredient_index.search(ingredient_ids), request, view=self
+        )
+        recipes = self.get_queryset().in_bulk(page)
+        serializer = RecipeMatchSerializer(
+            [recipes[recipe_id] for recipe_id in page if recipe_id in recipes],
+            many=True,
+            context={
+                **self.get_serializer_context(),
+                'ingredient_ids': frozenset(ingredient_ids),
+            }
+        )
+        return paginator.get_paginated_response(serializer.data)
 
-class CustomUserViewSet(UserViewSet):
+
+class CustomUserViewSet(KeysetPaginationMixin, UserViewSet):
     """ Вьюсет для модели User. """
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
+    def get_queryset(self):
+        """ Аннотирует is_subscribed для пользователя запроса. """
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset
+        return queryset.annotate(
+            is_subscribed=Exists(Subscription.objects.filter(
+                user=user, author=OuterRef('pk')))
+        )
+
     @action(
         detail=True,
         methods=['post', 'delete'],
@@ -173,13 +309,27 @@ class CustomUserViewSet(UserViewSet):
     @action(
         detail=False,
         methods=['get'],
+        keyset_pagination_class=SubscriptionKeysetPagination,
     )
     def subscriptions(self, request):
-        """ Список подписок у пользователя. """
+        """ Список подписок у пользователя.
+
+        С pagination=cursor - от новых подписок к старым по курсору.
+        """
         user = request.user
-        authors = User.objects.filter(subscribing__user=user)
+        authors = User.objects.filter(subscribing__user=user).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+            subscribed_at=F('subscribing__date_added'),
+        ).order_by('username')
 
         paged_queryset = self.paginate_queryset(authors)
+        # Рецепты только авторов страницы, не больше recipes_limit.
+        prefetch_related_objects(paged_queryset, Prefetch(
+            'recipes',
+            queryset=Recipe.objects.filter(
+                author__in=[author.id for author in paged_queryset]
+            ).latest_per_author(get_recipes_limit(request))
+        ))
         serializer = SubscriptionReadSerializer(
             paged_queryset,
             context={'request': request},
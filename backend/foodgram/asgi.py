@@ -3,6 +3,9 @@ ASGI config for foodgram project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Run with uvicorn workers so the async read views are used:
+gunicorn -k uvicorn.workers.UvicornWorker foodgram.asgi
+
 For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 """
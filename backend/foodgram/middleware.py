@@ -0,0 +1,109 @@
+import asyncio
+import logging
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.decorators import sync_and_async_middleware
+
+from api.timing import finish_timing, get_server_timing, start_timing
+from foodgram.routers import finish_routing, start_routing
+
+slow_request_logger = logging.getLogger('foodgram.slow_requests')
+
+
+def report_timing(request, response, timing):
+    """ Заголовок Server-Timing и запись о медленном запросе. """
+    metrics = timing.get_metrics()
+    if settings.SERVER_TIMING_HEADER:
+        response['Server-Timing'] = get_server_timing(
+            metrics, timing.queries
+        )
+    if metrics['total'] * 1000 < settings.SLOW_REQUEST_THRESHOLD_MS:
+        return
+    slow_request_logger.warning(
+        'Медленный запрос %s %s: статус %s, %.0f мс, '
+        '%d запросов к БД за %.0f мс\n%s',
+        request.method, request.get_full_path(), response.status_code,
+        metrics['total'] * 1000, timing.queries, timing.sql * 1000,
+        '\n'.join(
+            f'{duration * 1000:8.1f} мс  {sql}'
+            for duration, sql in timing.get_slowest_queries()
+        )
+    )
+
+
+@sync_and_async_middleware
+def request_timing_middleware(get_response):
+    """ Считает запросы к БД и время фаз каждого запроса.
+
+    С SERVER_TIMING_HEADER ставит заголовок Server-Timing, запросы дольше
+    SLOW_REQUEST_THRESHOLD_MS пишет в журнал foodgram.slow_requests
+    вместе с самыми долгими SQL.
+    """
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            timing, token = start_timing(settings.SLOW_REQUEST_TOP_QUERIES)
+            try:
+                response = await get_response(request)
+                report_timing(request, response, timing)
+                return response
+            finally:
+                finish_timing(token)
+    else:
+        def middleware(request):
+            timing, token = start_timing(settings.SLOW_REQUEST_TOP_QUERIES)
+            try:
+                response = get_response(request)
+                report_timing(request, response, timing)
+                return response
+            finally:
+                finish_timing(token)
+    return middleware
+
+
+@sync_and_async_middleware
+def replica_routing_middleware(get_response):
+    """ Отмечает, может ли запрос читать с реплик, для ReplicaRouter.
+
+    Без DATABASE_REPLICAS ничего не делает.
+    """
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            if not settings.DATABASE_REPLICAS:
+                return await get_response(request)
+            token = start_routing(request)
+            try:
+                return await get_response(request)
+            finally:
+                finish_routing(request, token)
+    else:
+        def middleware(request):
+            if not settings.DATABASE_REPLICAS:
+                return get_response(request)
+            token = start_routing(request)
+            try:
+                return get_response(request)
+            finally:
+                finish_routing(request, token)
+    return middleware
+
+
+@sync_and_async_middleware
+def asgi_urlconf_middleware(get_response):
+    """ Под ASGI разрешает адреса по ASGI_ROOT_URLCONF.
+
+    Там горячие адреса чтения обслуживают асинхронные представления,
+    под WSGI остаются синхронные вьюсеты. Если ниже в цепочке есть
+    только синхронный middleware, Django выполняет ее в потоке,
+    и асинхронные представления вызываются уже оттуда.
+    """
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            request.urlconf = settings.ASGI_ROOT_URLCONF
+            return await get_response(request)
+    else:
+        def middleware(request):
+            if isinstance(request, ASGIRequest):
+                request.urlconf = settings.ASGI_ROOT_URLCONF
+            return get_response(request)
+    return middleware
@@ -0,0 +1,139 @@
+import hashlib
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, Error, connections
+
+PIN_KEY = 'db:pinned:{}'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Модели, которые всегда читаются из основной БД: токен нужен
+# сразу после входа, когда реплика могла его еще не получить.
+PRIMARY_READ_MODELS = frozenset(('authtoken.Token',))
+
+_current_routing = ContextVar('db_routing', default=None)
+
+
+class RequestRouting:
+    """ Выбор БД для чтений одного HTTP-запроса.
+
+    read_only - запрос может читать с реплики, replica - выбранная
+    реплика (одна на весь запрос), wrote - запрос что-то записал.
+    """
+
+    def __init__(self, read_only):
+        self.read_only = read_only
+        self.replica = None
+        self.wrote = False
+
+
+class ReplicaHealth:
+    """ Доступность реплик, проверяется не чаще раза в интервал.
+
+    Состояние хранится в памяти процесса, недоступная реплика
+    исключается до следующей проверки.
+    """
+
+    def __init__(self):
+        self.checks = {}
+
+    def is_healthy(self, alias):
+        healthy, checked = self.checks.get(alias, (False, None))
+        now = time.monotonic()
+        if (checked is not None and now - checked
+                < settings.REPLICA_HEALTH_CHECK_INTERVAL):
+            return healthy
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            healthy = True
+        except Error:
+            connection.close()
+            healthy = False
+        self.checks[alias] = (healthy, now)
+        return healthy
+
+    def get_healthy_replicas(self):
+        return [
+            alias for alias in settings.DATABASE_REPLICAS
+            if self.is_healthy(alias)
+        ]
+
+    def invalidate(self):
+        self.checks.clear()
+
+
+replica_health = ReplicaHealth()
+
+
+def get_pin_key(request):
+    """ Ключ закрепления за основной БД по токену или сессии. """
+    credentials = (
+        request.META.get('HTTP_AUTHORIZATION')
+        or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    )
+    if not credentials:
+        return None
+    return PIN_KEY.format(hashlib.sha256(credentials.encode()).hexdigest())
+
+
+def start_routing(request):
+    """ Начинает маршрутизацию запроса, возвращает токен ContextVar.
+
+    Безопасный запрос читает с реплик, если его пользователь не
+    записывал данные в последние READ_YOUR_WRITES_WINDOW секунд.
+    """
+    pin_key = get_pin_key(request)
+    read_only = request.method in SAFE_METHODS and not (
+        pin_key is not None and cache.get(pin_key)
+    )
+    return _current_routing.set(RequestRouting(read_only))
+
+
+def finish_routing(request, token):
+    """ Закрепляет пользователя за основной БД, если запрос писал. """
+    routing = _current_routing.get()
+    _current_routing.reset(token)
+    pin_key = get_pin_key(request)
+    if routing.wrote and pin_key is not None:
+        cache.set(pin_key, True, settings.READ_YOUR_WRITES_WINDOW)
+
+
+class ReplicaRouter:
+    """ Чтения безопасных HTTP-запросов идут на реплики.
+
+    Записи и все запросы вне HTTP-запросов (команды, миграции)
+    идут в основную БД. Чтения внутри транзакции основной БД
+    тоже остаются в ней, иначе они не увидели бы ее изменений.
+    """
+
+    def db_for_read(self, model, **hints):
+        routing = _current_routing.get()
+        if routing is None or not settings.DATABASE_REPLICAS:
+            return None
+        if (not routing.read_only
+                or model._meta.label in PRIMARY_READ_MODELS
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        if routing.replica is None:
+            replicas = replica_health.get_healthy_replicas()
+            routing.replica = (
+                random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+            )
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        routing = _current_routing.get()
+        if routing is not None:
+            routing.wrote = True
+        # Явно, иначе Django запишет объект в БД, из которой он прочитан.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -9,7 +9,14 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = os.getenv('SECRET_KEY')
 
-DEBUG = True
+DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
+
+# Debug toolbar подключается только явно, вместе с DEBUG:
+# его middleware синхронный и собирает данные о каждом запросе
+
+DEBUG_TOOLBAR = DEBUG and (
+    os.getenv('DEBUG_TOOLBAR', 'False').lower() == 'true'
+)
 
 ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS').split(' ')
 
@@ -22,12 +29,12 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'djoser',
     'django_filters',
     'colorfield',
-    'debug_toolbar',
     # Local
     'api.apps.ApiConfig',
     'users.apps.UsersConfig',
@@ -35,6 +42,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram.middleware.request_timing_middleware',
+    'foodgram.middleware.replica_routing_middleware',
+    'foodgram.middleware.asgi_urlconf_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -42,11 +52,23 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
+if DEBUG_TOOLBAR:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'foodgram.urls'
 
+# Под ASGI (foodgram.asgi) чтение тегов, ингредиентов и рецептов идет
+# через асинхронные представления: ответы из кэша отдаются в цикле
+# событий, остальное выполняется в пуле потоков. При False синхронная
+# часть выполняется в одном общем потоке, как у обычных представлений.
+
+ASGI_ROOT_URLCONF = 'foodgram.asgi_urls'
+
+ASYNC_READ_THREAD_POOL = True
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -79,6 +101,64 @@ DATABASES = {
     }
 }
 
+# Реплики для чтения: хосты через запятую в DB_REPLICA_HOSTS, остальные
+# параметры как у основной БД. Безопасные HTTP-запросы читают с реплик,
+# после записи запросы того же токена или сессии читают из основной БД
+# READ_YOUR_WRITES_WINDOW секунд. Реплика, не ответившая на проверку,
+# исключается до следующей через REPLICA_HEALTH_CHECK_INTERVAL секунд.
+# В тестах реплики указывают на тестовую основную БД. Без DB_REPLICA_HOSTS
+# тест маршрутизации сам подключает такую реплику
+
+DATABASE_REPLICAS = []
+
+for number, host in enumerate(
+    filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), start=1
+):
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': host.strip(),
+        'OPTIONS': {'connect_timeout': 2},
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['foodgram.routers.ReplicaRouter']
+
+READ_YOUR_WRITES_WINDOW = int(os.getenv('READ_YOUR_WRITES_WINDOW', 5))
+
+REPLICA_HEALTH_CHECK_INTERVAL = 10
+
+
+# Cache
+# Для нескольких процессов нужен общий бэкенд, например
+# django.core.cache.backends.memcached.PyMemcacheCache.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Время жизни кэша ответов со справочниками (теги, ингредиенты)
+# и max-age для Cache-Control, в секундах
+
+REFERENCE_CACHE_TIMEOUT = 60 * 60
+
+REFERENCE_CACHE_MAX_AGE = 60
+
+# Время жизни кэша ленты рецептов для анонимных пользователей, в секундах
+
+RECIPE_CACHE_TIMEOUT = 60 * 10
+
+# Время жизни токена с пользователем в кэше аутентификации, в секундах.
+# Выход, смена пароля и деактивация сбрасывают запись сразу.
+
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', 60))
+
 
 # Password validation
 
@@ -139,14 +219,132 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
+    ],
+
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
 
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.PageLimitPagination',
     'PAGE_SIZE': 6,
 
 }
 
+# Поиск ингредиентов: memory - индекс в памяти процесса,
+# database - запросы к БД (для нескольких процессов без общей памяти,
+# только PostgreSQL, на других БД используется memory)
+
+INGREDIENT_SEARCH_BACKEND = os.getenv('INGREDIENT_SEARCH_BACKEND', 'memory')
+
+INGREDIENT_SEARCH_LIMIT = 50
+
+# Изображения рецептов: лимит размера в байтах и в пикселях,
+# допустимые форматы, параметры вариантов и размер пула для них
+
+RECIPE_IMAGE_MAX_SIZE = 10 * 1024 * 1024
+
+RECIPE_IMAGE_MAX_PIXELS = 40_000_000
+
+RECIPE_IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+RECIPE_THUMBNAIL_SIZE = (480, 480)
+
+RECIPE_IMAGE_WEBP_QUALITY = 80
+
+RECIPE_IMAGE_WORKERS = 2
+
+# Поиск рецептов: fulltext - полнотекстовый поиск PostgreSQL с этой
+# конфигурацией, python - перебор рецептов в памяти без учета регистра.
+# На других БД, например SQLite, всегда используется python.
+
+RECIPE_SEARCH_BACKEND = os.getenv('RECIPE_SEARCH_BACKEND', 'fulltext')
+
+RECIPE_SEARCH_CONFIG = 'russian'
+
+# Подбор рецептов по ингредиентам: обратный индекс в памяти процесса
+# перестраивается в фоновом потоке не реже раза в столько секунд,
+# число ингредиентов в запросе ограничено.
+
+RECIPE_INGREDIENT_INDEX_TTL = 300
+
+RECIPE_BY_INGREDIENTS_MAX_IDS = 100
+
+# Рецепты автора в списке подписок: recipes_limit по умолчанию
+# и наибольшее значение, иначе ответ растет с числом рецептов
+
+SUBSCRIPTION_RECIPES_LIMIT = 10
+
+# Похожие рецепты: модель строит команда build_recipe_similarity,
+# процессы сервера читают ее файлы через mmap.
+
+RECIPE_SIMILARITY_DIR = os.getenv(
+    'RECIPE_SIMILARITY_DIR', os.path.join(BASE_DIR, 'similarity')
+)
+
+RECIPE_SIMILARITY_TOP_K = 20
+
+RECIPE_SIMILARITY_TAG_WEIGHT = 0.5
+
+RECIPE_SIMILARITY_CHECK_INTERVAL = 60
+
+# Рейтинги trending и popular: период полураспада вклада избранного
+# и корзины в секундах, веса событий и задержка окна событий.
+
+RECIPE_TRENDING_HALF_LIFE = 2 * 24 * 60 * 60
+
+RECIPE_POPULAR_HALF_LIFE = 30 * 24 * 60 * 60
+
+RECIPE_SCORE_FAVORITE_WEIGHT = 1.0
+
+RECIPE_SCORE_CART_WEIGHT = 0.5
+
+RECIPE_SCORE_LAG = 60
+
+# Лента подписок: с какого числа подписок лента пользователя
+# хранится в FeedEntry и заполняется при публикации рецепта.
+
+FEED_FANOUT_THRESHOLD = 500
+
+FEED_FANOUT_BATCH_SIZE = 1000
+
+# Шрифт с кириллицей для PDF списка покупок
+
+SHOPPING_LIST_FONT = os.getenv(
+    'SHOPPING_LIST_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+# Замеры запросов: заголовок Server-Timing с временем SQL и фаз
+# (auth, view, serialize, render), запросы дольше порога в мс
+# пишутся в журнал foodgram.slow_requests с самыми долгими SQL.
+# Заголовок раскрывает внутреннее устройство, в продакшене он выключен
+
+SERVER_TIMING_HEADER = (
+    os.getenv('SERVER_TIMING_HEADER', 'False').lower() == 'true'
+)
+
+SLOW_REQUEST_THRESHOLD_MS = int(os.getenv('SLOW_REQUEST_THRESHOLD_MS', 500))
+
+SLOW_REQUEST_TOP_QUERIES = 5
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'foodgram.slow_requests': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+        },
+    },
+}
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'HIDE_USERS': False,
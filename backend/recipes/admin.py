@@ -5,6 +5,7 @@ from recipes.models import (
     Ingredient,
     Recipe,
     IngredientRecipe,
+    RecipeTag,
     ShoppingCart,
     Favorite,
     Subscription
@@ -21,30 +22,43 @@ class TagAdmin(admin.ModelAdmin):
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'measurement_unit',)
-    list_filter = ('name', )
+    search_fields = ('^name',)
     empty_value_display = '-пусто-'
 
 
 class IngredientRecipeInline(admin.TabularInline):
     model = IngredientRecipe
+    autocomplete_fields = ('ingredient',)
     extra = 0
     min_num = 1
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('ingredient')
+
 
 class TagInline(admin.TabularInline):
-    model = Recipe.tags.through
+    model = RecipeTag
+    autocomplete_fields = ('tag',)
     extra = 0
     min_num = 1
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('recipe', 'tag')
+
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     list_display = (
         'id', 'name',
-        'author', 'pub_date',
+        'author', 'pub_date', 'favorites_count',
     )
-    list_filter = ('author', 'name', 'tags',)
+    list_select_related = ('author',)
+    list_filter = ('tags',)
+    date_hierarchy = 'pub_date'
+    search_fields = ('name',)
+    autocomplete_fields = ('author',)
     exclude = ('tags',)
+    readonly_fields = ('favorites_count', 'cart_count',)
     inlines = (IngredientRecipeInline, TagInline,)
     empty_value_display = '-пусто-'
 
@@ -52,13 +66,19 @@ class RecipeAdmin(admin.ModelAdmin):
 @admin.register(ShoppingCart)
 class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe',)
+    list_select_related = ('user', 'recipe',)
+    autocomplete_fields = ('user', 'recipe',)
 
 
 @admin.register(Favorite)
 class FavoriteAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe',)
+    list_select_related = ('user', 'recipe',)
+    autocomplete_fields = ('user', 'recipe',)
 
 
 @admin.register(Subscription)
 class SubscriptionAdmin(admin.ModelAdmin):
     list_display = ('user', 'author', 'date_added',)
+    list_select_related = ('user', 'author',)
+    autocomplete_fields = ('user', 'author',)
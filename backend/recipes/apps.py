@@ -1,7 +1,16 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class RecipesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipes'
     verbose_name = 'Рецепты'
+
+    def ready(self):
+        from recipes.signals import (
+            backfill_recipe_scores,
+            create_postgres_indexes
+        )
+        post_migrate.connect(create_postgres_indexes, sender=self)
+        post_migrate.connect(backfill_recipe_scores, sender=self)
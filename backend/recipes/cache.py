@@ -0,0 +1,50 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'recipes:version:{}'
+# Бэкенды кэша, данные которых видит только один процесс.
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def get_cache_version(name):
+    """ Текущая версия данных name из кэша. """
+    key = VERSION_KEY.format(name)
+    version = cache.get(key)
+    if version is None:
+        # Начальное значение от времени, чтобы после потери ключа
+        # не совпасть с версией уже закэшированных ответов.
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_cache_version(name):
+    """ Увеличивает версию данных name, старые ответы перестают читаться. """
+    key = VERSION_KEY.format(name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+
+
+def is_cache_process_local():
+    """ Версии из кэша не видны другим процессам, например воркерам. """
+    return settings.CACHES['default']['BACKEND'] in PROCESS_LOCAL_CACHES
+
+
+def bump_cache_version_on_commit(*names):
+    """ Увеличивает версии после коммита текущей транзакции.
+
+    Иначе параллельный запрос может закэшировать еще старые данные
+    под уже новой версией.
+    """
+    def bump():
+        for name in names:
+            bump_cache_version(name)
+    transaction.on_commit(bump)
@@ -0,0 +1,48 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShoppingCart, Subscription
+from users.models import User
+
+# Счетчик: модель, поле счетчика, считаемая модель и ее внешний ключ.
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'cart_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'subscriptions_count', Subscription, 'user'),
+)
+
+
+def change_counter(queryset, field, delta):
+    """ Меняет счетчик на delta одним UPDATE, не читая строки.
+
+    Уменьшение не опускает счетчик ниже нуля.
+    """
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    return queryset.update(**{field: F(field) + delta})
+
+
+def get_actual_count(model, foreign_key):
+    """ Подзапрос с точным числом строк model для внешней строки. """
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{foreign_key: OuterRef('pk')}
+        ).order_by().values(foreign_key).annotate(
+            total=Count('pk')
+        ).values('total')
+    ), 0)
+
+
+def recount():
+    """ Пересчитывает разошедшиеся счетчики.
+
+    Возвращает число исправленных строк для каждого счетчика.
+    """
+    fixed = {}
+    for model, field, counted_model, foreign_key in COUNTERS:
+        actual = get_actual_count(counted_model, foreign_key)
+        fixed[f'{model._meta.label}.{field}'] = model.objects.annotate(
+            actual=actual
+        ).exclude(**{field: F('actual')}).update(**{field: actual})
+    return fixed
@@ -0,0 +1,111 @@
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import Exists, F, OuterRef
+
+from recipes.models import FeedEntry, Recipe, Subscription
+from users.models import User
+
+
+def uses_timeline(subscriptions_count):
+    """ Лента хранится в FeedEntry, а не собирается запросом. """
+    return subscriptions_count >= settings.FEED_FANOUT_THRESHOLD
+
+
+def get_feed(user):
+    """ Рецепты авторов, на которых подписан user.
+
+    Для небольшого числа подписок это полусоединение с Subscription
+    по индексам (user, author) и (author, -pub_date). Для тысяч
+    подписок такой запрос перебирает слишком много рецептов, поэтому
+    лента читается из FeedEntry по индексу (user, -pub_date, -recipe).
+    Дата для пагинации в обоих случаях лежит в feed_date.
+    """
+    if uses_timeline(user.subscriptions_count):
+        return Recipe.objects.filter(feed_entries__user=user).annotate(
+            feed_date=F('feed_entries__pub_date')
+        )
+    return Recipe.objects.filter(
+        Exists(Subscription.objects.filter(
+            user=user, author=OuterRef('author')
+        ))
+    ).annotate(feed_date=F('pub_date'))
+
+
+def bulk_create_entries(entries):
+    entries = iter(entries)
+    batch_size = settings.FEED_FANOUT_BATCH_SIZE
+    while True:
+        batch = list(islice(entries, batch_size))
+        if not batch:
+            return
+        FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out(recipes):
+    """ Добавляет рецепты в ленты подписчиков с большим числом подписок.
+
+    Вызывается при публикации, подписчики читаются потоком.
+    """
+    recipes_by_author = {}
+    for recipe in recipes:
+        recipes_by_author.setdefault(recipe.author_id, []).append(recipe)
+    subscribers = Subscription.objects.filter(
+        author__in=recipes_by_author,
+        user__subscriptions_count__gte=settings.FEED_FANOUT_THRESHOLD
+    ).values_list('user_id', 'author_id').iterator()
+    bulk_create_entries(
+        FeedEntry(user_id=user_id, recipe=recipe, pub_date=recipe.pub_date)
+        for user_id, author_id in subscribers
+        for recipe in recipes_by_author[author_id]
+    )
+
+
+def add_author(user_id, author_id):
+    """ Добавляет в ленту пользователя все рецепты нового автора. """
+    bulk_create_entries(
+        FeedEntry(user_id=user_id, recipe_id=recipe_id, pub_date=pub_date)
+        for recipe_id, pub_date in Recipe.objects.filter(
+            author_id=author_id
+        ).values_list('id', 'pub_date').iterator()
+    )
+
+
+def rebuild_timeline(user_id):
+    """ Заново заполняет ленту пользователя из его подписок. """
+    FeedEntry.objects.filter(user_id=user_id).delete()
+    bulk_create_entries(
+        FeedEntry(user_id=user_id, recipe_id=recipe_id, pub_date=pub_date)
+        for recipe_id, pub_date in Recipe.objects.filter(
+            Exists(Subscription.objects.filter(
+                user_id=user_id, author=OuterRef('author')
+            ))
+        ).values_list('id', 'pub_date').iterator()
+    )
+
+
+def subscribed(subscription):
+    """ Поддерживает ленту после новой подписки. """
+    count = User.objects.values_list(
+        'subscriptions_count', flat=True
+    ).get(pk=subscription.user_id)
+    if not uses_timeline(count):
+        return
+    if uses_timeline(count - 1):
+        add_author(subscription.user_id, subscription.author_id)
+    else:
+        rebuild_timeline(subscription.user_id)
+
+
+def unsubscribed(subscription):
+    """ Поддерживает ленту после отписки.
+
+    Когда подписок становится меньше порога, лента удаляется целиком.
+    """
+    entries = FeedEntry.objects.filter(user_id=subscription.user_id)
+    count = User.objects.filter(pk=subscription.user_id).values_list(
+        'subscriptions_count', flat=True
+    ).first()
+    if count is not None and uses_timeline(count):
+        entries = entries.filter(recipe__author_id=subscription.author_id)
+    entries.delete()
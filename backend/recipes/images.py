@@ -0,0 +1,93 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+
+from PIL import Image
+
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SUFFIX = '_thumb'
+WEBP_SUFFIX = '_full'
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.RECIPE_IMAGE_WORKERS,
+    thread_name_prefix='recipe-images'
+)
+
+
+def get_variant_stems(image_name):
+    """ Имена миниатюры и WebP-копии без расширения. """
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return stem + THUMBNAIL_SUFFIX, stem + WEBP_SUFFIX
+
+
+def has_variants(recipe):
+    """ Варианты уже построены для текущего изображения рецепта. """
+    thumbnail_stem, webp_stem = get_variant_stems(recipe.image.name)
+    return (
+        os.path.basename(recipe.image_thumbnail.name or '').startswith(
+            thumbnail_stem)
+        and os.path.basename(recipe.image_webp.name or '').startswith(
+            webp_stem)
+    )
+
+
+def to_webp(image):
+    buffer = io.BytesIO()
+    image.save(buffer, 'WEBP', quality=settings.RECIPE_IMAGE_WEBP_QUALITY)
+    return buffer.getvalue()
+
+
+def generate_variants(recipe_id):
+    """ Строит миниатюру и WebP-копию изображения рецепта.
+
+    Варианты прежнего изображения удаляются из хранилища после того,
+    как рецепт начал ссылаться на новые.
+    """
+    recipe = Recipe.objects.filter(pk=recipe_id).first()
+    if recipe is None or not recipe.image or has_variants(recipe):
+        return
+    stale_names = [
+        variant.name for variant in (recipe.image_thumbnail, recipe.image_webp)
+        if variant
+    ]
+    thumbnail_stem, webp_stem = get_variant_stems(recipe.image.name)
+    with recipe.image.open('rb') as file, Image.open(file) as image:
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        webp = to_webp(image)
+        image.thumbnail(settings.RECIPE_THUMBNAIL_SIZE)
+        thumbnail = to_webp(image)
+    recipe.image_webp.save(f'{webp_stem}.webp', ContentFile(webp), save=False)
+    recipe.image_thumbnail.save(
+        f'{thumbnail_stem}.webp', ContentFile(thumbnail), save=False
+    )
+    recipe.save(update_fields=('image_thumbnail', 'image_webp'))
+    for name in stale_names:
+        recipe.image_webp.storage.delete(name)
+
+
+def run_generate_variants(recipe_id):
+    """ Задача для пула: пишет ошибки в лог и закрывает соединение. """
+    try:
+        generate_variants(recipe_id)
+    except Exception:
+        logger.exception(
+            'Не удалось построить изображения рецепта %s', recipe_id
+        )
+    finally:
+        connection.close()
+
+
+def schedule_variants(recipe):
+    """ Ставит построение вариантов в пул после коммита транзакции. """
+    recipe_id = recipe.pk
+    transaction.on_commit(
+        lambda: executor.submit(run_generate_variants, recipe_id)
+    )
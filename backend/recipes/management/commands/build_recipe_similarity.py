@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.similarity import build_model
+
+
+class Command(BaseCommand):
+    """
+    Строит модель похожих рецептов по ингредиентам и тегам:
+    python manage.py build_recipe_similarity [--incremental]
+    С --incremental пересчитываются только новые и измененные
+    рецепты и те, чьи списки похожих они затрагивают; удобно
+    запускать по расписанию. Без флага модель строится заново.
+    """
+    help = 'Строит модель похожих рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help='Пересчитать только затронутые изменениями рецепты'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        recipes, updated = build_model(incremental=options['incremental'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Рецептов в модели: {recipes}, пересчитано: {updated}, '
+            f'{time.monotonic() - started:.1f} с'
+        ))
@@ -0,0 +1,104 @@
+import base64
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    """
+    Выгружает рецепты в формат JSON Lines, по рецепту на строку:
+    python manage.py export_recipes recipes.jsonl
+    Рецепты читаются пачками по id, поэтому память не растет
+    с размером базы. Без --no-images изображения пишутся в base64.
+    """
+    help = 'Выгружает рецепты в JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default='-',
+            help='Файл для выгрузки, по умолчанию stdout'
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--no-images', action='store_true',
+            help='Не выгружать изображения'
+        )
+
+    def iter_batches(self, batch_size):
+        last_id = 0
+        while True:
+            batch = list(
+                Recipe.objects.with_related().filter(
+                    id__gt=last_id
+                ).order_by('id')[:batch_size]
+            )
+            if not batch:
+                return
+            yield batch
+            last_id = batch[-1].id
+
+    def serialize_image(self, recipe):
+        if not recipe.image:
+            return None
+        with recipe.image.open('rb') as file:
+            data = base64.b64encode(file.read()).decode()
+        return {'name': recipe.image.name, 'data': data}
+
+    def serialize(self, recipe, with_images):
+        author = recipe.author
+        return {
+            'name': recipe.name,
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+            'pub_date': recipe.pub_date.isoformat(),
+            'author': {
+                'email': author.email,
+                'username': author.username,
+                'first_name': author.first_name,
+                'last_name': author.last_name,
+            },
+            'tags': [
+                {'name': tag.name, 'color': tag.color, 'slug': tag.slug}
+                for tag in recipe.tags.all()
+            ],
+            'ingredients': [
+                {
+                    'name': amount.ingredient.name,
+                    'measurement_unit': amount.ingredient.measurement_unit,
+                    'amount': amount.amount,
+                }
+                for amount in recipe.amount_ingredients.all()
+            ],
+            'image': self.serialize_image(recipe) if with_images else None,
+        }
+
+    def handle(self, *args, **options):
+        path = options['path']
+        output = (
+            self.stdout if path == '-'
+            else open(path, 'w', encoding='utf-8')
+        )
+        started = time.monotonic()
+        exported = 0
+        try:
+            for batch in self.iter_batches(options['batch_size']):
+                for recipe in batch:
+                    output.write(json.dumps(
+                        self.serialize(recipe, not options['no_images']),
+                        ensure_ascii=False
+                    ) + '\n')
+                exported += len(batch)
+                elapsed = time.monotonic() - started
+                self.stderr.write(
+                    f'Выгружено {exported} рецептов, '
+                    f'{exported / elapsed:.0f} рец/с'
+                )
+        finally:
+            if output is not self.stdout:
+                output.close()
+        self.stderr.write(self.style.SUCCESS(
+            f'Выгрузка завершена: {exported} рецептов'
+        ))
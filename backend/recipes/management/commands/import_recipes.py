@@ -0,0 +1,258 @@
+import base64
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from recipes.cache import bump_cache_version
+from recipes.counters import change_counter
+from recipes.feed import fan_out
+from recipes.search import schedule_search_update
+from recipes.models import (
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    RecipeScore,
+    RecipeTag,
+    Tag
+)
+from users.models import User
+
+IMAGE_UPLOAD_TO = Recipe._meta.get_field('image').upload_to
+
+
+def delete_images(names):
+    """ Удаляет из хранилища сохраненные изображения. """
+    for name in names:
+        if name:
+            default_storage.delete(name)
+
+
+def save_image(image):
+    """ Декодирует изображение и сохраняет его в хранилище.
+
+    Выполняется в процессе пула и возвращает имя сохраненного файла.
+    """
+    if not image:
+        return None
+    name = os.path.join(IMAGE_UPLOAD_TO, os.path.basename(image['name']))
+    return default_storage.save(
+        name, ContentFile(base64.b64decode(image['data']))
+    )
+
+
+class Command(BaseCommand):
+    """
+    Загружает рецепты из JSON Lines, выгруженных export_recipes:
+    python manage.py import_recipes recipes.jsonl
+    Файл читается пачками по --batch-size строк, каждая пачка
+    сохраняется через bulk_create в одной транзакции, изображения
+    декодируются в пуле процессов. Недостающие авторы, теги
+    и ингредиенты создаются, рецепты попадают в хранимые ленты
+    подписчиков. Миниатюры изображений не строятся.
+    Если имя нового автора уже занято другим пользователем, его
+    рецепты пропускаются с предупреждением. Изображения пачки,
+    которая не сохранилась, удаляются из хранилища.
+    """
+    help = 'Загружает рецепты из JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл с рецептами')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Число процессов для изображений, по умолчанию по CPU'
+        )
+
+    def get_authors(self, rows):
+        """ Авторы по email, новые создаются.
+
+        Авторы, чье имя пользователя уже занято, не создаются
+        и в результат не попадают.
+        """
+        authors = {row['author']['email']: row['author'] for row in rows}
+        existing = User.objects.in_bulk(authors, field_name='email')
+        taken = set(User.objects.filter(username__in=[
+            author['username'] for email, author in authors.items()
+            if email not in existing
+        ]).values_list('username', flat=True))
+        new_authors = []
+        for email, author in authors.items():
+            if email in existing:
+                continue
+            if author['username'] in taken:
+                self.stderr.write(self.style.WARNING(
+                    f'Рецепты автора {email} пропущены: имя пользователя '
+                    f'{author["username"]} уже занято'
+                ))
+                continue
+            taken.add(author['username'])
+            new_authors.append(
+                User(password=make_password(None), **author)
+            )
+        existing.update(
+            (user.email, user)
+            for user in User.objects.bulk_create(new_authors)
+        )
+        return existing
+
+    def get_tags(self, rows):
+        tags = {tag['slug']: tag for row in rows for tag in row['tags']}
+        existing = Tag.objects.in_bulk(tags, field_name='slug')
+        created = Tag.objects.bulk_create(
+            Tag(**tags[slug]) for slug in tags if slug not in existing
+        )
+        if created:
+            self.changed_versions.add('tag')
+        existing.update((tag.slug, tag) for tag in created)
+        return existing
+
+    def get_ingredients(self, rows):
+        missing = {
+            (ingredient['name'], ingredient['measurement_unit'])
+            for row in rows for ingredient in row['ingredients']
+        } - self.ingredients.keys()
+        if missing:
+            self.changed_versions.add('ingredient')
+        self.ingredients.update(
+            ((ingredient.name, ingredient.measurement_unit), ingredient)
+            for ingredient in Ingredient.objects.bulk_create(
+                Ingredient(name=name, measurement_unit=measurement_unit)
+                for name, measurement_unit in missing
+            )
+        )
+        return self.ingredients
+
+    @transaction.atomic
+    def import_batch(self, rows, images):
+        """ Сохраняет пачку рецептов и возвращает число загруженных. """
+        authors = self.get_authors(rows)
+        delete_images(
+            image for row, image in zip(rows, images)
+            if row['author']['email'] not in authors
+        )
+        images = [
+            image for row, image in zip(rows, images)
+            if row['author']['email'] in authors
+        ]
+        rows = [row for row in rows if row['author']['email'] in authors]
+        if not rows:
+            return 0
+        tags = self.get_tags(rows)
+        ingredients = self.get_ingredients(rows)
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                name=row['name'],
+                text=row['text'],
+                cooking_time=row['cooking_time'],
+                author=authors[row['author']['email']],
+                image=image,
+            )
+            for row, image in zip(rows, images)
+        )
+        # pub_date с auto_now_add перезаписывается при создании.
+        for recipe, row in zip(recipes, rows):
+            recipe.pub_date = parse_datetime(row['pub_date'])
+        Recipe.objects.bulk_update(recipes, ('pub_date',))
+        # bulk_create не отправляет сигналы, счетчики авторов меняются здесь.
+        for author_id, count in Counter(
+            recipe.author_id for recipe in recipes
+        ).items():
+            change_counter(
+                User.objects.filter(pk=author_id), 'recipes_count', count
+            )
+        RecipeTag.objects.bulk_create(
+            RecipeTag(recipe=recipe, tag=tags[tag['slug']])
+            for recipe, row in zip(recipes, rows)
+            for tag in row['tags']
+        )
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipe=recipe,
+                ingredient=ingredients[
+                    (ingredient['name'], ingredient['measurement_unit'])
+                ],
+                amount=ingredient['amount'],
+            )
+            for recipe, row in zip(recipes, rows)
+            for ingredient in row['ingredients']
+        )
+        RecipeScore.objects.bulk_create(
+            RecipeScore(recipe=recipe) for recipe in recipes
+        )
+        fan_out(recipes)
+        schedule_search_update(*(recipe.pk for recipe in recipes))
+        return len(recipes)
+
+    def save_images(self, executor, rows):
+        """ Сохраняет изображения пачки в пуле процессов.
+
+        Если какое-то изображение не сохранилось, уже записанные
+        удаляются.
+        """
+        futures = [
+            executor.submit(save_image, row.get('image')) for row in rows
+        ]
+        images = []
+        error = None
+        for future in futures:
+            try:
+                images.append(future.result())
+            except Exception as exc:
+                error = error or exc
+        if error is not None:
+            delete_images(images)
+            raise error
+        return images
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.changed_versions = {'recipe'}
+        self.ingredients = {
+            (ingredient.name, ingredient.measurement_unit): ingredient
+            for ingredient in Ingredient.objects.all()
+        }
+        started = time.monotonic()
+        imported = 0
+        skipped = 0
+        executor = ProcessPoolExecutor(
+            max_workers=options['workers'], initializer=django.setup
+        )
+        with open(options['path'], encoding='utf-8') as file, executor:
+            lines = (line for line in file if line.strip())
+            while True:
+                rows = [json.loads(line) for line in islice(lines, batch_size)]
+                if not rows:
+                    break
+                images = self.save_images(executor, rows)
+                try:
+                    count = self.import_batch(rows, images)
+                except Exception:
+                    # Транзакция пачки откатилась, ее файлы не нужны.
+                    delete_images(images)
+                    raise
+                imported += count
+                skipped += len(rows) - count
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'Загружено {imported} рецептов, '
+                    f'{imported / elapsed:.0f} рец/с'
+                )
+        # bulk_create не отправляет сигналы, кэш ленты, а для новых
+        # тегов и ингредиентов и их справочников сбрасывается здесь.
+        for name in self.changed_versions:
+            bump_cache_version(name)
+        self.stdout.write(self.style.SUCCESS(
+            f'Загрузка завершена: {imported} рецептов, '
+            f'пропущено {skipped}'
+        ))
@@ -1,45 +1,126 @@
 import csv
-
-import logging
+import json
+import os
+import time
+from itertools import islice
 
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
+from recipes.cache import bump_cache_version, is_cache_process_local
 from recipes.models import Ingredient
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    filename='program.log',
-    filemode='w',
-    format='%(asctime)s, %(levelname)s, %(message)s, %(name)s'
-)
+DEFAULT_PATH = os.path.join(settings.BASE_DIR, 'data', 'ingredients.csv')
 
 
 class Command(BaseCommand):
     """
-    Для запуска команды создайте и примените миграции
-    и примените команду python manage.py load_ingredients_from_csv
-    Базу нужно заполнить на чистую и только один раз.
-    Чтобы повторно заполнить базу - удалите файл db.sqlite3
-    и примените миграции, иначе будет ошибка.
+    Заполняет каталог ингредиентов из CSV или JSON:
+    python manage.py load_ingredients_from_csv [data/ingredients.json]
+    Команду можно запускать повторно: уже существующие пары
+    (name, measurement_unit) пропускаются. Файл читается пачками
+    по --batch-size строк, каждая пачка вставляется в своей транзакции.
+    Веб-воркеры узнают о новых ингредиентах по версии каталога
+    в общем кэше. С кэшем в памяти процесса (LocMemCache по умолчанию)
+    версия им не видна, и после загрузки их нужно перезапустить.
     """
     help = 'Заполняет таблицу с ингридиентами'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=DEFAULT_PATH,
+            help='Файл .csv или .json, по умолчанию data/ingredients.csv'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать новые ингредиенты, не записывая их'
+        )
+
+    def read_rows(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.csv':
+            with open(path, newline='', encoding='utf-8') as file:
+                yield from csv.DictReader(file)
+        elif extension == '.json':
+            with open(path, encoding='utf-8') as file:
+                yield from json.load(file)
+        else:
+            raise CommandError(f'Неизвестный формат файла: {path}')
+
+    def read_pairs(self, path):
+        for number, row in enumerate(self.read_rows(path), start=1):
+            try:
+                name = row['name'].strip()
+                measurement_unit = row['measurement_unit'].strip()
+            except (KeyError, AttributeError):
+                raise CommandError(f'Неверная строка {number}: {row}')
+            if not name or not measurement_unit:
+                raise CommandError(f'Пустое значение в строке {number}')
+            yield name, measurement_unit
+
+    def get_missing(self, pairs):
+        existing = set(
+            Ingredient.objects.filter(
+                name__in={name for name, _ in pairs}
+            ).values_list('name', 'measurement_unit')
+        )
+        return [pair for pair in dict.fromkeys(pairs) if pair not in existing]
+
+    @transaction.atomic
+    def load_batch(self, pairs, dry_run):
+        missing = self.get_missing(pairs)
+        if not dry_run:
+            # Параллельная загрузка могла успеть вставить те же пары.
+            Ingredient.objects.bulk_create(
+                (
+                    Ingredient(name=name, measurement_unit=measurement_unit)
+                    for name, measurement_unit in missing
+                ),
+                ignore_conflicts=True
+            )
+        return len(missing)
+
     def handle(self, *args, **options):
+        path = options['path']
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        if batch_size <= 0:
+            raise CommandError('--batch-size должен быть больше нуля')
+        if not os.path.exists(path):
+            raise CommandError(f'Файл не найден: {path}')
         self.stdout.write(self.style.SUCCESS('Начат импорт данных'))
-        try:
-            with open(
-                f'{settings.BASE_DIR}/data/ingredients.csv',
-                newline='',
-                encoding='utf-8'
-            ) as csvfile:
-                reader = csv.DictReader(csvfile)
-                Ingredient.objects.bulk_create(
-                    Ingredient(**row) for row in reader
-                )
+        pairs = self.read_pairs(path)
+        read = created = 0
+        for number, batch in enumerate(
+            iter(lambda: list(islice(pairs, batch_size)), []), start=1
+        ):
+            started = time.monotonic()
+            batch_created = self.load_batch(batch, dry_run)
+            read += len(batch)
+            created += batch_created
             self.stdout.write(
-                self.style.SUCCESS(
-                    'Ингридиенты успешно загруженны')
+                f'Пачка {number}: {len(batch)} строк, '
+                f'новых {batch_created}, '
+                f'{(time.monotonic() - started) * 1000:.0f} мс'
             )
-        except Exception as error:
-            logging.error(f'Ошибка при выполнении команды: {error}')
+        if dry_run:
+            self.stdout.write(self.style.WARNING(
+                f'Пробный запуск: прочитано {read}, будет добавлено {created}'
+            ))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Ингридиенты загружены: прочитано {read}, добавлено {created}'
+        ))
+        if not created:
+            return
+        # bulk_create не отправляет сигналы, версия каталога, по которой
+        # воркеры сбрасывают ответы и индекс, увеличивается здесь.
+        bump_cache_version('ingredient')
+        if is_cache_process_local():
+            self.stdout.write(self.style.WARNING(
+                'Кэш хранится в памяти процесса, веб-воркеры не увидят '
+                'новые ингредиенты: перезапустите их или настройте общий '
+                'кэш в CACHE_BACKEND'
+            ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.counters import recount
+
+
+class Command(BaseCommand):
+    """
+    Пересчитывает счетчики избранного, корзины и рецептов автора:
+    python manage.py recount
+    Исправляются только строки, где счетчик разошелся с данными.
+    """
+    help = 'Пересчитывает счетчики рецептов и пользователей'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            fixed = recount()
+        for counter, rows in fixed.items():
+            self.stdout.write(f'{counter}: исправлено {rows}')
+        self.stdout.write(self.style.SUCCESS('Счетчики пересчитаны'))
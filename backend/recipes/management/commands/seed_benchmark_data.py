@@ -0,0 +1,288 @@
+import random
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate, islice
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from recipes.cache import bump_cache_version
+from recipes.counters import recount
+from recipes.feed import rebuild_timeline
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    RecipeTag,
+    ShoppingCart,
+    Subscription,
+    Tag
+)
+from recipes.scores import create_missing_scores
+from recipes.search import update_search_vectors
+from users.models import User
+
+USERNAME_PREFIX = 'bench'
+PASSWORD = 'bench-password'
+# Даты публикации отсчитываются от фиксированного момента,
+# чтобы одинаковый seed давал одинаковые данные.
+START_DATE = datetime(2023, 1, 1, tzinfo=timezone.utc)
+WORDS = (
+    'курица', 'рис', 'соус', 'запеченный', 'домашний', 'суп', 'салат',
+    'быстрый', 'сырный', 'овощной', 'пирог', 'острый', 'сладкий', 'паста',
+)
+
+
+def skewed_weights(count, exponent):
+    """ Накопленные веса распределения Ципфа для random.choices. """
+    return list(accumulate(1 / (rank + 1) ** exponent
+                           for rank in range(count)))
+
+
+def sample_skewed(rng, population, cum_weights, count, exclude=None):
+    """ До count различных элементов, популярные выпадают чаще. """
+    chosen = dict.fromkeys(
+        item for item in rng.choices(
+            population, cum_weights=cum_weights, k=count * 3
+        )
+        if item != exclude
+    )
+    return list(islice(chosen, count))
+
+
+class Command(BaseCommand):
+    """
+    Заполняет базу синтетическими данными для нагрузочных замеров:
+    python manage.py seed_benchmark_data --users 1000 --recipes 10000
+    При одном и том же --seed данные совпадают. Популярность авторов,
+    рецептов и ингредиентов распределена по закону Ципфа: немногие
+    авторы пишут большую часть рецептов и собирают большую часть
+    подписок. Все строки вставляются через bulk_create, после чего
+    пересчитываются счетчики, рейтинги, поисковые векторы и ленты.
+    Пользователи получают имена bench0, bench1, ... и пароль
+    bench-password; --clear удаляет их вместе с рецептами.
+    """
+    help = 'Генерирует данные для нагрузочных замеров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--tags', type=int, default=8)
+        parser.add_argument(
+            '--favorites', type=int, default=20,
+            help='Среднее число избранных рецептов у пользователя'
+        )
+        parser.add_argument(
+            '--cart', type=int, default=5,
+            help='Среднее число рецептов в корзине'
+        )
+        parser.add_argument(
+            '--subscriptions', type=int, default=10,
+            help='Среднее число подписок'
+        )
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Удалить ранее сгенерированных пользователей'
+        )
+
+    def log(self, message):
+        self.stdout.write(
+            f'{message}, {time.monotonic() - self.started:.1f} с'
+        )
+
+    def get_tags(self, count):
+        Tag.objects.bulk_create(
+            (
+                Tag(name=f'Тег {number}', slug=f'tag{number}')
+                for number in range(count)
+            ),
+            ignore_conflicts=True
+        )
+        return list(Tag.objects.filter(
+            slug__in=[f'tag{number}' for number in range(count)]
+        ).order_by('id').values_list('id', flat=True))
+
+    def get_ingredients(self, count):
+        ingredient_ids = list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True)
+        )
+        missing = count - len(ingredient_ids)
+        if missing > 0:
+            Ingredient.objects.bulk_create(
+                (
+                    Ingredient(
+                        name=f'Ингредиент {number}', measurement_unit='г'
+                    )
+                    for number in range(missing)
+                ),
+                batch_size=self.batch_size,
+                ignore_conflicts=True
+            )
+            ingredient_ids = list(
+                Ingredient.objects.order_by('id').values_list('id', flat=True)
+            )
+        return ingredient_ids[:count]
+
+    def create_users(self, count):
+        password = make_password(PASSWORD)
+        users = User.objects.bulk_create(
+            (
+                User(
+                    username=f'{USERNAME_PREFIX}{number}',
+                    email=f'{USERNAME_PREFIX}{number}@example.com',
+                    first_name=f'Имя {number}',
+                    last_name=f'Фамилия {number}',
+                    password=password,
+                )
+                for number in range(count)
+            ),
+            batch_size=self.batch_size
+        )
+        return [user.id for user in users]
+
+    def create_recipes(self, count, user_ids):
+        rng = self.rng
+        authors = user_ids[:]
+        rng.shuffle(authors)
+        author_weights = skewed_weights(len(authors), 1.2)
+        recipes = Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    name=f'{" ".join(rng.sample(WORDS, 2)).capitalize()} '
+                         f'{number}',
+                    text=' '.join(rng.choices(WORDS, k=30)),
+                    cooking_time=rng.randint(5, 180),
+                    author_id=rng.choices(
+                        authors, cum_weights=author_weights
+                    )[0],
+                    image='',
+                )
+                for number in range(count)
+            ),
+            batch_size=self.batch_size
+        )
+        # pub_date с auto_now_add перезаписывается при создании.
+        for recipe in recipes:
+            recipe.pub_date = START_DATE + timedelta(
+                seconds=rng.randrange(365 * 24 * 3600)
+            )
+        Recipe.objects.bulk_update(
+            recipes, ('pub_date',), batch_size=self.batch_size
+        )
+        return recipes
+
+    def create_links(self, recipes, tag_ids, ingredient_ids):
+        rng = self.rng
+        ingredient_weights = skewed_weights(len(ingredient_ids), 1.0)
+        RecipeTag.objects.bulk_create(
+            (
+                RecipeTag(recipe=recipe, tag_id=tag_id)
+                for recipe in recipes
+                for tag_id in rng.sample(tag_ids, rng.randint(1, 3))
+            ),
+            batch_size=self.batch_size
+        )
+        IngredientRecipe.objects.bulk_create(
+            (
+                IngredientRecipe(
+                    recipe=recipe, ingredient_id=ingredient_id,
+                    amount=rng.randint(1, 500)
+                )
+                for recipe in recipes
+                for ingredient_id in sample_skewed(
+                    rng, ingredient_ids, ingredient_weights,
+                    rng.randint(3, 12)
+                )
+            ),
+            batch_size=self.batch_size
+        )
+
+    def get_count(self, mean, limit):
+        return min(limit, int(self.rng.expovariate(1 / mean))) if mean else 0
+
+    def create_user_links(self, model, field, user_ids, targets, mean):
+        """ Избранное, корзина или подписки с перекосом к популярным. """
+        rng = self.rng
+        targets = targets[:]
+        rng.shuffle(targets)
+        weights = skewed_weights(len(targets), 1.1)
+        model.objects.bulk_create(
+            (
+                model(user_id=user_id, **{f'{field}_id': target})
+                for user_id in user_ids
+                for target in sample_skewed(
+                    rng, targets, weights,
+                    self.get_count(mean, len(targets) - 1),
+                    exclude=user_id if field == 'author' else None
+                )
+            ),
+            batch_size=self.batch_size
+        )
+
+    @transaction.atomic
+    def seed(self, options):
+        tag_ids = self.get_tags(options['tags'])
+        ingredient_ids = self.get_ingredients(options['ingredients'])
+        user_ids = self.create_users(options['users'])
+        self.log(f'Пользователи: {len(user_ids)}')
+        recipes = self.create_recipes(options['recipes'], user_ids)
+        self.log(f'Рецепты: {len(recipes)}')
+        self.create_links(recipes, tag_ids, ingredient_ids)
+        self.log('Теги и ингредиенты рецептов')
+        recipe_ids = [recipe.id for recipe in recipes]
+        self.create_user_links(
+            Favorite, 'recipe', user_ids, recipe_ids, options['favorites']
+        )
+        self.create_user_links(
+            ShoppingCart, 'recipe', user_ids, recipe_ids, options['cart']
+        )
+        self.create_user_links(
+            Subscription, 'author', user_ids, user_ids,
+            options['subscriptions']
+        )
+        self.log('Избранное, корзины и подписки')
+        # bulk_create не отправляет сигналы, производные данные
+        # пересчитываются здесь.
+        recount()
+        create_missing_scores()
+        update_search_vectors(Recipe.objects.filter(pk__in=recipe_ids))
+        for user_id in User.objects.filter(
+            pk__in=user_ids,
+            subscriptions_count__gte=settings.FEED_FANOUT_THRESHOLD
+        ).values_list('id', flat=True):
+            rebuild_timeline(user_id)
+        self.log('Счетчики, рейтинги, поиск и ленты')
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        if self.batch_size <= 0:
+            raise CommandError('--batch-size должен быть больше нуля')
+        if options['users'] < 2 or options['tags'] < 3:
+            raise CommandError('Нужно хотя бы 2 пользователя и 3 тега')
+        if options['recipes'] <= 0 or options['ingredients'] < 12:
+            raise CommandError('Нужен хотя бы 1 рецепт и 12 ингредиентов')
+        benchmark_users = User.objects.filter(
+            username__startswith=USERNAME_PREFIX
+        )
+        if options['clear']:
+            benchmark_users.delete()
+        elif benchmark_users.exists():
+            raise CommandError(
+                'Данные уже сгенерированы, используйте --clear'
+            )
+        self.rng = random.Random(options['seed'])
+        self.started = time.monotonic()
+        self.seed(options)
+        for name in ('recipe', 'tag', 'ingredient'):
+            bump_cache_version(name)
+        self.stdout.write(self.style.SUCCESS(
+            'Данные сгенерированы. Похожие рецепты строятся отдельно: '
+            'python manage.py build_recipe_similarity'
+        ))
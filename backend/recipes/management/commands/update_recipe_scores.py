@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.cache import bump_cache_version
+from recipes.scores import update_scores
+
+
+class Command(BaseCommand):
+    """
+    Обновляет рейтинги trending и popular:
+    python manage.py update_recipe_scores
+    Учитываются только события с прошлого запуска, поэтому
+    команду можно запускать по расписанию раз в несколько минут.
+    """
+    help = 'Обновляет рейтинги рецептов'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        updated = update_scores()
+        if updated:
+            bump_cache_version('recipe')
+        self.stdout.write(self.style.SUCCESS(
+            f'Рецептов с новой активностью: {updated}, '
+            f'{time.monotonic() - started:.1f} с'
+        ))
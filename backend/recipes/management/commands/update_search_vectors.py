@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from recipes.search import update_search_vectors
+
+
+class Command(BaseCommand):
+    """
+    Заполняет поисковые векторы всех рецептов:
+    python manage.py update_search_vectors
+    Нужна после первого развертывания поиска и после ручных
+    изменений в БД. Рецепты обновляются пачками по id.
+    """
+    help = 'Пересчитывает поисковые векторы рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        updated = 0
+        while True:
+            recipe_ids = list(
+                Recipe.objects.filter(id__gt=last_id).order_by(
+                    'id'
+                ).values_list('id', flat=True)[:batch_size]
+            )
+            if not recipe_ids:
+                break
+            updated += update_search_vectors(
+                Recipe.objects.filter(id__in=recipe_ids)
+            )
+            last_id = recipe_ids[-1]
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено векторов: {updated}'
+        ))
@@ -1,7 +1,11 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models.expressions import Window
+from django.db.models.functions import RowNumber
 from colorfield.fields import ColorField
 from django.core.validators import MinValueValidator
 
+from users.mixins import CounterFieldsMixin
 from users.models import User
 
 MESSAGE_COOKING_TIME = 'Время приготовления не может быть меньше минуты.'
@@ -9,7 +13,11 @@ MESSAGE_AMOUNT = 'Количество должно быть равно хотя
 
 
 class Ingredient(models.Model):
-    """ Ингридиенты для рецепта. """
+    """ Ингридиенты для рецепта.
+
+    Индекс по UPPER(name) для поиска по началу названия создается
+    только в PostgreSQL, см. recipes.signals.create_postgres_indexes.
+    """
     name = models.CharField(
         'Название ингридиента',
         max_length=200,
@@ -23,6 +31,12 @@ class Ingredient(models.Model):
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
         ordering = ('name',)
+        constraints = (
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit',),
+                name='unique_ingredient_unit'
+            ),
+        )
 
     def __str__(self) -> str:
         """Строковое представление объекта модели."""
@@ -53,8 +67,80 @@ class Tag(models.Model):
         return self.name
 
 
-class Recipe(models.Model):
-    """ Рецепты. """
+class RecipeQuerySet(models.QuerySet):
+    """ Выборки рецептов для выдачи в API. """
+
+    def with_related(self):
+        """ Подгружает автора, теги и ингредиенты одним набором запросов. """
+        return self.select_related('author').prefetch_related(
+            models.Prefetch(
+                'amount_ingredients',
+                queryset=IngredientRecipe.objects.select_related(
+                    'ingredient'
+                ).order_by('id')
+            ),
+            'tags'
+        )
+
+    def with_user_flags(self, user):
+        """ Аннотирует is_favorited и is_in_shopping_cart для user.
+
+        Для анонимного пользователя оба флага - константа False.
+        """
+        if user is None or user.is_anonymous:
+            return self.annotate(
+                is_favorited=models.Value(
+                    False, output_field=models.BooleanField()),
+                is_in_shopping_cart=models.Value(
+                    False, output_field=models.BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=models.Exists(Favorite.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+            is_in_shopping_cart=models.Exists(ShoppingCart.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+        )
+
+    def latest_per_author(self, limit):
+        """ Не больше limit самых новых рецептов каждого автора.
+
+        Номера рецептов внутри автора считает ROW_NUMBER() в подзапросе
+        по той же выборке. Django 3.2 не фильтрует по оконным
+        выражениям, поэтому подзапрос отдает id только рецептов
+        с номером не больше limit, у остальных NULL.
+        """
+        row_number = Window(
+            RowNumber(),
+            partition_by=models.F('author'),
+            order_by=(models.F('pub_date').desc(), models.F('pk').desc())
+        )
+        within_limit = models.Func(
+            row_number, models.Value(limit), template='%(expressions)s',
+            arg_joiner=' <= ', output_field=models.BooleanField()
+        )
+        return self.model.objects.filter(pk__in=models.Subquery(
+            self.order_by().annotate(latest_pk=models.Case(
+                models.When(within_limit, then=models.F('pk'))
+            )).values('latest_pk')
+        ))
+
+
+class RecipeManager(models.Manager.from_queryset(RecipeQuerySet)):
+    """ Менеджер рецептов без поискового вектора в выборке.
+
+    Вектор нужен только в условиях поиска и не читается в память.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().defer('search_vector')
+
+
+class Recipe(CounterFieldsMixin, models.Model):
+    """ Рецепты.
+
+    GIN-индекс поискового вектора создается только в PostgreSQL,
+    см. recipes.signals.create_postgres_indexes.
+    """
     name = models.CharField(
         'Название рецепта',
         max_length=200
@@ -65,6 +151,18 @@ class Recipe(models.Model):
         null=True,
         default=None
     )
+    image_thumbnail = models.ImageField(
+        'Миниатюра изображения',
+        upload_to='recipes/images/variants',
+        blank=True,
+        editable=False
+    )
+    image_webp = models.ImageField(
+        'Изображение в WebP',
+        upload_to='recipes/images/variants',
+        blank=True,
+        editable=False
+    )
     text = models.TextField(
         'Описание',
         max_length=1000,
@@ -81,6 +179,7 @@ class Recipe(models.Model):
     )
     tags = models.ManyToManyField(
         Tag,
+        through='RecipeTag',
         verbose_name='Теги'
     )
     cooking_time = models.PositiveSmallIntegerField(
@@ -92,18 +191,87 @@ class Recipe(models.Model):
         'Дата и время публикации',
         auto_now_add=True
     )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном',
+        default=0,
+        editable=False
+    )
+    cart_count = models.PositiveIntegerField(
+        'В списках покупок',
+        default=0,
+        editable=False
+    )
+
+    search_vector = SearchVectorField(
+        'Поисковый вектор',
+        null=True,
+        editable=False
+    )
+
+    objects = RecipeManager()
+    counter_fields = ('favorites_count', 'cart_count')
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
         default_related_name = 'recipes'
+        indexes = (
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=('author', '-pub_date'),
+                name='recipe_author_pub_date_idx'
+            ),
+        )
 
     def __str__(self) -> str:
         """Строковое представление объекта модели."""
         return self.name
 
 
+class RecipeTag(models.Model):
+    """ Теги рецепта.
+
+    Связывает модели Recipe и Tag, таблица та же,
+    что у автоматической связи ManyToMany.
+    """
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт'
+    )
+    tag = models.ForeignKey(
+        Tag,
+        on_delete=models.CASCADE,
+        verbose_name='Тег'
+    )
+
+    class Meta:
+        db_table = 'recipes_recipe_tags'
+        verbose_name = 'Тег рецепта'
+        verbose_name_plural = 'Теги рецепта'
+        default_related_name = 'recipe_tags'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('recipe', 'tag',),
+                name='unique_recipe_tag'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('tag', 'recipe'),
+                name='recipe_tag_tag_recipe_idx'
+            ),
+        )
+
+    def __str__(self) -> str:
+        """Строковое представление объекта модели."""
+        return f'{self.recipe} {self.tag}'
+
+
 class IngredientRecipe(models.Model):
     """ Количество ингридиентов в рецепте блюда.
         Вспомогательная модель.
@@ -167,6 +335,12 @@ class Favorite(models.Model):
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
         default_related_name = 'favorites'
+        indexes = (
+            models.Index(
+                fields=('date_added',),
+                name='favorite_date_idx'
+            ),
+        )
         constraints = (
             models.UniqueConstraint(
                 fields=('user', 'recipe',),
@@ -192,11 +366,22 @@ class ShoppingCart(models.Model):
         on_delete=models.CASCADE,
         verbose_name='Рецепт',
     )
+    date_added = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True,
+        editable=False
+    )
 
     class Meta:
         verbose_name = 'Корзина'
         verbose_name_plural = 'Корзина'
         default_related_name = 'cart'
+        indexes = (
+            models.Index(
+                fields=('date_added',),
+                name='shopping_cart_date_idx'
+            ),
+        )
         constraints = (
             models.UniqueConstraint(
                 fields=('user', 'recipe',),
@@ -232,6 +417,12 @@ class Subscription(models.Model):
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+        indexes = (
+            models.Index(
+                fields=('user', '-date_added'),
+                name='subscription_user_date_idx'
+            ),
+        )
         constraints = (
             models.UniqueConstraint(
                 fields=('user', 'author',),
@@ -246,3 +437,95 @@ class Subscription(models.Model):
     def __str__(self) -> str:
         """Строковое представление объекта модели."""
         return f'{self.user} подписан на {self.author}'
+
+
+class FeedEntry(models.Model):
+    """ Лента подписок пользователя.
+
+    Заполняется при публикации рецепта только для пользователей
+    с большим числом подписок, см. recipes.feed.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт'
+    )
+    pub_date = models.DateTimeField('Дата и время публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Лента'
+        default_related_name = 'feed_entries'
+        indexes = (
+            models.Index(
+                fields=('user', '-pub_date', '-recipe'),
+                name='feed_user_pub_date_idx'
+            ),
+        )
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe',),
+                name='unique_feed_entry'
+            ),
+        )
+
+    def __str__(self) -> str:
+        """Строковое представление объекта модели."""
+        return f'{self.user} :: {self.recipe}'
+
+
+class RecipeScore(models.Model):
+    """ Рейтинги рецепта по активности с затуханием во времени.
+
+    Значения хранятся относительно опорной даты RecipeScoreState,
+    поэтому новые события прибавляются к рейтингу, удаленные
+    вычитаются, а старые строки не пересчитываются, см. recipes.scores.
+    """
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='score',
+        verbose_name='Рецепт'
+    )
+    trending = models.FloatField('Набирает популярность', default=0)
+    popular = models.FloatField('Популярное', default=0)
+
+    class Meta:
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+        indexes = (
+            models.Index(
+                fields=('-trending', '-recipe'),
+                name='recipe_score_trending_idx'
+            ),
+            models.Index(
+                fields=('-popular', '-recipe'),
+                name='recipe_score_popular_idx'
+            ),
+        )
+
+    def __str__(self) -> str:
+        """Строковое представление объекта модели."""
+        return f'{self.recipe_id}: {self.trending:.3g} / {self.popular:.3g}'
+
+
+class RecipeScoreState(models.Model):
+    """ Опорная дата рейтингов и граница обработанных событий. """
+    landmark = models.DateTimeField('Опорная дата')
+    processed_until = models.DateTimeField(
+        'События учтены до', null=True
+    )
+
+    class Meta:
+        verbose_name = 'Состояние рейтингов'
+        verbose_name_plural = 'Состояние рейтингов'
+
+    def __str__(self) -> str:
+        """Строковое представление объекта модели."""
+        return f'{self.landmark} / {self.processed_until}'
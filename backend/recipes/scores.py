@@ -0,0 +1,189 @@
+import math
+import threading
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (
+    Case,
+    Exists,
+    ExpressionWrapper,
+    F,
+    FloatField,
+    Subquery,
+    Sum,
+    Value,
+    When
+)
+from django.db.models.functions import Exp, Extract, Greatest
+from django.utils import timezone
+
+from recipes.models import (
+    Favorite,
+    Recipe,
+    RecipeScore,
+    RecipeScoreState,
+    ShoppingCart
+)
+
+RANKINGS = ('trending', 'popular')
+# Когда множитель опорной даты дорастет до e**MAX_EXPONENT,
+# рейтинги пересчитываются к новой опорной дате.
+MAX_EXPONENT = 100
+BATCH_SIZE = 500
+
+_deleted_recipes = threading.local()
+
+
+def get_decay_rates():
+    """ Скорость затухания каждого рейтинга, 1/с. """
+    return {
+        'trending': math.log(2) / settings.RECIPE_TRENDING_HALF_LIFE,
+        'popular': math.log(2) / settings.RECIPE_POPULAR_HALF_LIFE,
+    }
+
+
+def get_contributions(model, weight, since, until, landmark, rates):
+    """ Вклад событий окна (since, until] в рейтинги рецептов.
+
+    Событие в момент t дает weight * exp(rate * (t - landmark)):
+    это его вес с затуханием к опорной дате, умноженный на общий
+    для всех рецептов множитель, который не меняет порядок.
+    """
+    events = model.objects.filter(date_added__lte=until)
+    if since is not None:
+        events = events.filter(date_added__gt=since)
+    age = ExpressionWrapper(
+        Extract('date_added', 'epoch') - Value(landmark.timestamp()),
+        output_field=FloatField()
+    )
+    return events.order_by().values('recipe').annotate(**{
+        name: Sum(Exp(age * Value(rate)), output_field=FloatField())
+        * Value(weight)
+        for name, rate in rates.items()
+    }).values_list('recipe', *RANKINGS)
+
+
+def add_to_scores(totals):
+    """ Прибавляет вклады к рейтингам пачками, по UPDATE на пачку. """
+    items = iter(totals.items())
+    while True:
+        batch = list(islice(items, BATCH_SIZE))
+        if not batch:
+            return
+        RecipeScore.objects.filter(
+            recipe_id__in=[recipe_id for recipe_id, _ in batch]
+        ).update(**{
+            name: F(name) + Case(
+                *(
+                    When(recipe_id=recipe_id, then=Value(values[index]))
+                    for recipe_id, values in batch
+                ),
+                default=Value(0.0),
+                output_field=FloatField()
+            )
+            for index, name in enumerate(RANKINGS)
+        })
+
+
+def get_deleted_recipes():
+    """ id рецептов, которые сейчас удаляются в этом потоке. """
+    if not hasattr(_deleted_recipes, 'ids'):
+        _deleted_recipes.ids = set()
+    return _deleted_recipes.ids
+
+
+def remove_from_scores(event, weight):
+    """ Вычитает из рейтингов вклад удаленного события одним UPDATE.
+
+    Условие на processed_until и опорная дата читаются подзапросами
+    без блокировки, поэтому удаления не ждут друг друга и пересчет.
+    Событие, которое update_scores еще не учел, пропускается: после
+    удаления следующий запуск его уже не прочитает. Если удаление
+    совпало с пересчетом, учтенный им вклад может остаться и затухнет
+    сам. Для удаляемого рецепта ничего не делается: его рейтинг
+    удаляется вместе с ним. Рейтинг не опускается ниже нуля из-за
+    погрешности вычислений.
+    """
+    if event.recipe_id in get_deleted_recipes():
+        return
+    state = RecipeScoreState.objects.filter(pk=1)
+    age = ExpressionWrapper(
+        Value(event.date_added.timestamp())
+        - Extract(Subquery(state.values('landmark')), 'epoch'),
+        output_field=FloatField()
+    )
+    RecipeScore.objects.filter(
+        Exists(state.filter(processed_until__gte=event.date_added)),
+        recipe_id=event.recipe_id
+    ).update(**{
+        name: Greatest(
+            F(name) - Value(weight) * Exp(age * Value(rate)),
+            Value(0.0)
+        )
+        for name, rate in get_decay_rates().items()
+    })
+
+
+def create_missing_scores():
+    """ Строки рейтингов для рецептов, у которых их еще нет. """
+    recipe_ids = Recipe.objects.filter(
+        score__isnull=True
+    ).values_list('id', flat=True).iterator()
+    while True:
+        batch = list(islice(recipe_ids, BATCH_SIZE))
+        if not batch:
+            return
+        RecipeScore.objects.bulk_create(
+            (RecipeScore(recipe_id=recipe_id) for recipe_id in batch),
+            ignore_conflicts=True
+        )
+
+
+def rebase(state, now, rates):
+    """ Переносит опорную дату на now, умножая все рейтинги. """
+    seconds = (now - state.landmark).total_seconds()
+    RecipeScore.objects.update(**{
+        name: F(name) * Value(math.exp(-rate * seconds))
+        for name, rate in rates.items()
+    })
+    state.landmark = now
+
+
+def update_scores(now=None):
+    """ Учитывает в рейтингах события с прошлого запуска.
+
+    Читаются только избранное и корзины, добавленные в окне
+    с прошлой границы до now минус RECIPE_SCORE_LAG: задержка
+    оставляет время закоммититься транзакциям, начатым раньше.
+    Возвращает число рецептов с новой активностью.
+    """
+    now = now or timezone.now()
+    until = now - timedelta(seconds=settings.RECIPE_SCORE_LAG)
+    rates = get_decay_rates()
+    with transaction.atomic():
+        state, _ = RecipeScoreState.objects.select_for_update(
+        ).get_or_create(pk=1, defaults={'landmark': now})
+        since = state.processed_until
+        if since is not None and until <= since:
+            return 0
+        create_missing_scores()
+        seconds = (until - state.landmark).total_seconds()
+        if max(rates.values()) * seconds > MAX_EXPONENT:
+            rebase(state, now, rates)
+        totals = {}
+        for model, weight in (
+            (Favorite, settings.RECIPE_SCORE_FAVORITE_WEIGHT),
+            (ShoppingCart, settings.RECIPE_SCORE_CART_WEIGHT),
+        ):
+            for recipe_id, *values in get_contributions(
+                model, weight, since, until, state.landmark, rates
+            ):
+                current = totals.setdefault(recipe_id, [0.0] * len(rates))
+                for index, value in enumerate(values):
+                    current[index] += value
+        add_to_scores(totals)
+        state.processed_until = until
+        state.save()
+    return len(totals)
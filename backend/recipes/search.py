@@ -0,0 +1,428 @@
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector
+)
+from django.db import connection, transaction
+from django.db.models import (
+    Case,
+    F,
+    IntegerField,
+    OuterRef,
+    Subquery,
+    TextField,
+    When
+)
+
+import numpy as np
+
+from recipes.cache import get_cache_version
+from recipes.models import Ingredient, IngredientRecipe, Recipe
+
+_pending_search_updates = threading.local()
+
+
+class IngredientIndex:
+    """ Префиксный индекс ингредиентов в памяти процесса.
+
+    Хранит отсортированные названия в нижнем регистре и строится
+    из таблицы при первом поиске после сброса. Индекс помечен
+    версией каталога из общего кэша и перестраивается, когда ее
+    увеличил другой процесс: воркер, админка или команда загрузки.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+
+    def invalidate(self):
+        """ Сбрасывает индекс, он перестроится при следующем поиске. """
+        self._data = None
+
+    def _get_fresh(self, version):
+        data = self._data
+        if data is not None and data[0] == version:
+            return data
+        return None
+
+    def _load(self):
+        version = get_cache_version('ingredient')
+        data = self._get_fresh(version)
+        if data is not None:
+            return data
+        with self._lock:
+            if self._get_fresh(version) is None:
+                ingredients = sorted(
+                    Ingredient.objects.all(),
+                    key=lambda ingredient: ingredient.name.lower()
+                )
+                keys = [ingredient.name.lower() for ingredient in ingredients]
+                self._data = (version, keys, ingredients)
+            return self._data
+
+    def search(self, name, limit, load=True):
+        """ Сначала совпадения по началу названия, затем по подстроке.
+
+        С load=False индекс не строится: если он сброшен или устарел,
+        возвращается None, к БД обращения нет.
+        """
+        if load:
+            data = self._load()
+        else:
+            data = self._get_fresh(get_cache_version('ingredient'))
+        if data is None:
+            return None
+        _, keys, ingredients = data
+        name = name.lower()
+        result = []
+        position = bisect_left(keys, name)
+        while (position < len(keys) and len(result) < limit
+               and keys[position].startswith(name)):
+            result.append(ingredients[position])
+            position += 1
+        if len(result) < limit:
+            for key, ingredient in zip(keys, ingredients):
+                if name in key and not key.startswith(name):
+                    result.append(ingredient)
+                    if len(result) == limit:
+                        break
+        return result
+
+
+ingredient_index = IngredientIndex()
+
+
+def search_ingredients_in_db(name, limit):
+    """ Тот же поиск запросами к БД для нескольких процессов.
+
+    Поиск по началу названия использует индекс по UPPER(name).
+    """
+    result = list(Ingredient.objects.filter(name__istartswith=name)[:limit])
+    if len(result) < limit:
+        result += Ingredient.objects.filter(
+            name__icontains=name
+        ).exclude(
+            name__istartswith=name
+        )[:limit - len(result)]
+    return result
+
+
+def search_ingredients(name):
+    """ Ищет ингредиенты для автодополнения по названию.
+
+    Поиск запросами к БД работает только на PostgreSQL: LIKE в SQLite
+    не учитывает регистр лишь для латиницы, поэтому на других БД
+    используется индекс в памяти.
+    """
+    limit = settings.INGREDIENT_SEARCH_LIMIT
+    if (settings.INGREDIENT_SEARCH_BACKEND == 'database'
+            and connection.vendor == 'postgresql'):
+        return search_ingredients_in_db(name, limit)
+    return ingredient_index.search(name, limit)
+
+
+class RecipeIngredientIndex:
+    """ Обратный индекс ингредиент -> рецепты в памяти процесса.
+
+    Рецепты лежат в массивах по позициям: id, число ингредиентов
+    и признак актуальности. Для каждого ингредиента хранится массив
+    позиций рецептов. Измененный рецепт получает новую позицию,
+    старая помечается неактуальной; когда неактуальных больше
+    половины, индекс перестраивается. Изменения из других процессов
+    подхватываются перестроением раз в RECIPE_INGREDIENT_INDEX_TTL:
+    оно идет в фоновом потоке, а поиск до его конца читает
+    прежний индекс.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+        self._built_at = 0
+        self._generation = 0
+        # id рецептов, измененных во время фонового перестроения,
+        # или None, если перестроение не идет.
+        self._rebuilding = None
+
+    def invalidate(self):
+        """ Сбрасывает индекс, он перестроится при следующем поиске. """
+        with self._lock:
+            self._data = None
+            self._generation += 1
+
+    def _build(self):
+        pairs = np.array(
+            list(IngredientRecipe.objects.order_by().values_list(
+                'recipe_id', 'ingredient_id'
+            )),
+            dtype=np.int64
+        ).reshape(-1, 2)
+        recipe_ids, positions = np.unique(pairs[:, 0], return_inverse=True)
+        totals = np.bincount(positions, minlength=len(recipe_ids))
+        order = np.argsort(pairs[:, 1], kind='stable')
+        ingredient_ids, starts = np.unique(
+            pairs[order, 1], return_index=True
+        )
+        postings = dict(zip(
+            ingredient_ids.tolist(),
+            np.split(positions[order].astype(np.int32), starts[1:])
+        ))
+        return {
+            'recipe_ids': recipe_ids,
+            'totals': totals,
+            'alive': np.ones(len(recipe_ids), dtype=bool),
+            'positions': {
+                recipe_id: position
+                for position, recipe_id in enumerate(recipe_ids.tolist())
+            },
+            'postings': postings,
+        }
+
+    def _load(self):
+        data = self._data
+        ttl = settings.RECIPE_INGREDIENT_INDEX_TTL
+        if data is not None and time.monotonic() - self._built_at < ttl:
+            return data
+        with self._lock:
+            if self._data is None:
+                self._data = self._build()
+                self._built_at = time.monotonic()
+            elif (self._rebuilding is None
+                    and time.monotonic() - self._built_at >= ttl):
+                self._rebuilding = set()
+                self._start_rebuild()
+            return self._data
+
+    def _start_rebuild(self):
+        threading.Thread(
+            target=self._rebuild_in_background, daemon=True
+        ).start()
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        finally:
+            # У потока свое соединение, сигналы запроса его не закроют.
+            connection.close()
+
+    def rebuild(self):
+        """ Строит индекс заново и подменяет им текущий.
+
+        Рецепты, измененные за время построения, переиндексируются
+        в новом индексе. Если индекс за это время сбросили,
+        результат отбрасывается.
+        """
+        with self._lock:
+            generation = self._generation
+        try:
+            data = self._build()
+        except Exception:
+            with self._lock:
+                self._rebuilding = None
+            raise
+        with self._lock:
+            recipe_ids = self._rebuilding
+            self._rebuilding = None
+            if generation != self._generation:
+                return
+            if recipe_ids:
+                data = self._updated(data, recipe_ids)
+            self._data = data
+            self._built_at = time.monotonic()
+
+    def update(self, recipe_ids):
+        """ Переиндексирует рецепты после записи.
+
+        Новые массивы собираются отдельно и подменяют старые целиком,
+        поэтому параллельные поиски видят согласованный снимок.
+        """
+        with self._lock:
+            if self._rebuilding is not None:
+                self._rebuilding.update(recipe_ids)
+            if self._data is not None:
+                self._data = self._updated(self._data, recipe_ids)
+
+    def _updated(self, data, recipe_ids):
+        """ Индекс data с переиндексированными рецептами или None. """
+        rows = {}
+        for recipe_id, ingredient_id in IngredientRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by().values_list('recipe_id', 'ingredient_id'):
+            rows.setdefault(recipe_id, []).append(ingredient_id)
+        alive = data['alive'].copy()
+        positions = dict(data['positions'])
+        for recipe_id in recipe_ids:
+            position = positions.pop(recipe_id, None)
+            if position is not None:
+                alive[position] = False
+        size = len(alive)
+        postings = dict(data['postings'])
+        new_postings = {}
+        for offset, (recipe_id, ingredient_ids) in enumerate(rows.items()):
+            positions[recipe_id] = size + offset
+            for ingredient_id in ingredient_ids:
+                new_postings.setdefault(ingredient_id, []).append(
+                    size + offset
+                )
+        for ingredient_id, added in new_postings.items():
+            postings[ingredient_id] = np.append(
+                postings.get(ingredient_id, np.empty(0, np.int32)),
+                np.array(added, dtype=np.int32)
+            )
+        alive = np.append(alive, np.ones(len(rows), dtype=bool))
+        if np.count_nonzero(~alive) * 2 > len(alive):
+            return None
+        return {
+            'recipe_ids': np.append(
+                data['recipe_ids'], np.array(list(rows), dtype=np.int64)
+            ),
+            'totals': np.append(
+                data['totals'],
+                np.array([len(ids) for ids in rows.values()], dtype=np.int64)
+            ),
+            'alive': alive,
+            'positions': positions,
+            'postings': postings,
+        }
+
+    def search(self, ingredient_ids):
+        """ id рецептов хотя бы с одним из ингредиентов.
+
+        Порядок: доля имеющихся ингредиентов рецепта, затем меньше
+        недостающих, затем новые рецепты первыми.
+        """
+        data = self._load()
+        postings = [
+            data['postings'][ingredient_id]
+            for ingredient_id in set(ingredient_ids)
+            if ingredient_id in data['postings']
+        ]
+        if not postings:
+            return []
+        counts = np.bincount(
+            np.concatenate(postings), minlength=len(data['alive'])
+        )
+        candidates = np.flatnonzero((counts > 0) & data['alive'])
+        have = counts[candidates]
+        totals = data['totals'][candidates]
+        recipe_ids = data['recipe_ids'][candidates]
+        order = np.lexsort((-recipe_ids, totals - have, -have / totals))
+        return recipe_ids[order].tolist()
+
+
+recipe_ingredient_index = RecipeIngredientIndex()
+
+
+def get_search_vector():
+    """ Вектор рецепта: название (A), описание (B), ингредиенты (C). """
+    config = settings.RECIPE_SEARCH_CONFIG
+    ingredient_names = Subquery(
+        IngredientRecipe.objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names'),
+        output_field=TextField()
+    )
+    return (
+        SearchVector('name', weight='A', config=config)
+        + SearchVector('text', weight='B', config=config)
+        + SearchVector(ingredient_names, weight='C', config=config)
+    )
+
+
+def update_search_vectors(recipes):
+    """ Пересчитывает поисковый вектор рецептов одним UPDATE. """
+    if connection.vendor != 'postgresql':
+        return 0
+    return recipes.update(search_vector=get_search_vector())
+
+
+def flush_search_updates():
+    recipe_ids = getattr(_pending_search_updates, 'ids', None)
+    if not recipe_ids:
+        return
+    _pending_search_updates.ids = set()
+    update_search_vectors(Recipe.objects.filter(pk__in=recipe_ids))
+    recipe_ingredient_index.update(recipe_ids)
+
+
+def schedule_search_update(*recipe_ids):
+    """ Обновляет поисковые индексы рецептов после коммита транзакции.
+
+    Изменения рецепта и его ингредиентов в одной транзакции
+    собираются в один UPDATE вектора и одно обновление
+    обратного индекса ингредиентов.
+    """
+    if not hasattr(_pending_search_updates, 'ids'):
+        _pending_search_updates.ids = set()
+    _pending_search_updates.ids.update(recipe_ids)
+    transaction.on_commit(flush_search_updates)
+
+
+def search_recipes_in_python(queryset, text):
+    """ Поиск рецептов без полнотекстового индекса.
+
+    Рецепт подходит, если каждое слово запроса есть в названии,
+    описании или ингредиентах. Сравнение идет через casefold(),
+    поэтому, в отличие от LIKE в SQLite, не зависит от регистра
+    и для кириллицы. Вес совпадения: название 3, описание 2,
+    ингредиенты 1. Рецепты перебираются в памяти, поэтому способ
+    годится только для небольших баз и тестов.
+    """
+    words = text.casefold().split()
+    recipe_ids = queryset.order_by().values('pk')
+    ingredient_names = {}
+    for recipe_id, name in IngredientRecipe.objects.filter(
+        recipe__in=recipe_ids
+    ).values_list('recipe_id', 'ingredient__name'):
+        ingredient_names.setdefault(recipe_id, []).append(name.casefold())
+    ranks = {}
+    for pk, name, description in queryset.order_by().values_list(
+        'pk', 'name', 'text'
+    ):
+        fields = (
+            (3, name.casefold()),
+            (2, description.casefold()),
+            (1, ' '.join(ingredient_names.get(pk, ()))),
+        )
+        weights = [
+            max((weight for weight, field in fields if word in field),
+                default=0)
+            for word in words
+        ]
+        if all(weights):
+            ranks[pk] = sum(weights)
+    if not ranks:
+        return queryset.none()
+    return queryset.filter(pk__in=ranks).annotate(
+        search_rank=Case(
+            *(When(pk=pk, then=rank) for pk, rank in ranks.items()),
+            output_field=IntegerField()
+        )
+    ).order_by('-search_rank', '-pub_date', '-id')
+
+
+def search_recipes(queryset, text):
+    """ Полнотекстовый поиск рецептов, лучшие совпадения первыми.
+
+    На PostgreSQL условие идет по GIN-индексу вектора и сочетается
+    с остальными условиями фильтра. На других БД, например SQLite
+    в тестах, и с RECIPE_SEARCH_BACKEND=python рецепты ищутся
+    в памяти, см. search_recipes_in_python.
+    """
+    if (settings.RECIPE_SEARCH_BACKEND != 'fulltext'
+            or connection.vendor != 'postgresql'):
+        return search_recipes_in_python(queryset, text)
+    query = SearchQuery(
+        text, config=settings.RECIPE_SEARCH_CONFIG,
+        search_type='websearch'
+    )
+    return queryset.filter(search_vector=query).annotate(
+        search_rank=SearchRank(F('search_vector'), query)
+    ).order_by('-search_rank', '-pub_date', '-id')
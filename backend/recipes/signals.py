@@ -0,0 +1,162 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from recipes import feed
+from recipes.counters import change_counter
+from recipes.images import schedule_variants
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    RecipeScore,
+    ShoppingCart,
+    Subscription
+)
+from recipes.scores import (
+    create_missing_scores,
+    get_deleted_recipes,
+    remove_from_scores
+)
+from recipes.search import ingredient_index, schedule_search_update
+from users.models import User
+
+# Индексы только для PostgreSQL: в Meta.indexes они ломают создание
+# схемы на других БД. IF NOT EXISTS делает повторный запуск безопасным.
+POSTGRES_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS ingredient_name_upper_idx '
+    'ON recipes_ingredient (UPPER(name) text_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS recipe_search_vector_idx '
+    'ON recipes_recipe USING gin (search_vector)',
+)
+
+
+def create_postgres_indexes(sender, using, **kwargs):
+    """ Создает индексы PostgreSQL после migrate. """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for sql in POSTGRES_INDEXES:
+            cursor.execute(sql)
+
+
+def backfill_recipe_scores(sender, using, **kwargs):
+    """ Создает строки рейтингов рецептам, у которых их нет.
+
+    Сортировки trending и popular соединяют рецепты с рейтингами
+    внутренним соединением, рецепт без строки в них не попадет.
+    """
+    if using == DEFAULT_DB_ALIAS:
+        create_missing_scores()
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    """ Сбрасывает индекс ингредиентов при изменении каталога. """
+    ingredient_index.invalidate()
+
+
+@receiver(post_save, sender=Recipe)
+def schedule_recipe_image_variants(sender, instance, update_fields, **kwargs):
+    """ Ставит в фон построение миниатюры и WebP нового изображения. """
+    if instance.image and (update_fields is None or 'image' in update_fields):
+        schedule_variants(instance)
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def change_recipe_counter(sender, instance, created=False, **kwargs):
+    """ Обновляет счетчики избранного и корзины у рецепта. """
+    if kwargs['signal'] is post_save and not created:
+        return
+    field = 'favorites_count' if sender is Favorite else 'cart_count'
+    change_counter(
+        Recipe.objects.filter(pk=instance.recipe_id),
+        field, 1 if created else -1
+    )
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def change_author_counter(sender, instance, created=False, **kwargs):
+    """ Обновляет счетчик рецептов у автора. """
+    if kwargs['signal'] is post_save and not created:
+        return
+    change_counter(
+        User.objects.filter(pk=instance.author_id),
+        'recipes_count', 1 if created else -1
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(sender, instance, created, **kwargs):
+    """ Добавляет новый рецепт в хранимые ленты подписчиков. """
+    if created:
+        feed.fan_out((instance,))
+
+
+@receiver(post_save, sender=Recipe)
+def create_recipe_score(sender, instance, created, **kwargs):
+    """ Новый рецепт сразу попадает в рейтинги с нулевым счетом. """
+    if created:
+        RecipeScore.objects.create(recipe=instance)
+
+
+@receiver(pre_delete, sender=Recipe)
+def mark_recipe_deleted(sender, instance, **kwargs):
+    """ Каскадные удаления избранного и корзин не трогают рейтинг. """
+    get_deleted_recipes().add(instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def unmark_recipe_deleted(sender, instance, **kwargs):
+    get_deleted_recipes().discard(instance.pk)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def remove_recipe_score(sender, instance, **kwargs):
+    """ Убирает из рейтингов рецепта вклад удаленного события. """
+    remove_from_scores(instance, (
+        settings.RECIPE_SCORE_FAVORITE_WEIGHT if sender is Favorite
+        else settings.RECIPE_SCORE_CART_WEIGHT
+    ))
+
+
+@receiver((post_save, post_delete), sender=Subscription)
+def change_subscriptions(sender, instance, created=False, **kwargs):
+    """ Обновляет счетчик подписок и ленту подписчика. """
+    if kwargs['signal'] is post_save and not created:
+        return
+    change_counter(
+        User.objects.filter(pk=instance.user_id),
+        'subscriptions_count', 1 if created else -1
+    )
+    if created:
+        feed.subscribed(instance)
+    else:
+        feed.unsubscribed(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_search(sender, instance, update_fields, **kwargs):
+    """ Пересчитывает поисковый вектор при изменении текста рецепта. """
+    if update_fields is None or {'name', 'text'} & set(update_fields):
+        schedule_search_update(instance.pk)
+
+
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+def update_ingredient_recipe_search(sender, instance, **kwargs):
+    """ Пересчитывает вектор рецепта при изменении его ингредиентов. """
+    schedule_search_update(instance.recipe_id)
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_search(sender, instance, created, **kwargs):
+    """ Пересчитывает векторы рецептов с переименованным ингредиентом. """
+    if not created:
+        schedule_search_update(*IngredientRecipe.objects.filter(
+            ingredient=instance
+        ).values_list('recipe_id', flat=True))
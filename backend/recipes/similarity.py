@@ -0,0 +1,238 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from scipy import sparse
+
+from recipes.models import IngredientRecipe, RecipeTag
+
+CURRENT_LINK = 'current'
+MODEL_FILES = ('recipe_ids', 'neighbours', 'scores', 'fingerprints')
+
+
+def load_features():
+    """ Признаки рецептов из БД: ингредиенты и теги.
+
+    Возвращает отсортированные id рецептов, разреженную матрицу
+    TF-IDF с нормированными строками и отпечатки наборов признаков.
+    """
+    ingredient_pairs = list(IngredientRecipe.objects.order_by().values_list(
+        'recipe_id', 'ingredient_id'
+    ))
+    tag_pairs = list(RecipeTag.objects.order_by().values_list(
+        'recipe_id', 'tag_id'
+    ))
+    ingredients = np.array(ingredient_pairs, dtype=np.int64).reshape(-1, 2)
+    tags = np.array(tag_pairs, dtype=np.int64).reshape(-1, 2)
+    recipe_ids, rows = np.unique(
+        np.concatenate((ingredients[:, 0], tags[:, 0])), return_inverse=True
+    )
+    # Теги идут после ингредиентов, у каждого вида свой номер признака.
+    features = np.concatenate((ingredients[:, 1] * 2, tags[:, 1] * 2 + 1))
+    feature_ids, columns = np.unique(features, return_inverse=True)
+    is_tag = (feature_ids % 2 == 1)[columns]
+    document_frequency = np.bincount(columns, minlength=len(feature_ids))
+    idf = np.log(len(recipe_ids) / document_frequency) + 1
+    weights = idf[columns] * np.where(
+        is_tag, settings.RECIPE_SIMILARITY_TAG_WEIGHT, 1
+    )
+    matrix = sparse.csr_matrix(
+        (weights.astype(np.float32), (rows, columns)),
+        shape=(len(recipe_ids), len(feature_ids))
+    )
+    matrix.sort_indices()
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1))).ravel()
+    matrix = (
+        sparse.diags(1 / np.maximum(norms, 1e-12)) @ matrix
+    ).tocsr().astype(np.float32)
+    # Отпечаток по исходным id признаков не зависит от нумерации столбцов.
+    fingerprints = np.array(
+        [
+            hash(tuple(feature_ids[matrix.indices[start:end]].tolist()))
+            for start, end in zip(matrix.indptr[:-1], matrix.indptr[1:])
+        ],
+        dtype=np.int64
+    )
+    return recipe_ids, matrix, fingerprints
+
+
+def top_neighbours(matrix, recipe_ids, rows, top_k, batch_size=256):
+    """ Ближайшие по косинусу рецепты для строк rows.
+
+    Сходство считается произведением блока строк на всю матрицу,
+    из каждой строки берутся top_k лучших без самого рецепта.
+    Пустые места заполняются id -1 и сходством 0.
+    """
+    neighbours = np.full((len(rows), top_k), -1, dtype=np.int64)
+    scores = np.zeros((len(rows), top_k), dtype=np.float32)
+    transposed = matrix.T.tocsr()
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        similarity = (matrix[batch] @ transposed).toarray()
+        similarity[np.arange(len(batch)), batch] = 0
+        count = min(top_k, similarity.shape[1])
+        best = np.argpartition(-similarity, count - 1, axis=1)[:, :count]
+        best_scores = np.take_along_axis(similarity, best, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind='stable')
+        best = np.take_along_axis(best, order, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        found = best_scores > 0
+        neighbours[start:start + len(batch), :count] = np.where(
+            found, recipe_ids[best], -1
+        )
+        scores[start:start + len(batch), :count] = np.where(
+            found, best_scores, 0
+        )
+    return neighbours, scores
+
+
+def get_affected_rows(matrix, recipe_ids, fingerprints, model):
+    """ Строки, которые нужно пересчитать после изменения рецептов.
+
+    Это новые и измененные рецепты, рецепты, у которых среди соседей
+    был измененный или удаленный рецепт, и рецепты, в чей top-k
+    измененный рецепт теперь проходит.
+    """
+    old_positions = np.searchsorted(model['recipe_ids'], recipe_ids)
+    old_positions = np.minimum(old_positions, len(model['recipe_ids']) - 1)
+    known = model['recipe_ids'][old_positions] == recipe_ids
+    changed = ~known | (model['fingerprints'][old_positions] != fingerprints)
+    deleted = np.setdiff1d(model['recipe_ids'], recipe_ids)
+    touched_ids = np.concatenate((recipe_ids[changed], deleted))
+    affected = changed.copy()
+    affected[known] |= np.isin(
+        model['neighbours'][old_positions[known]], touched_ids
+    ).any(axis=1)
+    changed_rows = np.flatnonzero(changed)
+    if len(changed_rows):
+        best = np.asarray(
+            (matrix[changed_rows] @ matrix.T).max(axis=0).todense()
+        ).ravel()
+        worst_kept = model['scores'][old_positions, -1]
+        affected |= known & (best > worst_kept)
+    return affected, old_positions
+
+
+def write_model(directory, model):
+    """ Записывает модель в новый каталог и переключает на него ссылку.
+
+    Старые файлы не изменяются, поэтому процессы, которые держат
+    их в памяти, дочитывают прежнюю версию.
+    """
+    os.makedirs(directory, exist_ok=True)
+    target = tempfile.mkdtemp(prefix='model-', dir=directory)
+    for name in MODEL_FILES:
+        np.save(os.path.join(target, f'{name}.npy'), model[name])
+    link = os.path.join(directory, CURRENT_LINK)
+    previous = os.path.realpath(link)
+    temporary_link = f'{link}.{os.getpid()}'
+    os.symlink(os.path.basename(target), temporary_link)
+    os.replace(temporary_link, link)
+    # Предыдущая версия остается для процессов, которые сейчас ее читают.
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith('model-') and path not in (target, previous):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def read_model(path):
+    return {
+        name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+        for name in MODEL_FILES
+    }
+
+
+def build_model(incremental=False):
+    """ Строит модель похожих рецептов и сохраняет ее.
+
+    С incremental пересчитываются только затронутые строки,
+    остальные берутся из текущей модели. Возвращает число
+    рецептов в модели и число пересчитанных строк.
+    """
+    directory = settings.RECIPE_SIMILARITY_DIR
+    top_k = settings.RECIPE_SIMILARITY_TOP_K
+    recipe_ids, matrix, fingerprints = load_features()
+    current = os.path.join(directory, CURRENT_LINK)
+    model = None
+    if incremental and os.path.exists(current):
+        model = read_model(current)
+        if model['neighbours'].shape[1] != top_k:
+            model = None
+    if model is None or not len(model['recipe_ids']):
+        rows = np.arange(len(recipe_ids))
+        neighbours, scores = top_neighbours(matrix, recipe_ids, rows, top_k)
+    else:
+        affected, old_positions = get_affected_rows(
+            matrix, recipe_ids, fingerprints, model
+        )
+        neighbours = np.array(model['neighbours'][old_positions])
+        scores = np.array(model['scores'][old_positions])
+        rows = np.flatnonzero(affected)
+        if not len(rows) and np.array_equal(
+                recipe_ids, model['recipe_ids']):
+            return len(recipe_ids), 0
+        neighbours[rows], scores[rows] = top_neighbours(
+            matrix, recipe_ids, rows, top_k
+        )
+    write_model(directory, {
+        'recipe_ids': recipe_ids,
+        'neighbours': neighbours,
+        'scores': scores,
+        'fingerprints': fingerprints,
+    })
+    similarity_index.invalidate()
+    return len(recipe_ids), len(rows)
+
+
+class SimilarityIndex:
+    """ Модель похожих рецептов, отображенная в память.
+
+    Файлы открываются через mmap, поэтому страницы общие
+    для всех процессов сервера. Не чаще раза в
+    RECIPE_SIMILARITY_CHECK_INTERVAL секунд проверяется, не
+    переключилась ли ссылка на новую модель.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._path = None
+        self._model = None
+        self._checked_at = 0
+
+    def invalidate(self):
+        self._checked_at = 0
+
+    def _load(self):
+        interval = settings.RECIPE_SIMILARITY_CHECK_INTERVAL
+        if time.monotonic() - self._checked_at < interval:
+            return self._model
+        with self._lock:
+            path = os.path.realpath(os.path.join(
+                settings.RECIPE_SIMILARITY_DIR, CURRENT_LINK
+            ))
+            if path != self._path:
+                self._model = (
+                    read_model(path) if os.path.isdir(path) else None
+                )
+                self._path = path
+            self._checked_at = time.monotonic()
+            return self._model
+
+    def similar(self, recipe_id, limit):
+        """ id похожих рецептов, самые похожие первыми. """
+        model = self._load()
+        if model is None or not len(model['recipe_ids']):
+            return []
+        position = np.searchsorted(model['recipe_ids'], recipe_id)
+        if (position == len(model['recipe_ids'])
+                or model['recipe_ids'][position] != recipe_id):
+            return []
+        neighbours = model['neighbours'][position, :limit]
+        return neighbours[neighbours >= 0].tolist()
+
+
+similarity_index = SimilarityIndex()
@@ -7,6 +7,8 @@ from users.models import User
 @admin.register(User)
 class CustomUserAdmin(UserAdmin):
     model = User
-    list_display = ('id', 'first_name', 'last_name', 'email',)
+    list_display = (
+        'id', 'first_name', 'last_name', 'email', 'recipes_count',
+    )
     search_fields = ('email', 'first_name',)
-    list_filter = ('email', 'first_name',)
+    list_filter = ('is_active', 'is_staff')
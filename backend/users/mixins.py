@@ -0,0 +1,67 @@
+from django.db import models
+
+
+class CounterFieldsMixin:
+    """ Защищает счетчики модели от перезаписи при сохранении.
+
+    Счетчики из counter_fields меняются только через F()-выражения,
+    поэтому обычный save() существующего объекта их не записывает:
+    значения в памяти могут быть устаревшими. Отложенные поля
+    тоже не записываются, чтобы save() не подгружал их из БД.
+    У объекта из БД записываются только поля, отличающиеся
+    от прочитанных; если изменений нет, пишутся все поля, кроме
+    файловых, чтобы сигналы post_save по-прежнему срабатывали.
+    """
+    counter_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def get_changed_fields(self, fields):
+        """ Поля из fields, значения которых изменились после чтения. """
+        loaded_values = getattr(self, '_loaded_values', None)
+        if loaded_values is None:
+            return list(fields)
+        return [
+            field for field in fields
+            if field.attname not in loaded_values
+            or field.get_prep_value(getattr(self, field.attname))
+            != field.get_prep_value(loaded_values[field.attname])
+        ]
+
+    def save(self, *args, **kwargs):
+        if (
+            not self._state.adding
+            and kwargs.get('update_fields') is None
+            and not kwargs.get('force_insert')
+        ):
+            deferred_fields = self.get_deferred_fields()
+            fields = [
+                field for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields
+                and field.attname not in deferred_fields
+            ]
+            changed_fields = self.get_changed_fields(fields) or [
+                field for field in fields
+                if not isinstance(field, models.FileField)
+            ]
+            kwargs['update_fields'] = [
+                field.name for field in changed_fields
+            ]
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        loaded_values = getattr(self, '_loaded_values', {})
+        deferred_fields = self.get_deferred_fields()
+        for field in self._meta.concrete_fields:
+            if field.attname in deferred_fields or (
+                update_fields is not None and field.name not in update_fields
+            ):
+                continue
+            loaded_values[field.attname] = field.get_prep_value(
+                getattr(self, field.attname)
+            )
+        self._loaded_values = loaded_values
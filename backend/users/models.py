@@ -1,10 +1,11 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
+from users.mixins import CounterFieldsMixin
 from users.validators import validate_username
 
 
-class User(AbstractUser):
+class User(CounterFieldsMixin, AbstractUser):
     """Переопределяем модель User"""
 
     username = models.CharField(
@@ -26,6 +27,19 @@ class User(AbstractUser):
         'Фамилия',
         max_length=150
     )
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов',
+        default=0,
+        editable=False
+    )
+
+    subscriptions_count = models.PositiveIntegerField(
+        'Количество подписок',
+        default=0,
+        editable=False
+    )
+
+    counter_fields = ('recipes_count', 'subscriptions_count')
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = (